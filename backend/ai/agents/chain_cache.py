@@ -0,0 +1,54 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from utils.logger import mylog
+
+
+def text_digest(text: Optional[str]) -> str:
+    """文本摘要，用于缓存 key（如参考输出）。"""
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+class ChainCache:
+    """
+    已编译 LangChain 链的有界 LRU 缓存：
+    - key 由调用方给出，通常为 (模型标识, 提示词版本, 参考输出摘要)；模型或提示词没有稳定标识时传 None，不缓存
+    - 线程安全，记录命中/未命中次数
+    """
+
+    def __init__(self, name: str, maxsize: int = 128):
+        self.name = name
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: Optional[Hashable], build: Callable[[], Any]) -> Any:
+        if key is None:
+            return build()
+        with self._lock:
+            chain = self._items.get(key)
+            if chain is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return chain
+            self.misses += 1
+        chain = build()
+        with self._lock:
+            self._items[key] = chain
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        mylog.info("[ChainCache:%s] 构建新链 size=%s hits=%s misses=%s", self.name, len(self._items), self.hits, self.misses)
+        return chain
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"name": self.name, "size": len(self._items), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
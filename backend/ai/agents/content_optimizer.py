@@ -5,6 +5,14 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_openai import ChatOpenAI
 from templates.ai_templates.content_optimize import content_optimize_prompt
+from ai.agents.chain_cache import ChainCache, text_digest
+from ai.llm.llm_factory import LLMFactory
+
+# 优化提示词为代码内置模板，版本取模板内容摘要
+CONTENT_OPTIMIZE_PROMPT_VERSION = f"static-{text_digest(content_optimize_prompt.template)}"
+
+# 已编译的内容优化链：按 (模型配置, 提示词版本) 复用
+optimize_chain_cache = ChainCache("optimize", maxsize=64)
 
 # 初始化大模型
 # headers = {
@@ -22,8 +30,13 @@ from templates.ai_templates.content_optimize import content_optimize_prompt
 # )
 
 def build_optimize_chain(llm: ChatOpenAI):
-    """构造优化内容链，外部注入 llm。"""
-    return {"original_text": RunnablePassthrough(), "article_type": RunnablePassthrough(), "user_requirements": RunnablePassthrough()} | content_optimize_prompt | llm | StrOutputParser()
+    """构造优化内容链，外部注入 llm；同一模型配置复用已编译的链。"""
+    model_identity = LLMFactory.identity(llm)
+    key = (model_identity, CONTENT_OPTIMIZE_PROMPT_VERSION) if model_identity is not None else None
+    return optimize_chain_cache.get_or_build(
+        key,
+        lambda: {"original_text": RunnablePassthrough(), "article_type": RunnablePassthrough(), "user_requirements": RunnablePassthrough()} | content_optimize_prompt | llm | StrOutputParser()
+    )
 
 # headers = {
 #     "accept": "application/json",
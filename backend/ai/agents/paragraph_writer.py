@@ -3,10 +3,16 @@ import re
 import warnings
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 from templates.ai_templates.paragraph_generate import paragraph_generate_prompt, get_paragraph_generate_prompt
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
+from ai.agents.chain_cache import ChainCache, text_digest
+from ai.llm.llm_factory import LLMFactory
+
+# 已编译的段落生成链：按 (模型配置, 提示词版本, 参考输出摘要) 复用
+paragraph_chain_cache = ChainCache("paragraph", maxsize=128)
 
 # 初始化大模型
 # headers = {
@@ -27,19 +33,31 @@ def build_paragraph_chain(llm: ChatOpenAI):
     """构造段落生成链，外部注入 llm（向后兼容）。"""
     return {"complete_title": RunnablePassthrough(), "last_para_content": RunnablePassthrough(), "titleNames": RunnablePassthrough(), "requirements": RunnablePassthrough(), "expected_titles": RunnablePassthrough()} | paragraph_generate_prompt  | llm | StrOutputParser()
 
-async def build_paragraph_chain_async(llm: ChatOpenAI, db: Optional[AsyncSession] = None, example_output: Optional[str] = None):
+async def build_paragraph_chain_async(llm: ChatOpenAI, db: Optional[AsyncSession] = None, example_output: Optional[str] = None,
+                                      prompt: Optional[PromptTemplate] = None):
     """
     异步构造段落生成链，支持从数据库读取提示词。
     
     Args:
         llm: LangChain LLM 实例
         db: 可选的数据库会话，用于从数据库读取提示词
+        prompt: 可选，调用方已获取的提示词模板（避免重复读取）
     
     Returns:
         配置好的 LangChain chain
     """
-    prompt = await get_paragraph_generate_prompt(db=db, example_output=example_output)
-    return {"complete_title": RunnablePassthrough(), "last_para_content": RunnablePassthrough(), "titleNames": RunnablePassthrough(), "requirements": RunnablePassthrough(), "expected_titles": RunnablePassthrough()} | prompt | llm | StrOutputParser()
+    if prompt is None:
+        prompt = await get_paragraph_generate_prompt(db=db, example_output=example_output)
+    prompt_version = (prompt.metadata or {}).get("prompt_version")
+    model_identity = LLMFactory.identity(llm)
+    # 模型或提示词没有稳定标识时不复用（对象 id 会被回收复用）
+    key = None
+    if model_identity is not None and prompt_version is not None:
+        key = (model_identity, prompt_version, text_digest(example_output))
+    return paragraph_chain_cache.get_or_build(
+        key,
+        lambda: {"complete_title": RunnablePassthrough(), "last_para_content": RunnablePassthrough(), "titleNames": RunnablePassthrough(), "requirements": RunnablePassthrough(), "expected_titles": RunnablePassthrough()} | prompt | llm | StrOutputParser()
+    )
 
 async def build_paragraph_chain_async_stream(llm: ChatOpenAI, db: Optional[AsyncSession] = None, example_output: Optional[str] = None):
     """
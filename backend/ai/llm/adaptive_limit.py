@@ -0,0 +1,318 @@
+"""
+模型调用自适应并发限制（AIMD）
+按上游地址（ai.llm.http_pool.upstream_key）限制同时进行的请求数，上限随上游表现自动调整：
+- 加性增：请求成功且首 token 时间、平均 token 间隔都在目标以内，并且当前并发已用到上限的一半以上时，上限增加 1/上限
+  （约每轮满并发请求增加 1）
+- 乘性减：超时、连接失败、5xx、429 时上限乘以 LLM_AIMD_BACKOFF（同一上游每秒最多减一次，避免同一波失败连续减半）
+- 延迟超出目标但未出错时保持不变
+自建 vLLM 等上游的承载能力随批处理负载变化，上限最终收敛到上游能稳定承受的并发数。
+统计与排队按进程进行（API 进程与每个 Worker 进程各自调整）；同一进程内的多个事件循环与同步调用共用同一个上限。
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from ai.llm.http_pool import upstream_key
+from config import (
+    LLM_AIMD_INITIAL_LIMIT, LLM_AIMD_MIN_LIMIT, LLM_AIMD_MAX_LIMIT, LLM_AIMD_BACKOFF,
+    LLM_AIMD_TTFT_TARGET, LLM_AIMD_ITL_TARGET, LLM_AIMD_SYNC_MAX_WAIT,
+)
+from utils.logger import mylog
+
+# 视为上游过载的异常
+_OVERLOAD_ERRORS = (
+    openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError,
+    httpx.TimeoutException, asyncio.TimeoutError,
+)
+
+
+def is_overload_error(error: BaseException) -> bool:
+    if isinstance(error, _OVERLOAD_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class AIMDLimiter:
+    """单个上游地址的自适应并发上限"""
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = LLM_AIMD_INITIAL_LIMIT,
+        min_limit: int = LLM_AIMD_MIN_LIMIT,
+        max_limit: int = LLM_AIMD_MAX_LIMIT,
+        backoff: float = LLM_AIMD_BACKOFF,
+        ttft_target: float = LLM_AIMD_TTFT_TARGET,
+        itl_target: float = LLM_AIMD_ITL_TARGET,
+    ):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.backoff = backoff
+        self.ttft_target = ttft_target
+        self.itl_target = itl_target
+        self.inflight = 0
+        self._last_decrease = 0.0
+        # 等待者：（事件循环, Future）或（None, threading.Event），按到达顺序放行
+        self._waiters: Deque[Tuple[Optional[asyncio.AbstractEventLoop], Any]] = deque()
+        self._lock = threading.Lock()
+
+    def _grant(self, loop: Optional[asyncio.AbstractEventLoop], waiter) -> None:
+        if loop is None:
+            waiter.set()
+        else:
+            loop.call_soon_threadsafe(self._resolve, waiter)
+
+    def _resolve(self, future: asyncio.Future) -> None:
+        # 放行时等待者已取消：名额交还
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(True)
+
+    def _wake(self) -> None:
+        """在锁内调用：上限允许时按顺序放行等待者（名额直接转给等待者）"""
+        while self._waiters and self.inflight < int(self.limit):
+            loop, waiter = self._waiters.popleft()
+            if loop is not None and loop.is_closed():
+                continue
+            self.inflight += 1
+            self._grant(loop, waiter)
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                return
+            future = loop.create_future()
+            entry = (loop, future)
+            self._waiters.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                # 仍在排队则直接移除；已被放行但 _resolve 尚未执行的由 _resolve 交还名额
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+            # 名额已转给本等待者（Future 已有结果）后才被取消：由这里交还
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def acquire_sync(self, max_wait: float = LLM_AIMD_SYNC_MAX_WAIT) -> bool:
+        """
+        同步占用名额，返回是否占到（调用方只在占到时 release）。
+        最多等待 max_wait 秒，超时直接放行：同步调用可能发生在事件循环线程上，无限等待会挡住正要释放名额的协程。
+        """
+        with self._lock:
+            if not self._waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            event = threading.Event()
+            entry = (None, event)
+            self._waiters.append(entry)
+        if event.wait(max_wait):
+            return True
+        with self._lock:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                mylog.warning(f"[AIMDLimiter] 上游 {self.name} 同步调用等待名额超过 {max_wait:g}s，直接放行")
+                return False
+        # 超时与放行同时发生：名额已转给本调用
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.inflight = max(0, self.inflight - 1)
+            self._wake()
+
+    def on_success(self, ttft: Optional[float], itl: Optional[float]) -> None:
+        """请求成功：延迟在目标以内且并发已接近上限时加性增"""
+        if ttft is not None and ttft > self.ttft_target:
+            return
+        if itl is not None and itl > self.itl_target:
+            return
+        with self._lock:
+            if self.inflight + 1 >= self.limit / 2 and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._wake()
+
+    def on_overload(self) -> None:
+        """超时 / 5xx / 429：乘性减"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_decrease < 1:
+                return
+            self._last_decrease = now
+            previous = self.limit
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        if int(previous) != int(self.limit):
+            mylog.warning(f"[AIMDLimiter] 上游 {self.name} 过载，并发上限 {int(previous)} -> {int(self.limit)}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"limit": round(self.limit, 2), "inflight": self.inflight, "waiting": len(self._waiters)}
+
+
+class AdaptiveLimitRegistry:
+    """按上游地址管理限制器；fork 出的子进程重新开始统计"""
+
+    def __init__(self):
+        self._limiters: Dict[str, AIMDLimiter] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str) -> AIMDLimiter:
+        key = upstream_key(base_url)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._limiters, self._pid = {}, os.getpid()
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = self._limiters[key] = AIMDLimiter(key)
+            return limiter
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {key: limiter.snapshot() for key, limiter in self._limiters.items()}
+
+
+# 全局实例
+adaptive_limits = AdaptiveLimitRegistry()
+
+
+class _LatencyProbe:
+    """记录一次流式请求的首 token 时间与平均 token 间隔"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self.count = 0
+
+    def on_chunk(self, chunk: ChatGenerationChunk) -> None:
+        if not getattr(chunk.message, "content", None):
+            return
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.count += 1
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first is None else self.first - self.start
+
+    @property
+    def itl(self) -> Optional[float]:
+        if self.count < 2:
+            return None
+        return (self.last - self.first) / (self.count - 1)
+
+
+class ConcurrencyLimitedChatModel(BaseChatModel):
+    """调用前占用上游的并发名额，结束后按延迟与错误反馈调整上限，之后原样委托给内部实例"""
+
+    inner: BaseChatModel
+    base_url: str
+
+    @property
+    def _llm_type(self) -> str:
+        return f"concurrency-limited-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def _finish(
+        self, limiter: AIMDLimiter, error: Optional[BaseException], probe: Optional[_LatencyProbe] = None,
+        held: bool = True,
+    ):
+        if error is None:
+            limiter.on_success(probe.ttft if probe else None, probe.itl if probe else None)
+        elif is_overload_error(error):
+            limiter.on_overload()
+        if held:
+            limiter.release()
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        limiter = adaptive_limits.get(self.base_url)
+        await limiter.acquire()
+        probe, error = _LatencyProbe(), None
+        try:
+            async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+                probe.on_chunk(chunk)
+                yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # 调用方提前结束（GeneratorExit / 取消）不计入成功或失败
+            if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+                limiter.release()
+            else:
+                self._finish(limiter, error, probe)
+
+    async def _agenerate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        limiter = adaptive_limits.get(self.base_url)
+        await limiter.acquire()
+        error = None
+        try:
+            return await self.inner._agenerate(messages, stop=stop, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if isinstance(error, asyncio.CancelledError):
+                limiter.release()
+            else:
+                self._finish(limiter, error)
+
+    def _stream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        limiter = adaptive_limits.get(self.base_url)
+        held = limiter.acquire_sync()
+        probe, error = _LatencyProbe(), None
+        try:
+            for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+                probe.on_chunk(chunk)
+                yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if isinstance(error, GeneratorExit):
+                if held:
+                    limiter.release()
+            else:
+                self._finish(limiter, error, probe, held=held)
+
+    def _generate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        limiter = adaptive_limits.get(self.base_url)
+        held = limiter.acquire_sync()
+        error = None
+        try:
+            return self.inner._generate(messages, stop=stop, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(limiter, error, held=held)
@@ -0,0 +1,144 @@
+"""
+模型接口 HTTP 连接池
+同一进程内每个上游地址（协议 + 主机 + 端口）共用一组客户端，由 LLMFactory 注入所有 ChatOpenAI 实例：
+- 长连接复用，TLS 握手与 TCP 建连不再计入首 token 时间
+- 连接数上限、空闲长连接数与保持时间可配置，可选 HTTP/2（需安装 h2，未安装时回退 HTTP/1.1）
+- 按进程号隔离：fork 出的 Worker 子进程丢弃继承来的客户端，重新建连
+异步客户端的连接与首次使用它的事件循环绑定；API 进程与 Worker（常驻循环，见 tasks/worker_runtime.py）都只有一个循环，
+因此按上游地址共享即可。aiohttp 会话（InsideQwenChat 使用）必须在循环内创建，按（上游地址，事件循环）缓存。
+"""
+import asyncio
+import os
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE, LLM_HTTP_KEEPALIVE_EXPIRY,
+    LLM_HTTP_CONNECT_TIMEOUT, LLM_HTTP2,
+)
+from utils.logger import mylog
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    _HTTP2_AVAILABLE = True
+except ImportError:  # 可选依赖
+    _HTTP2_AVAILABLE = False
+
+
+def upstream_key(base_url: str) -> str:
+    """上游地址：base_url 的协议 + 主机 + 端口（同一主机的不同路径共用连接）"""
+    parts = urlsplit(base_url or "")
+    if not parts.netloc:
+        return base_url or ""
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class LLMHttpPool:
+    """按上游地址共享的 HTTP 客户端"""
+
+    def __init__(
+        self,
+        max_connections: int = LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive: int = LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry: float = LLM_HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout: float = LLM_HTTP_CONNECT_TIMEOUT,
+        http2: bool = LLM_HTTP2,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # 只限制建连时间；读取不设上限（与未注入客户端时 ChatOpenAI 的行为一致）
+        self.timeout = httpx.Timeout(None, connect=connect_timeout)
+        self.http2 = http2 and _HTTP2_AVAILABLE
+        if http2 and not _HTTP2_AVAILABLE:
+            mylog.warning("[LLMHttpPool] 未安装 h2，HTTP/2 不可用，使用 HTTP/1.1")
+        self._clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._sessions: Dict[Tuple[str, int], object] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_pid(self) -> None:
+        """fork 后的子进程不复用父进程的连接；直接丢弃，不关闭（关闭会影响父进程共享的套接字）"""
+        if self._pid != os.getpid():
+            self._clients, self._async_clients, self._sessions = {}, {}, {}
+            self._pid = os.getpid()
+
+    def get_client(self, base_url: str) -> httpx.Client:
+        """同步客户端（ChatOpenAI.invoke / stream 使用）"""
+        key = upstream_key(base_url)
+        with self._lock:
+            self._check_pid()
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.Client(limits=self.limits, timeout=self.timeout, http2=self.http2)
+                self._clients[key] = client
+            return client
+
+    def get_async_client(self, base_url: str) -> httpx.AsyncClient:
+        """异步客户端（ChatOpenAI.ainvoke / astream 使用）"""
+        key = upstream_key(base_url)
+        with self._lock:
+            self._check_pid()
+            client = self._async_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+                self._async_clients[key] = client
+                mylog.info(f"[LLMHttpPool] 创建连接池: {key}, http2={self.http2}")
+            return client
+
+    def client_kwargs(self, base_url: str) -> Dict:
+        """注入 ChatOpenAI 的参数：共享客户端 + 建连超时"""
+        return {
+            "http_client": self.get_client(base_url),
+            "http_async_client": self.get_async_client(base_url),
+            "request_timeout": self.timeout,
+        }
+
+    async def get_aiohttp_session(self, base_url: str):
+        """当前事件循环内该上游地址共享的 aiohttp 会话"""
+        import aiohttp
+
+        key = (upstream_key(base_url), id(asyncio.get_running_loop()))
+        with self._lock:
+            self._check_pid()
+            session = self._sessions.get(key)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limits.max_connections or 0,
+                    keepalive_timeout=self.limits.keepalive_expiry,
+                )
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout.connect),
+                )
+                self._sessions[key] = session
+            return session
+
+    async def aclose(self) -> None:
+        """关闭全部客户端（进程退出时在事件循环中调用）；其他循环创建的 aiohttp 会话无法在此关闭，直接丢弃"""
+        loop_id = id(asyncio.get_running_loop())
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            clients, async_clients, sessions = self._clients, self._async_clients, self._sessions
+            self._clients, self._async_clients, self._sessions = {}, {}, {}
+        for client in clients.values():
+            client.close()
+        for client in async_clients.values():
+            try:
+                await client.aclose()
+            except Exception as e:
+                mylog.error(f"[LLMHttpPool] 关闭连接池失败: {e}")
+        for (_, session_loop), session in sessions.items():
+            if session_loop == loop_id:
+                await session.close()
+
+
+# 全局实例
+llm_http_pool = LLMHttpPool()
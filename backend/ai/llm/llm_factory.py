@@ -1,39 +1,163 @@
+import json
+import os
 import threading
 import time
-from typing import Optional, Dict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
+import redis
+import redis.asyncio as aioredis
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import RunnableBinding
 from langchain_openai import ChatOpenAI
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ai.llm.adaptive_limit import ConcurrencyLimitedChatModel
+from ai.llm.http_pool import llm_http_pool
+from ai.llm.rate_limit import RateLimitedChatModel
+from ai.llm.router import RoutedChatModel, HedgedChatModel
+from ai.llm.watchdog import StreamWatchdogChatModel
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD, LLM_CONFIG_CACHE_TTL,
+    LLM_RATE_DEFAULT_RPM, LLM_RATE_DEFAULT_TPM, ESTIMATE_NODE_OUTPUT_TOKENS, LLM_AIMD_ENABLED, LLM_HEDGE_ENABLED,
+)
 from models.model_config import AiModelConfig
-from services.model_config import get_model_config, get_default_model
+from services.model_config import get_model_config, get_default_model, list_group_configs
 from utils.logger import mylog
 
 
+# 模型配置变更广播频道：消息体为模型配置 ID（空串表示全部），各进程收到后清理本地的配置缓存与实例缓存
+MODEL_CONFIG_CHANNEL = "llm:model_config:invalidate"
+
+
+class _ConfigInvalidationListener:
+    """
+    后台线程订阅模型配置变更广播。按进程号启动：fork 出的 Celery Worker 子进程首次使用时各自启动。
+    订阅（含断线重连）成功时先清空一次本地缓存，断线期间错过的广播不会留下旧配置。
+    """
+
+    def __init__(self, on_invalidate: Callable[[Optional[int]], None]):
+        self.on_invalidate = on_invalidate
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # 广播用的异步客户端（配置变更发生在 API 路由中，不阻塞事件循环），按需建立连接、复用
+        self._publisher = aioredis.Redis(
+            host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD, decode_responses=True
+        )
+
+    def _client(self) -> redis.Redis:
+        return redis.Redis(
+            host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD,
+            decode_responses=True, socket_keepalive=True, health_check_interval=30,
+        )
+
+    def ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="llm-config-listener", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(MODEL_CONFIG_CHANNEL)
+                self.on_invalidate(None)
+                for message in pubsub.listen():
+                    data = message.get("data") or ""
+                    self.on_invalidate(int(data) if str(data).isdigit() else None)
+            except Exception as e:
+                mylog.error(f"[LLMFactory] 模型配置变更订阅中断，5 秒后重连: {e}")
+                time.sleep(5)
+
+    async def publish(self, model_id: Optional[int]) -> None:
+        try:
+            await self._publisher.publish(MODEL_CONFIG_CHANNEL, "" if model_id is None else str(model_id))
+        except Exception as e:
+            # 广播失败时其他进程依赖缓存 TTL 过期
+            mylog.error(f"[LLMFactory] 模型配置变更广播失败: {e}")
+
+
+def _detach(cfg):
+    """复制为不属于任何会话的对象（列表逐个复制），会话关闭或提交后读取属性不会触发数据库加载"""
+    if cfg is None:
+        return None
+    if isinstance(cfg, list):
+        return [_detach(item) for item in cfg]
+    return AiModelConfig(**{c.key: getattr(cfg, c.key) for c in AiModelConfig.__table__.columns})
+
+
 class LLMFactory:
     """
     简单的 LLM 工厂：
     - 统一使用 ChatOpenAI（OpenAI 兼容，支持自定义 base_url）
+    - 同一 base_url 的实例共享 HTTP 连接池（ai.llm.http_pool）
+    - 配置了 RPM / TPM 限额时外包一层限流（ai.llm.rate_limit），调用前排队取令牌
     - 基于 model_id 的实例缓存，带 TTL
+    - 模型配置行缓存（按 model_id / 用户默认模型 / 模型组），带 TTL；配置变更经 Redis 发布订阅通知所有 API 与 Worker 进程
+    - 配置属于模型组（model_group）时返回组路由实例 RoutedChatModel，在组内端点之间按延迟与错误率路由、失败切换
     """
 
     _cache: Dict[int, Dict] = {}
     _lock = threading.Lock()
     _ttl_seconds = 15 * 60
+    _cfg_cache: Dict[Tuple, Dict] = {}
+    _cfg_ttl_seconds = LLM_CONFIG_CACHE_TTL
+    _cfg_version = 0  # 每次失效加一，查询期间发生失效时不回填
+    _listener: Optional[_ConfigInvalidationListener] = None
 
     @classmethod
-    def _make_llm(cls, cfg: AiModelConfig) -> ChatOpenAI:
+    def _make_llm(cls, cfg: AiModelConfig) -> BaseChatModel:
         temperature = float(cfg.temperature) if cfg.temperature is not None else 0.2
-        return ChatOpenAI(
+        metadata = {"model_config_id": cfg.id, "model_config_version": str(getattr(cfg, 'updated_at', '') or '')}
+        llm = ChatOpenAI(
             temperature=temperature,
             model=cfg.model,
             openai_api_key=cfg.api_key,
             openai_api_base=cfg.base_url,
-            max_tokens=cfg.max_tokens
+            max_tokens=cfg.max_tokens,
+            **llm_http_pool.client_kwargs(cfg.base_url),
+            # 记录来源配置，供 identity() 生成缓存 key
+            metadata=metadata,
         )
+        # 首 token / token 间隔超时直接包在原始实例外，超时异常可被并发限制与模型组路由感知
+        llm = StreamWatchdogChatModel(inner=llm, model_key=cfg.id, metadata=metadata)
+        if LLM_AIMD_ENABLED:
+            # 按上游地址的自适应并发上限（在限流排队之后占用名额）
+            llm = ConcurrencyLimitedChatModel(inner=llm, base_url=cfg.base_url or "", metadata=metadata)
+        rpm = cfg.rpm_limit if getattr(cfg, 'rpm_limit', None) is not None else LLM_RATE_DEFAULT_RPM
+        tpm = cfg.tpm_limit if getattr(cfg, 'tpm_limit', None) is not None else LLM_RATE_DEFAULT_TPM
+        if rpm <= 0 and tpm <= 0:
+            return llm
+        return RateLimitedChatModel(
+            inner=llm, model_key=cfg.id, rpm=max(0, rpm), tpm=max(0, tpm),
+            output_tokens=cfg.max_tokens or ESTIMATE_NODE_OUTPUT_TOKENS, metadata=metadata,
+        )
+
+    @staticmethod
+    def identity(llm) -> Optional[str]:
+        """
+        LLM 实例的稳定标识，用于链 / 响应缓存的 key：
+        模型配置 ID + 配置更新时间 + bind 参数；非工厂创建的实例没有稳定标识，返回 None，调用方不做缓存
+        （对象 id 在实例回收后会被复用，缓存的链可能绑定到另一个模型上）。
+        """
+        bound_kwargs: Dict = {}
+        target = llm
+        while isinstance(target, RunnableBinding):
+            bound_kwargs.update(target.kwargs or {})
+            target = target.bound
+        meta = getattr(target, "metadata", None) or {}
+        if meta.get("model_config_id") is None:
+            return None
+        key = f"cfg:{meta['model_config_id']}@{meta.get('model_config_version', '')}"
+        if bound_kwargs:
+            key += ":" + json.dumps(bound_kwargs, sort_keys=True, ensure_ascii=False, default=str)
+        return key
 
     @classmethod
-    def create_llm(cls, cfg: AiModelConfig, use_cache: bool = True) -> ChatOpenAI:
+    def create_llm(cls, cfg: AiModelConfig, use_cache: bool = True) -> BaseChatModel:
         now = time.time()
         if not use_cache:
             llm = cls._make_llm(cfg)
@@ -78,17 +202,91 @@ class LLMFactory:
                 cls._cache.pop(model_id, None)
 
     @classmethod
-    async def get_llm_by_id(cls, db: AsyncSession, model_id: int) -> Optional[ChatOpenAI]:
-        cfg = await get_model_config(db, model_id)
+    def _on_invalidate(cls, model_id: Optional[int]) -> None:
+        """清理本地缓存：配置行缓存全部清空（默认模型可能随之变化），实例缓存按 model_id 清理"""
+        with cls._lock:
+            cls._cfg_version += 1
+            cls._cfg_cache.clear()
+            if model_id is None:
+                cls._cache.clear()
+            else:
+                cls._cache.pop(model_id, None)
+
+    @classmethod
+    def _get_listener(cls) -> _ConfigInvalidationListener:
+        if cls._listener is None:
+            cls._listener = _ConfigInvalidationListener(cls._on_invalidate)
+        return cls._listener
+
+    @classmethod
+    async def invalidate(cls, model_id: Optional[int] = None) -> None:
+        """模型配置变更后调用：清理本进程缓存并广播给其他进程"""
+        cls._on_invalidate(model_id)
+        await cls._get_listener().publish(model_id)
+
+    @classmethod
+    async def _cached_config(
+        cls, key: Tuple, loader: Callable[[], Awaitable[Union[AiModelConfig, List[AiModelConfig], None]]]
+    ) -> Union[AiModelConfig, List[AiModelConfig], None]:
+        """按 key 读取缓存的配置行，未命中或过期时查库（查不到也缓存，避免反复查库）"""
+        if cls._cfg_ttl_seconds <= 0:
+            return await loader()
+        cls._get_listener().ensure_started()
+        with cls._lock:
+            entry = cls._cfg_cache.get(key)
+            if entry and time.time() - entry["ts"] < cls._cfg_ttl_seconds:
+                return entry["cfg"]
+            version = cls._cfg_version
+        cfg = _detach(await loader())
+        with cls._lock:
+            if cls._cfg_version == version:
+                cls._cfg_cache[key] = {"cfg": cfg, "ts": time.time()}
+        return cfg
+
+    @classmethod
+    async def _llm_for_config(cls, db: AsyncSession, cfg: AiModelConfig) -> BaseChatModel:
+        """配置属于模型组且组内有多个端点时返回组路由实例，否则返回该配置的实例"""
+        group = getattr(cfg, "model_group", None)
+        if not group:
+            return cls.create_llm(cfg, use_cache=True)
+        members = await cls._cached_config(("group", group), lambda: list_group_configs(db, group))
+        if not members or len(members) < 2:
+            return cls.create_llm(cfg, use_cache=True)
+        version = ",".join(f"{m.id}@{getattr(m, 'updated_at', '') or ''}" for m in members)
+        return RoutedChatModel(
+            group=group,
+            endpoints=[(m.id, cls.create_llm(m, use_cache=True)) for m in members],
+            # 组内任一配置变更都会改变版本，供 identity() 生成缓存 key
+            metadata={"model_config_id": f"group:{group}", "model_config_version": version},
+        )
+
+    @staticmethod
+    def hedged(llm: BaseChatModel) -> BaseChatModel:
+        """
+        交互式接口使用的对冲版本（LLM_HEDGE_ENABLED 开启时）：模型组在组内端点之间对冲，
+        单个配置向同一配置重复发起（网关分到其他副本）；非工厂创建的实例原样返回。
+        """
+        if not LLM_HEDGE_ENABLED or llm is None:
+            return llm
+        if isinstance(llm, RoutedChatModel):
+            return HedgedChatModel(group=llm.group, endpoints=llm.endpoints, metadata=llm.metadata)
+        meta = getattr(llm, "metadata", None) or {}
+        if isinstance(meta.get("model_config_id"), int):
+            return HedgedChatModel(group=f"config:{meta['model_config_id']}", endpoints=[(meta["model_config_id"], llm)], metadata=meta)
+        return llm
+
+    @classmethod
+    async def get_llm_by_id(cls, db: AsyncSession, model_id: int) -> Optional[BaseChatModel]:
+        cfg = await cls._cached_config(("id", model_id), lambda: get_model_config(db, model_id))
         if not cfg:
             return None
         if cfg.status_cd != 'Y':
             return None
-        return cls.create_llm(cfg, use_cache=True)
+        return await cls._llm_for_config(db, cfg)
 
     @classmethod
-    async def get_default_llm(cls, db: AsyncSession, user_id: Optional[str] = None) -> Optional[ChatOpenAI]:
-        cfg = await get_default_model(db, user_id=user_id)
+    async def get_default_llm(cls, db: AsyncSession, user_id: Optional[str] = None) -> Optional[BaseChatModel]:
+        cfg = await cls._cached_config(("default", user_id), lambda: get_default_model(db, user_id=user_id))
         if not cfg:
             return None
-        return cls.create_llm(cfg, use_cache=True)
+        return await cls._llm_for_config(db, cfg)
@@ -6,6 +6,8 @@ from unittest.mock import patch
 import asyncio
 import aiohttp
 
+from ai.llm.http_pool import llm_http_pool
+
 class InsideQwenChat:
     def __init__(self, api_key, base_url, model):
         self.api_key = api_key
@@ -39,19 +41,19 @@ class InsideQwenChat:
             "n": 1
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.base_url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    async for line in response.content:
-                        decoded_line = line.decode('utf-8').replace("data: ", "")
-                        try:
-                            data = json.loads(decoded_line)
-                            if 'choices' in data and len(data['choices']) > 0 and 'delta' in data['choices'][0] and 'content' in data['choices'][0]['delta']:
-                                yield data['choices'][0]['delta']['content']
-                        except json.JSONDecodeError:
-                            pass
-                else:
-                    print("HTTP请求失败，状态码：" + str(response.status) + "，错误信息：" + await response.text())
+        session = await llm_http_pool.get_aiohttp_session(self.base_url)
+        async with session.post(self.base_url, headers=headers, json=payload) as response:
+            if response.status == 200:
+                async for line in response.content:
+                    decoded_line = line.decode('utf-8').replace("data: ", "")
+                    try:
+                        data = json.loads(decoded_line)
+                        if 'choices' in data and len(data['choices']) > 0 and 'delta' in data['choices'][0] and 'content' in data['choices'][0]['delta']:
+                            yield data['choices'][0]['delta']['content']
+                    except json.JSONDecodeError:
+                        pass
+            else:
+                print("HTTP请求失败，状态码：" + str(response.status) + "，错误信息：" + await response.text())
 
     async def inside_ainvoke_async(self, text):
         """
@@ -80,17 +82,17 @@ class InsideQwenChat:
             "n": 1
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.base_url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    try:
-                        data = await response.json()
-                        if 'choices' in data and len(data['choices']) > 0 and 'delta' in data['choices'][0] and 'content' in data['choices'][0]['delta']:
-                            return data
-                    except json.JSONDecodeError:
-                        pass
-                else:
-                    print("HTTP请求失败，状态码：" + str(response.status) + "，错误信息：" + await response.text())
+        session = await llm_http_pool.get_aiohttp_session(self.base_url)
+        async with session.post(self.base_url, headers=headers, json=payload) as response:
+            if response.status == 200:
+                try:
+                    data = await response.json()
+                    if 'choices' in data and len(data['choices']) > 0 and 'delta' in data['choices'][0] and 'content' in data['choices'][0]['delta']:
+                        return data
+                except json.JSONDecodeError:
+                    pass
+            else:
+                print("HTTP请求失败，状态码：" + str(response.status) + "，错误信息：" + await response.text())
         return None
 
 class TestQwenInside(unittest.TestCase):
@@ -0,0 +1,258 @@
+"""
+模型调用限流
+按模型配置限制每分钟请求数（RPM）与每分钟 token 数（TPM），令牌桶保存在 Redis 中，API 与所有 Worker 进程共享：
+- 每次调用前按提示词 token 数（tiktoken）+ 预估输出 token 数占用令牌，令牌不足时排队等待而不是报错
+- 排队按用户公平：每个等待者的排队标签 = max(全局虚拟时间, 该用户上一个标签) + 1，标签最小者先取令牌，
+  同一用户连续提交的大量请求不会挡住其他用户
+- 等待者需要定期续期，调用方退出（取消、进程崩溃）后其排队位置到期自动回收
+- Redis 不可用或等待超过 LLM_RATE_MAX_WAIT 秒时直接放行（交给上游与 SDK 重试处理）
+未配置限额（模型配置 rpm_limit / tpm_limit 与默认值均为 0）时不启用，LLMFactory 直接返回原始实例。
+"""
+import asyncio
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import redis
+import redis.asyncio as aioredis
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from config import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD, LLM_RATE_MAX_WAIT
+from utils.logger import mylog
+from utils.tools import compute_gpt_tokens
+
+
+# 当前调用所属用户（公平排队的依据），由任务 / 路由入口设置；未设置时归入同一个匿名用户
+llm_user: ContextVar[Optional[str]] = ContextVar("llm_user", default=None)
+
+
+def set_llm_user(user_id: Optional[str]) -> None:
+    """设置当前上下文（协程及其创建的子任务）中模型调用所属的用户"""
+    llm_user.set(str(user_id) if user_id else None)
+
+
+_RATE_LIMIT_SCRIPT = """
+local bucket, waiters, deadlines, vt = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local op, now, id = ARGV[1], tonumber(ARGV[2]), ARGV[3]
+local user, tokens = ARGV[4], tonumber(ARGV[5])
+local rpm, tpm, ttl = tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])
+
+-- 回收未续期的等待者（调用方已退出）
+for _, w in ipairs(redis.call('ZRANGEBYSCORE', deadlines, '-inf', now)) do
+  redis.call('ZREM', waiters, w)
+  redis.call('ZREM', deadlines, w)
+end
+
+if op == 'leave' then
+  redis.call('ZREM', waiters, id)
+  redis.call('ZREM', deadlines, id)
+  return 0
+end
+
+-- 入队：排队标签 = max(全局虚拟时间, 该用户上一个标签) + 1
+if not redis.call('ZSCORE', waiters, id) then
+  local g = tonumber(redis.call('HGET', vt, '*') or '0')
+  local u = tonumber(redis.call('HGET', vt, 'u:' .. user) or '0')
+  local tag = math.max(g, u) + 1
+  redis.call('HSET', vt, 'u:' .. user, tag)
+  redis.call('ZADD', waiters, tag, id)
+end
+redis.call('ZADD', deadlines, now + ttl, id)
+for _, key in ipairs({waiters, deadlines, vt}) do
+  redis.call('PEXPIRE', key, ttl * 6)
+end
+
+-- 只有排在最前的等待者可以取令牌，其余返回 -1 继续等待
+local head = redis.call('ZRANGE', waiters, 0, 0, 'WITHSCORES')
+if head[1] ~= id then return -1 end
+
+-- 按经过的时间补充令牌（桶容量为每分钟限额）
+local state = redis.call('HMGET', bucket, 'req', 'tok', 'ts')
+local req = tonumber(state[1]) or rpm
+local tok = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+if rpm > 0 then req = math.min(rpm, req + elapsed * rpm / 60000) end
+if tpm > 0 then tok = math.min(tpm, tok + elapsed * tpm / 60000) end
+-- 单次调用超过每分钟限额时按桶满放行，避免永远等不到
+local need = tokens
+if tpm > 0 then need = math.min(tokens, tpm) end
+
+local wait = 0
+if rpm > 0 and req < 1 then wait = math.max(wait, math.ceil((1 - req) * 60000 / rpm)) end
+if tpm > 0 and tok < need then wait = math.max(wait, math.ceil((need - tok) * 60000 / tpm)) end
+if wait == 0 then
+  if rpm > 0 then req = req - 1 end
+  if tpm > 0 then tok = tok - need end
+  redis.call('ZREM', waiters, id)
+  redis.call('ZREM', deadlines, id)
+  redis.call('HSET', vt, '*', head[2])
+end
+redis.call('HSET', bucket, 'req', tostring(req), 'tok', tostring(tok), 'ts', now)
+redis.call('PEXPIRE', bucket, 120000)
+return wait
+"""
+
+# 非队首等待者的轮询间隔、队首等待令牌时单次最长休眠（毫秒），等待者续期时长（毫秒）
+_POLL_MS = 100
+_MAX_SLEEP_MS = 1000
+_WAITER_TTL_MS = 10000
+
+
+def _on_event_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class LLMRateLimiter:
+    """按模型配置的 RPM / TPM 令牌桶（Redis Lua 脚本原子地排队与取令牌）"""
+
+    def __init__(self, max_wait: float = LLM_RATE_MAX_WAIT):
+        self.max_wait = max_wait
+        redis_kwargs = dict(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD, decode_responses=True)
+        # Worker 端同步调用（invoke / stream）与异步调用各一个客户端，均按需建立连接
+        self.redis_client = redis.Redis(**redis_kwargs)
+        self.async_redis_client = aioredis.Redis(**redis_kwargs)
+
+    @staticmethod
+    def _keys(model_key) -> List[str]:
+        prefix = f"llm_rate:{model_key}"
+        return [f"{prefix}:bucket", f"{prefix}:waiters", f"{prefix}:deadlines", f"{prefix}:vt"]
+
+    @staticmethod
+    def _args(op: str, waiter_id: str, user: str, tokens: int, rpm: int, tpm: int) -> list:
+        return [op, int(time.time() * 1000), waiter_id, user, int(tokens), int(rpm), int(tpm), _WAITER_TTL_MS]
+
+    @staticmethod
+    def _sleep_seconds(result: int) -> float:
+        return (_POLL_MS if result < 0 else min(result, _MAX_SLEEP_MS)) / 1000
+
+    async def acquire(self, model_key, rpm: int, tpm: int, tokens: int, user_id: Optional[str] = None) -> float:
+        """排队并占用 1 个请求与 tokens 个 token，返回等待秒数"""
+        keys = self._keys(model_key)
+        waiter_id, user = uuid.uuid4().hex, user_id or llm_user.get() or ""
+        start = time.monotonic()
+        try:
+            while True:
+                result = int(await self.async_redis_client.eval(
+                    _RATE_LIMIT_SCRIPT, len(keys), *keys, *self._args("acquire", waiter_id, user, tokens, rpm, tpm)
+                ))
+                waited = time.monotonic() - start
+                if result == 0:
+                    return waited
+                if waited >= self.max_wait:
+                    mylog.warning(f"[LLMRateLimiter] 模型 {model_key} 排队超过 {self.max_wait}s，直接放行")
+                    break
+                await asyncio.sleep(self._sleep_seconds(result))
+        except asyncio.CancelledError:
+            await asyncio.shield(self._leave_async(keys, waiter_id))
+            raise
+        except Exception as e:
+            mylog.error(f"[LLMRateLimiter] 限流失败，直接放行: {e}")
+        await self._leave_async(keys, waiter_id)
+        return time.monotonic() - start
+
+    def acquire_sync(self, model_key, rpm: int, tpm: int, tokens: int, user_id: Optional[str] = None) -> float:
+        """
+        acquire 的同步版本（invoke / stream 使用）。
+        在事件循环线程上调用时只尝试一次、不排队：休眠会冻结整个循环（应改用 ainvoke / astream）。
+        """
+        keys = self._keys(model_key)
+        waiter_id, user = uuid.uuid4().hex, user_id or llm_user.get() or ""
+        start = time.monotonic()
+        on_loop = _on_event_loop_thread()
+        try:
+            while True:
+                result = int(self.redis_client.eval(
+                    _RATE_LIMIT_SCRIPT, len(keys), *keys, *self._args("acquire", waiter_id, user, tokens, rpm, tpm)
+                ))
+                waited = time.monotonic() - start
+                if result == 0:
+                    return waited
+                if on_loop:
+                    mylog.warning(f"[LLMRateLimiter] 模型 {model_key} 在事件循环线程上同步调用，不排队直接放行")
+                    break
+                if waited >= self.max_wait:
+                    mylog.warning(f"[LLMRateLimiter] 模型 {model_key} 排队超过 {self.max_wait}s，直接放行")
+                    break
+                time.sleep(self._sleep_seconds(result))
+        except Exception as e:
+            mylog.error(f"[LLMRateLimiter] 限流失败，直接放行: {e}")
+        try:
+            self.redis_client.eval(_RATE_LIMIT_SCRIPT, len(keys), *keys, *self._args("leave", waiter_id, "", 0, 0, 0))
+        except Exception:
+            pass
+        return time.monotonic() - start
+
+    async def _leave_async(self, keys: List[str], waiter_id: str) -> None:
+        try:
+            await self.async_redis_client.eval(
+                _RATE_LIMIT_SCRIPT, len(keys), *keys, *self._args("leave", waiter_id, "", 0, 0, 0)
+            )
+        except Exception:
+            pass
+
+
+# 全局实例
+llm_rate_limiter = LLMRateLimiter()
+
+
+def estimate_request_tokens(messages: List[BaseMessage], output_tokens: int) -> int:
+    """一次调用占用的 token 数：提示词 token 数 + 预估输出 token 数"""
+    text = "\n".join(str(getattr(m, "content", "") or "") for m in messages)
+    return compute_gpt_tokens(text) + max(0, output_tokens)
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """在调用模型前按 RPM / TPM 排队取令牌，之后原样委托给内部实例"""
+
+    inner: BaseChatModel
+    model_key: int
+    rpm: int = 0
+    tpm: int = 0
+    output_tokens: int = 0  # 预估输出 token 数（模型配置 max_tokens 或默认值）
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate-limited-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_key": self.model_key, **self.inner._identifying_params}
+
+    def _tokens(self, messages: List[BaseMessage]) -> int:
+        return estimate_request_tokens(messages, self.output_tokens) if self.tpm > 0 else 0
+
+    def _log_wait(self, waited: float) -> None:
+        if waited >= 1:
+            mylog.info(f"[LLMRateLimiter] 模型 {self.model_key} 排队 {waited:.1f}s")
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        self._log_wait(await llm_rate_limiter.acquire(self.model_key, self.rpm, self.tpm, self._tokens(messages)))
+        async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+            yield chunk
+
+    async def _agenerate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        self._log_wait(await llm_rate_limiter.acquire(self.model_key, self.rpm, self.tpm, self._tokens(messages)))
+        return await self.inner._agenerate(messages, stop=stop, **kwargs)
+
+    def _stream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        self._log_wait(llm_rate_limiter.acquire_sync(self.model_key, self.rpm, self.tpm, self._tokens(messages)))
+        yield from self.inner._stream(messages, stop=stop, **kwargs)
+
+    def _generate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        self._log_wait(llm_rate_limiter.acquire_sync(self.model_key, self.rpm, self.tpm, self._tokens(messages)))
+        return self.inner._generate(messages, stop=stop, **kwargs)
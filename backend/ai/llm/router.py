@@ -0,0 +1,366 @@
+"""
+模型组路由
+同一模型组（ai_model_config.model_group 相同）的多个配置对外表现为一个模型：
+- 按端点（模型配置 ID）统计首 token 时间与错误率的指数滑动平均（EWMA）
+- 每次请求优先选择健康端点中得分最低者：首 token 时间 × (1 + 进行中请求数)；未测过的端点优先试探（同分时选进行中请求少的）
+- 错误率超过阈值的端点冷却一段时间，冷却结束后重新参与选择（一次成功即逐步恢复）
+- 首个有效内容输出之前出错时切换到下一个端点重试；已输出内容后出错直接抛出（无法无缝续写）。
+  长文按章节多次请求，某个端点异常后，后续章节自动落到其他端点
+统计数据按进程保存（API 进程与每个 Worker 进程各自统计）。
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from config import (
+    LLM_ROUTER_EWMA_ALPHA, LLM_ROUTER_ERROR_THRESHOLD, LLM_ROUTER_COOLDOWN_SECONDS,
+    LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_DEFAULT_DELAY,
+)
+from utils.logger import mylog
+
+# 每个端点保留的最近首 token 时间样本数（计算分位数用），以及样本不足时不计算分位数的下限
+_TTFT_WINDOW = 100
+_TTFT_MIN_SAMPLES = 5
+
+
+class _EndpointStats:
+    __slots__ = ("ttft", "ttft_samples", "error_rate", "inflight", "cooldown_until")
+
+    def __init__(self):
+        self.ttft: Optional[float] = None  # 首 token 时间 EWMA（秒），未测过为 None
+        self.ttft_samples: Deque[float] = deque(maxlen=_TTFT_WINDOW)
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.cooldown_until = 0.0
+
+
+class EndpointStatsRegistry:
+    """端点统计（按模型配置 ID）"""
+
+    def __init__(
+        self,
+        alpha: float = LLM_ROUTER_EWMA_ALPHA,
+        error_threshold: float = LLM_ROUTER_ERROR_THRESHOLD,
+        cooldown_seconds: float = LLM_ROUTER_COOLDOWN_SECONDS,
+    ):
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._stats: Dict[int, _EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: int) -> _EndpointStats:
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _EndpointStats()
+        return stats
+
+    def begin(self, key: int) -> None:
+        with self._lock:
+            self._get(key).inflight += 1
+
+    def end(self, key: int) -> None:
+        with self._lock:
+            stats = self._get(key)
+            stats.inflight = max(0, stats.inflight - 1)
+
+    def record_success(self, key: int, ttft: Optional[float] = None) -> None:
+        """请求成功；ttft 为首 token 时间（非流式请求不计）"""
+        with self._lock:
+            stats = self._get(key)
+            stats.error_rate *= 1 - self.alpha
+            if ttft is not None:
+                stats.ttft = ttft if stats.ttft is None else self.alpha * ttft + (1 - self.alpha) * stats.ttft
+                stats.ttft_samples.append(ttft)
+
+    def record_failure(self, key: int) -> None:
+        with self._lock:
+            stats = self._get(key)
+            stats.error_rate = self.alpha + (1 - self.alpha) * stats.error_rate
+            if stats.error_rate >= self.error_threshold:
+                stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+    def ttft_quantile(self, key: int, q: float) -> Optional[float]:
+        """最近首 token 时间的分位数；样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._get(key).ttft_samples)
+        if len(samples) < _TTFT_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def is_cooling(self, key: int) -> bool:
+        with self._lock:
+            return self._get(key).cooldown_until > time.monotonic()
+
+    def rank(self, keys: List[int]) -> List[int]:
+        """按优先级排序：健康端点按得分升序，冷却中的端点按冷却结束时间排在最后（全部冷却时仍可兜底）"""
+        now = time.monotonic()
+        with self._lock:
+            stats = {key: self._get(key) for key in keys}
+
+            def score(key: int) -> Tuple[float, int]:
+                s = stats[key]
+                return (s.ttft or 0.0) * (1 + s.inflight), s.inflight
+
+            healthy = [key for key in keys if stats[key].cooldown_until <= now]
+            cooling = [key for key in keys if stats[key].cooldown_until > now]
+            return sorted(healthy, key=score) + sorted(cooling, key=lambda key: stats[key].cooldown_until)
+
+    def snapshot(self) -> Dict[int, Dict]:
+        with self._lock:
+            return {
+                key: {"ttft": s.ttft, "error_rate": round(s.error_rate, 4), "inflight": s.inflight,
+                      "cooling": s.cooldown_until > time.monotonic()}
+                for key, s in self._stats.items()
+            }
+
+
+# 全局实例
+endpoint_stats = EndpointStatsRegistry()
+
+
+def _has_content(chunk: ChatGenerationChunk) -> bool:
+    return bool(getattr(chunk.message, "content", None))
+
+
+class RoutedChatModel(BaseChatModel):
+    """模型组：在多个 OpenAI 兼容端点之间按延迟与错误率路由，首个有效内容输出之前自动切换端点"""
+
+    group: str
+    endpoints: List[Tuple[int, BaseChatModel]]  # （模型配置 ID，实例）
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat-openai"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"group": self.group, "endpoints": [key for key, _ in self.endpoints]}
+
+    def _candidates(self) -> List[Tuple[int, BaseChatModel]]:
+        llms = dict(self.endpoints)
+        return [(key, llms[key]) for key in endpoint_stats.rank(list(llms))]
+
+    def _log_failover(self, key: int, error: Exception) -> None:
+        mylog.warning(f"[RoutedChatModel] 模型组 {self.group} 端点 {key} 请求失败，切换端点: {error}")
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        last_error: Optional[Exception] = None
+        for key, llm in self._candidates():
+            start = time.monotonic()
+            emitted = False
+            endpoint_stats.begin(key)
+            try:
+                async for chunk in llm._astream(messages, stop=stop, **kwargs):
+                    if not emitted and _has_content(chunk):
+                        emitted = True
+                        endpoint_stats.record_success(key, time.monotonic() - start)
+                    yield chunk
+                if not emitted:
+                    endpoint_stats.record_success(key, time.monotonic() - start)
+                return
+            except Exception as e:
+                endpoint_stats.record_failure(key)
+                if emitted:
+                    raise
+                self._log_failover(key, e)
+                last_error = e
+            finally:
+                endpoint_stats.end(key)
+        raise last_error or RuntimeError(f"模型组 {self.group} 没有可用端点")
+
+    async def _agenerate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        last_error: Optional[Exception] = None
+        for key, llm in self._candidates():
+            endpoint_stats.begin(key)
+            try:
+                result = await llm._agenerate(messages, stop=stop, **kwargs)
+                endpoint_stats.record_success(key)
+                return result
+            except Exception as e:
+                endpoint_stats.record_failure(key)
+                self._log_failover(key, e)
+                last_error = e
+            finally:
+                endpoint_stats.end(key)
+        raise last_error or RuntimeError(f"模型组 {self.group} 没有可用端点")
+
+    def _stream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        last_error: Optional[Exception] = None
+        for key, llm in self._candidates():
+            start = time.monotonic()
+            emitted = False
+            endpoint_stats.begin(key)
+            try:
+                for chunk in llm._stream(messages, stop=stop, **kwargs):
+                    if not emitted and _has_content(chunk):
+                        emitted = True
+                        endpoint_stats.record_success(key, time.monotonic() - start)
+                    yield chunk
+                if not emitted:
+                    endpoint_stats.record_success(key, time.monotonic() - start)
+                return
+            except Exception as e:
+                endpoint_stats.record_failure(key)
+                if emitted:
+                    raise
+                self._log_failover(key, e)
+                last_error = e
+            finally:
+                endpoint_stats.end(key)
+        raise last_error or RuntimeError(f"模型组 {self.group} 没有可用端点")
+
+    def _generate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        last_error: Optional[Exception] = None
+        for key, llm in self._candidates():
+            endpoint_stats.begin(key)
+            try:
+                result = llm._generate(messages, stop=stop, **kwargs)
+                endpoint_stats.record_success(key)
+                return result
+            except Exception as e:
+                endpoint_stats.record_failure(key)
+                self._log_failover(key, e)
+                last_error = e
+            finally:
+                endpoint_stats.end(key)
+        raise last_error or RuntimeError(f"模型组 {self.group} 没有可用端点")
+
+
+class _HedgeAttempt:
+    """一次对冲尝试：后台拉取流直到首个有效内容（或流结束），之前的块先缓存"""
+
+    def __init__(self, key: int, llm: BaseChatModel, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict):
+        self.key = key
+        self.start = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.buffer: List[ChatGenerationChunk] = []
+        self.finished = False
+        self.closed = False
+        self.stream = llm._astream(messages, stop=stop, **kwargs)
+        endpoint_stats.begin(key)
+        self.task = asyncio.ensure_future(self._until_content())
+
+    async def _until_content(self) -> None:
+        while True:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.finished = True
+                self.ttft = time.monotonic() - self.start
+                return
+            self.buffer.append(chunk)
+            if _has_content(chunk):
+                self.ttft = time.monotonic() - self.start
+                return
+
+    def error(self) -> Optional[BaseException]:
+        if self.task.cancelled():
+            return asyncio.CancelledError()
+        return self.task.exception()
+
+    async def close(self) -> None:
+        """取消尝试并关闭流（必须等拉取任务结束后再关闭，否则流仍在运行）"""
+        if self.closed:
+            return
+        self.closed = True
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        try:
+            await self.stream.aclose()
+        except Exception:
+            pass
+        endpoint_stats.end(self.key)
+
+
+class HedgedChatModel(RoutedChatModel):
+    """
+    对冲请求：主端点在其最近首 token 时间的 p90（LLM_HEDGE_QUANTILE）内没有输出有效内容时，
+    在第二个健康端点（模型组内的下一个端点；单个配置或组内无其他健康端点时为同一配置，由网关分到其他副本）
+    再发起一次相同请求，先输出有效内容者胜出，另一个立即取消。已发起的请求都失败时按模型组顺序继续切换端点。
+    只作用于流式调用；非流式调用沿用模型组的切换逻辑。
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat-openai"
+
+    def _hedge_delay(self, key: int) -> float:
+        delay = endpoint_stats.ttft_quantile(key, LLM_HEDGE_QUANTILE)
+        return max(LLM_HEDGE_MIN_DELAY, LLM_HEDGE_DEFAULT_DELAY if delay is None else delay)
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        candidates = self._candidates()
+        attempts: List[_HedgeAttempt] = []
+        winner: Optional[_HedgeAttempt] = None
+        last_error: Optional[BaseException] = None
+        hedged = False
+        hedge_deadline = 0.0
+        try:
+            while winner is None:
+                running = [a for a in attempts if not a.task.done()]
+                if not running:
+                    # 尚未发起或已发起的请求全部失败：按顺序切换到下一个端点
+                    if not candidates:
+                        raise last_error or RuntimeError(f"模型组 {self.group} 没有可用端点")
+                    key, llm = candidates.pop(0)
+                    attempts.append(_HedgeAttempt(key, llm, messages, stop, kwargs))
+                    # 新的主请求重新计时，超时后仍可再对冲一次
+                    hedged = False
+                    hedge_deadline = time.monotonic() + self._hedge_delay(key)
+                    continue
+                timeout = None if hedged else max(0.0, hedge_deadline - time.monotonic())
+                done, _ = await asyncio.wait([a.task for a in running], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    primary = running[0]
+                    if candidates and not endpoint_stats.is_cooling(candidates[0][0]):
+                        key, llm = candidates.pop(0)
+                    else:
+                        key, llm = primary.key, dict(self.endpoints)[primary.key]
+                    mylog.info(f"[HedgedChatModel] 端点 {primary.key} 未在 {self._hedge_delay(primary.key):.2f}s 内输出，对冲到端点 {key}")
+                    attempts.append(_HedgeAttempt(key, llm, messages, stop, kwargs))
+                    continue
+                for attempt in running:
+                    if attempt.task not in done:
+                        continue
+                    error = attempt.error()
+                    if error is not None:
+                        endpoint_stats.record_failure(attempt.key)
+                        self._log_failover(attempt.key, error)
+                        last_error = error
+                        await attempt.close()
+                    elif winner is None:
+                        winner = attempt
+            # 胜出者之外的请求立即取消
+            await asyncio.gather(*(a.close() for a in attempts if a is not winner))
+
+            endpoint_stats.record_success(winner.key, winner.ttft)
+            for chunk in winner.buffer:
+                yield chunk
+            if not winner.finished:
+                try:
+                    async for chunk in winner.stream:
+                        yield chunk
+                except Exception:
+                    endpoint_stats.record_failure(winner.key)
+                    raise
+        finally:
+            # 正常结束、出错或调用方提前结束：关闭全部尝试
+            await asyncio.gather(*(a.close() for a in attempts))
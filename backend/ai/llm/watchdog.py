@@ -0,0 +1,145 @@
+"""
+流式生成看门狗
+上游卡住时 astream 会一直等待，占住 Worker 槽位直到 Celery 的 task_time_limit 才被强制结束。LLMFactory 创建的实例都经过
+StreamWatchdogChatModel：
+- 首 token 超时：发出请求后 LLM_FIRST_TOKEN_TIMEOUT 秒内没有有效内容，中止本次请求并重试（最多 LLM_STREAM_RETRIES 次）
+- token 间隔超时：已输出内容后 LLM_INTER_TOKEN_TIMEOUT 秒没有新内容，中止请求（已输出内容无法无缝续写，不重试）
+重试用尽或间隔超时时抛出 LLMStreamTimeout（asyncio.TimeoutError 的子类）：模型组（ai/llm/router.py）据此切换端点，
+自适应并发限制（ai/llm/adaptive_limit.py）据此降低上游并发上限。
+每次超时计入指标：本进程计数 + Redis 哈希 llm:metrics:stream_timeouts（字段为 "类型:模型配置 ID"，各进程累计）。
+只作用于异步流式调用（astream）；同步与非流式调用原样委托。
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import redis.asyncio as aioredis
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD,
+    LLM_FIRST_TOKEN_TIMEOUT, LLM_INTER_TOKEN_TIMEOUT, LLM_STREAM_RETRIES,
+)
+from utils.logger import mylog
+
+FIRST_TOKEN = "first_token"
+INTER_TOKEN = "inter_token"
+
+
+class LLMStreamTimeout(asyncio.TimeoutError):
+    """流式生成超时（kind 为 first_token / inter_token）"""
+
+    def __init__(self, kind: str, model_key, timeout: float):
+        self.kind = kind
+        self.model_key = model_key
+        self.timeout = timeout
+        label = "首 token 超时" if kind == FIRST_TOKEN else "token 间隔超时"
+        super().__init__(f"模型 {model_key} {label}（{timeout:g}s）")
+
+
+class StreamTimeoutMetrics:
+    """流式超时计数"""
+
+    METRICS_KEY = "llm:metrics:stream_timeouts"
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.redis_client = aioredis.Redis(
+            host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD, decode_responses=True
+        )
+
+    async def record(self, kind: str, model_key) -> None:
+        field = f"{kind}:{model_key}"
+        self.counts[field] = self.counts.get(field, 0) + 1
+        try:
+            await self.redis_client.hincrby(self.METRICS_KEY, field, 1)
+        except Exception as e:
+            mylog.error(f"[StreamWatchdog] 超时指标写入失败: {e}")
+
+    async def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """各进程累计（Redis）与本进程计数"""
+        total: Dict[str, int] = {}
+        try:
+            total = {k: int(v) for k, v in (await self.redis_client.hgetall(self.METRICS_KEY)).items()}
+        except Exception as e:
+            mylog.error(f"[StreamWatchdog] 超时指标读取失败: {e}")
+        return {"total": total, "process": dict(self.counts)}
+
+
+# 全局实例
+stream_timeout_metrics = StreamTimeoutMetrics()
+
+
+def _has_content(chunk: ChatGenerationChunk) -> bool:
+    return bool(getattr(chunk.message, "content", None))
+
+
+class StreamWatchdogChatModel(BaseChatModel):
+    """为流式调用加首 token 超时与 token 间隔超时，首个有效内容之前超时自动重试"""
+
+    inner: BaseChatModel
+    model_key: Any = None
+    first_token_timeout: float = LLM_FIRST_TOKEN_TIMEOUT  # 0 表示不限制
+    inter_token_timeout: float = LLM_INTER_TOKEN_TIMEOUT  # 0 表示不限制
+    retries: int = LLM_STREAM_RETRIES
+
+    @property
+    def _llm_type(self) -> str:
+        return f"watchdog-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    async def _timed_out(self, kind: str, timeout: float, attempt: int) -> LLMStreamTimeout:
+        await stream_timeout_metrics.record(kind, self.model_key)
+        error = LLMStreamTimeout(kind, self.model_key, timeout)
+        retrying = kind == FIRST_TOKEN and attempt < self.retries
+        mylog.warning(f"[StreamWatchdog] {error}，{'重试' if retrying else '中止'}（第 {attempt + 1} 次）")
+        return error
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        for attempt in range(max(0, self.retries) + 1):
+            stream = self.inner._astream(messages, stop=stop, **kwargs)
+            # 首个有效内容之前按首 token 截止时间等待，之后按 token 间隔
+            deadline = time.monotonic() + self.first_token_timeout if self.first_token_timeout > 0 else None
+            emitted = False
+            try:
+                while True:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.TimeoutError:
+                        if emitted:
+                            raise await self._timed_out(INTER_TOKEN, self.inter_token_timeout, attempt)
+                        error = await self._timed_out(FIRST_TOKEN, self.first_token_timeout, attempt)
+                        if attempt >= self.retries:
+                            raise error
+                        break
+                    if _has_content(chunk):
+                        emitted = True
+                        deadline = time.monotonic() + self.inter_token_timeout if self.inter_token_timeout > 0 else None
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+    async def _agenerate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        return await self.inner._agenerate(messages, stop=stop, **kwargs)
+
+    def _stream(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        yield from self.inner._stream(messages, stop=stop, **kwargs)
+
+    def _generate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any
+    ) -> ChatResult:
+        return self.inner._generate(messages, stop=stop, **kwargs)
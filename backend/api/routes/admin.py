@@ -191,7 +191,11 @@ async def list_records(db: AsyncSession = Depends(get_async_db), authorization:
 
     # 查询 Solution
     if type in (None, '', 'solution'):
-        stmt = select(AiSolutionSave).where(AiSolutionSave.status_cd == 'Y')
+        # 只取列表需要的元数据列，不加载方案正文
+        stmt = select(
+            AiSolutionSave.solution_id, AiSolutionSave.solution_title,
+            AiSolutionSave.create_phone, AiSolutionSave.create_name, AiSolutionSave.create_date
+        ).where(AiSolutionSave.status_cd == 'Y')
         # 限制在当前管理员成员范围（同时兼容 create_phone 存为 user_id 的历史数据）
         if member_user:
             idents = member_allowed_idents(member_user)
@@ -219,7 +223,7 @@ async def list_records(db: AsyncSession = Depends(get_async_db), authorization:
         for c in in_time(AiSolutionSave.create_date):
             stmt = stmt.where(c)
         all_res = await db.execute(stmt)
-        sols = all_res.scalars().all()
+        sols = all_res.all()
         total += len(sols)
         items.extend([{
             "type": "solution",
@@ -314,3 +318,23 @@ async def update_system_configs(payload: List[Dict[str, str]], db: AsyncSession
     
     await db.commit()
     return json_ok()
+
+
+@router.get("/llm-stats")
+async def get_llm_stats(db: AsyncSession = Depends(get_async_db), authorization: str = Header(None), token: str = None):
+    """模型调用运行指标：流式超时次数（各进程累计）与本进程的端点统计、并发上限"""
+    tok = _extract_token(authorization, token)
+    if not tok:
+        return json_err("缺少token")
+    admin = await get_current_user(db, tok)
+    if not admin or not getattr(admin, 'is_admin', 0):
+        return json_err("无权限", 403)
+
+    from ai.llm.adaptive_limit import adaptive_limits
+    from ai.llm.router import endpoint_stats
+    from ai.llm.watchdog import stream_timeout_metrics
+    return json_ok({
+        "stream_timeouts": await stream_timeout_metrics.snapshot(),
+        "endpoints": endpoint_stats.snapshot(),
+        "concurrency_limits": adaptive_limits.snapshot(),
+    })
@@ -8,6 +8,7 @@ from datetime import datetime
 
 from config import get_async_db
 from ai.llm.llm_factory import LLMFactory
+from ai.llm.rate_limit import set_llm_user
 from models.auth import User, UserToken
 from services.model_config import list_model_configs, get_default_model
 from models.model_config import ModelConfigQuery
@@ -205,6 +206,8 @@ async def aieditor_chat_completions(req: Request, db: AsyncSession = Depends(get
             return JSONResponse(status_code=200, content=jsonable_encoder({
                 "code": 404, "type": "error", "message": "未找到可用模型，请在模型配置中添加并设为默认", "data": None
             }))
+        # 编辑器交互更看重首 token 延迟（开启对冲时生效）
+        llm = LLMFactory.hedged(llm)
 
         sys_prompt = action_prompts.get(action) or ''
         prompt = _combine_messages(messages)
@@ -212,15 +215,16 @@ async def aieditor_chat_completions(req: Request, db: AsyncSession = Depends(get
             prompt = f"{sys_prompt}\n\n---\n\n{prompt}"
 
         async def gen():
+            set_llm_user(user_id or (req.client.host if req.client else None))
             try:
                 if stream:
-                    # 使用 LangChain OpenAI 兼容客户端进行流式输出
-                    for chunk in llm.stream(prompt):
+                    # 使用 LangChain OpenAI 兼容客户端进行流式输出（异步，不阻塞事件循环）
+                    async for chunk in llm.astream(prompt):
                         text = getattr(chunk, 'content', None) or str(chunk)
                         if text:
                             yield _format_openai_sse_chunk(text)
                 else:
-                    result = llm.invoke(prompt)
+                    result = await llm.ainvoke(prompt)
                     text = getattr(result, 'content', None) or str(result)
                     # 非流式也按 OpenAI 结构一次性返回
                     payload = {
@@ -25,6 +25,7 @@ from services.model_config import (
     model_to_dict,
 )
 from ai.llm.llm_factory import LLMFactory
+from ai.llm.http_pool import llm_http_pool
 from langchain_openai import ChatOpenAI
 from models.model_config import ModelConfigCreate
 
@@ -286,6 +287,7 @@ async def verify_api(
                 openai_api_key=body.api_key,
                 openai_api_base=body.base_url,
                 max_tokens=body.max_tokens,
+                **llm_http_pool.client_kwargs(body.base_url),
             )
         else:
             if model_id:
@@ -298,7 +300,8 @@ async def verify_api(
                 }))
         # 触发一次极小请求做连通性验证
         try:
-            _ = llm.invoke("ping")  # OpenAI 兼容实现会走一个最小请求
+            # 异步调用：同步 invoke 会在事件循环线程上等待并发名额 / 限流令牌，挡住其他请求
+            _ = await llm.ainvoke("ping")  # OpenAI 兼容实现会走一个最小请求
         except Exception as e:
             msg = str(e)
             if "401" in msg or "AuthenticationError" in msg or "unauthorized" in msg.lower() or "invalid" in msg.lower():
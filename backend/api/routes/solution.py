@@ -11,16 +11,18 @@ from models.solution import (
     GenerationResponse,
     TemplateData
 )
-from services.solution import generate_article, ChapterGenerationState, generate_chapter_content
+from services.solution import generate_article, ChapterGenerationState, generate_chapter_content, optimize_content
 from ai.llm.llm_factory import LLMFactory
+from ai.llm.rate_limit import set_llm_user
 from utils.logger import mylog
+from utils.stream_coalesce import coalesce_stream
 from config import AsyncSessionLocal, get_async_db
 from fastapi import FastAPI
 from starlette.background import BackgroundTask
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, String, Integer, Text, Date, select, update
+from sqlalchemy import create_engine, Column, String, Integer, Text, Date, select, update, func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -72,12 +74,22 @@ async def generate_chapter_api(request: ChapterGenerationRequest, req: Request,
         return JSONResponse(status_code=200, content=jsonable_encoder({
             "code": 404, "type": "error", "message": "未找到可用模型，请先配置", "data": None
         }))
+    # 交互式生成更看重首 token 延迟：开启对冲时慢端点 / 慢副本上的请求会在第二个端点重复发起
+    llm = LLMFactory.hedged(llm)
 
     async def generate():
         # try:
-            async for content in generate_chapter_content(request.chapter, request.last_para_content, highest_level_title="", llm=llm, db=db):
-                yield format_sse(content)
-                await asyncio.sleep(0)  # 给予事件循环处理其他任务的机会
+            # 调用限流按用户公平排队，该接口不带用户信息，按客户端地址区分
+            set_llm_user(req.client.host if req.client else None)
+            chapter_stream = generate_chapter_content(request.chapter, request.last_para_content, highest_level_title="", llm=llm, db=db)
+            try:
+                async for content in coalesce_stream(chapter_stream):
+                    yield format_sse(content)
+                    await asyncio.sleep(0)  # 给予事件循环处理其他任务的机会
+            except Exception as e:
+                # 生成失败（超时、所有端点均失败）时明确告知前端，而不是返回空章节
+                yield format_sse(f"\n\n错误: {e}", is_end=True)
+                return
             yield format_sse("", is_end=True)
         # finally:
         #     request_in_progress[client_ip] = False
@@ -156,6 +168,7 @@ async def generate_article_api(request: ArticleGenerationRequest,db: AsyncSessio
         async with AsyncSessionLocal() as session:
             try:
                 # 在生成器内部获取 LLM，确保 session 有效
+                set_llm_user(request.userId)
                 llm = await LLMFactory.get_llm_by_id(session, request.modelId)
                 if not llm:
                     yield format_sse("未找到可用模型，请先配置", is_end=True)
@@ -163,7 +176,7 @@ async def generate_article_api(request: ArticleGenerationRequest,db: AsyncSessio
 
                 state = ChapterGenerationState(request.outline)
                 
-                async for content in generate_article(state, llm, db=session):
+                async for content in coalesce_stream(generate_article(state, llm, db=session)):
                     yield format_sse(content)
                     await asyncio.sleep(0)
                     
@@ -197,13 +210,18 @@ async def optimize_content_api(request: dict, req: Request, db: AsyncSession = D
         if not model_id:
             yield format_sse("", is_end=True)
             return
+        set_llm_user(request.get("user_id") or (req.client.host if req.client else None))
         llm = await LLMFactory.get_llm_by_id(db, int(model_id))
         if not llm:
             yield format_sse("", is_end=True)
             return
-        async for content in optimize_content(original_text, article_type, user_requirements, llm):
-            yield format_sse(content)
-            await asyncio.sleep(0)  # 给予事件循环处理其他任务的机会
+        try:
+            async for content in coalesce_stream(optimize_content(original_text, article_type, user_requirements, llm)):
+                yield format_sse(content)
+                await asyncio.sleep(0)  # 给予事件循环处理其他任务的机会
+        except Exception as e:
+            yield format_sse(f"\n\n错误: {e}", is_end=True)
+            return
         yield format_sse("", is_end=True)
     mylog.info("*"*100)
     mylog.info(f"开始优化内容: {req.client.host}")
@@ -310,29 +328,45 @@ async def ai_solution_save(save_solution: saveSolution,db: AsyncSession = Depend
         )
     
 
+# 列表查询只取元数据列，方案正文（压缩存储，体积大）在 getSolution 中按需读取
+SOLUTION_LIST_COLUMNS = (
+    AiSolutionSave.solution_id, AiSolutionSave.solution_title,
+    AiSolutionSave.create_phone, AiSolutionSave.create_name, AiSolutionSave.create_date,
+    AiSolutionSave.update_phone, AiSolutionSave.update_name, AiSolutionSave.update_date,
+    AiSolutionSave.status_cd,
+)
+
+
+def _solution_list_item(row) -> dict:
+    """列表项：元数据列转为字典，创建时间格式化为字符串"""
+    item = dict(row._mapping)
+    create_date = item.get("create_date")
+    if isinstance(create_date, str):
+        # 将字符串转换为 datetime 对象
+        create_date = datetime.fromisoformat(create_date.replace('Z', '+00:00'))
+    if create_date:
+        # 格式化日期
+        item["create_date"] = create_date.strftime("%Y-%m-%d %H:%M:%S")
+    return item
+
+
 @router.post("/querySolution")
 async def ai_solution_query(query_solution: querySolution,db: AsyncSession = Depends(get_async_db)):
     try:
 
         if query_solution.solution_title:
             # 执行查询并获取结果
-            stmt = select(AiSolutionSave).filter((AiSolutionSave.solution_title.like(f'%{query_solution.solution_title}%'))
+            stmt = select(*SOLUTION_LIST_COLUMNS).filter((AiSolutionSave.solution_title.like(f'%{query_solution.solution_title}%'))
                                                      & (AiSolutionSave.create_phone==query_solution.create_phone)
                                                       & (AiSolutionSave.status_cd=="Y")).order_by(AiSolutionSave.create_date.desc())
             # 模糊查询文章标题
             query = await db.execute(stmt)
         else:
             # 默认全查
-            stmt = select(AiSolutionSave).filter((AiSolutionSave.create_phone==query_solution.create_phone) & (AiSolutionSave.status_cd=="Y")).order_by(AiSolutionSave.create_date.desc())
+            stmt = select(*SOLUTION_LIST_COLUMNS).filter((AiSolutionSave.create_phone==query_solution.create_phone) & (AiSolutionSave.status_cd=="Y")).order_by(AiSolutionSave.create_date.desc())
             query = await db.execute(stmt)
-        results = query.scalars().all()
+        results = [_solution_list_item(row) for row in query.all()]
         solution_count = len(results)
-        for result in results:
-            if isinstance(result.create_date, str):
-                # 将字符串转换为 datetime 对象
-                result.create_date = datetime.fromisoformat(result.create_date.replace('Z', '+00:00'))
-            # 格式化日期
-            result.create_date = result.create_date.strftime("%Y-%m-%d %H:%M:%S")
         fileResults = await select_file_by_title(db, query_solution.solution_title, query_solution.create_phone)
         file_count = len(fileResults)
         for result in fileResults:
@@ -370,23 +404,16 @@ class querySolutionList(BaseModel):
 async def ai_solution_query(query_solution_list: querySolutionList,db: AsyncSession = Depends(get_async_db)):
     try:
         # 默认全查
-        stmt = select(AiSolutionSave).filter((AiSolutionSave.create_phone==query_solution_list.create_phone) & (AiSolutionSave.status_cd=="Y")).order_by(AiSolutionSave.create_date.desc())
+        condition = (AiSolutionSave.create_phone==query_solution_list.create_phone) & (AiSolutionSave.status_cd=="Y")
         # 获取总条数
-        result = await db.execute(stmt)
-        total_count = len(result.scalars().all())
+        total_count = (await db.execute(select(func.count()).select_from(AiSolutionSave).filter(condition))).scalar() or 0
         # 分页查询
         page_size = query_solution_list.pageSize
         page_number = query_solution_list.pageNum
         offset = (page_number - 1) * page_size
-        stmt = stmt.offset(offset).limit(page_size)
+        stmt = select(*SOLUTION_LIST_COLUMNS).filter(condition).order_by(AiSolutionSave.create_date.desc()).offset(offset).limit(page_size)
         result = await db.execute(stmt)
-        results = result.scalars().all()
-        for result in results:
-            if isinstance(result.create_date, str):
-                # 将字符串转换为 datetime 对象
-                result.create_date = datetime.fromisoformat(result.create_date.replace('Z', '+00:00'))
-            # 格式化日期
-            result.create_date = result.create_date.strftime("%Y-%m-%d %H:%M:%S")
+        results = [_solution_list_item(row) for row in result.all()]
         data = {
             "solutionCount": total_count,
             "solutionList": results
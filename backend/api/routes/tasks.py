@@ -2,8 +2,8 @@
 任务管理 API
 """
 import json
+import re
 import uuid
-import asyncio
 from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Request
@@ -17,8 +17,11 @@ from models.solution import ArticleGenerationRequest
 from models.templates import TemplateData
 from config import AsyncSessionLocal
 from tasks.celery_app import celery_app
-from tasks.article_tasks import generate_article_task
-from tasks.redis_stream import redis_stream_manager
+from tasks.article_tasks import dispatch_article_async, dispatch_admitted
+from tasks.redis_stream import async_redis_stream_manager, STREAM_EVENT_CANCELLED, STREAM_EVENT_ERROR, TERMINAL_STREAM_EVENTS
+from tasks.stream_hub import task_stream_hub, STREAM_EVENT_RESET
+from services.task_estimator import task_estimator, admission_controller, ADMISSION_ADMITTED, ADMISSION_REJECTED
+from utils.compression import decompress_text
 from utils.logger import mylog
 
 
@@ -47,11 +50,18 @@ async def submit_generate_article_task(
         
         outline_dict = request.outline.dict() if hasattr(request.outline, 'dict') else request.outline
         
+        # 分布式生成：一级章节不少于两个时按章节拆成子任务并行生成
+        chapters = len(outline_dict.get("children") or [])
+        parts = chapters if request.distributed and chapters >= 2 else 0
+        estimate = await task_estimator.estimate(db, outline_dict, request.modelId, distributed=bool(parts))
+        
+        # 先以排队状态落库，准入放行后再转为 pending 并分发
         task_record = AiTask(
             task_id=task_id,
             task_type="generate_article",
             user_id=request.userId,
-            status="pending",
+            model_id=request.modelId,
+            status="queued",
             progress=0,
             input_params=json.dumps(outline_dict, ensure_ascii=False),
             created_at=datetime.now()
@@ -60,17 +70,30 @@ async def submit_generate_article_task(
         db.add(task_record)
         await db.commit()
         
-        redis_stream_manager.update_task_meta(task_id, "pending", 0)
+        if parts:
+            # 子任务数先写入元信息，推送中心据此合并各子任务的输出
+            await async_redis_stream_manager.set_task_parts(task_id, parts)
+        await async_redis_stream_manager.update_task_meta(task_id, "queued", 0)
         
-        generate_article_task.delay(task_id, outline_dict, request.userId, request.modelId)
+        decision = await _admit_and_dispatch(db, task_record, outline_dict, parts, estimate)
+        if decision == ADMISSION_REJECTED:
+            return JSONResponse(
+                status_code=200,
+                content=jsonable_encoder({
+                    "code": 429,
+                    "message": task_record.error_message,
+                    "type": "error",
+                    "data": {"task_id": task_id, "estimate": estimate}
+                })
+            )
         
         return JSONResponse(
             status_code=200,
             content=jsonable_encoder({
                 "code": 200,
-                "message": "任务已提交",
+                "message": "任务已提交" if decision == ADMISSION_ADMITTED else "任务已提交，正在排队",
                 "type": "success",
-                "data": {"task_id": task_id}
+                "data": {"task_id": task_id, "status": task_record.status, "estimate": estimate}
             })
         )
     except Exception as e:
@@ -86,8 +109,34 @@ async def submit_generate_article_task(
         )
 
 
-def format_sse(data: str, is_end: bool = False) -> str:
-    """格式化 SSE 响应"""
+async def _admit_and_dispatch(db: AsyncSession, task_record: AiTask, outline_dict: dict, parts: int, estimate: dict) -> str:
+    """
+    按预估 token 数申请准入：放行则分发执行；排队则等待其他任务释放预算后由 Worker 分发；拒绝则标记任务。
+    返回准入结果（admitted / queued / rejected）
+    """
+    task_id = task_record.task_id
+    decision, admitted = await admission_controller.acquire(task_id, task_record.user_id, estimate["total_tokens"])
+    if decision == ADMISSION_ADMITTED:
+        task_record.status = "pending"
+        await db.commit()
+        await async_redis_stream_manager.update_task_meta(task_id, "pending", 0)
+        await dispatch_article_async(task_id, outline_dict, task_record.user_id, task_record.model_id, parts)
+    elif decision == ADMISSION_REJECTED:
+        error_msg = f"当前进行中的任务过多（本任务预估 {estimate['total_tokens']} tokens），请稍后再试"
+        task_record.status = "rejected"
+        task_record.error_message = error_msg
+        await db.commit()
+        await async_redis_stream_manager.update_task_meta(task_id, "rejected", 0, error_msg)
+    # 过期占用回收后放行的其他排队任务
+    await dispatch_admitted(admitted)
+    return decision
+
+
+def format_sse(data: str, is_end: bool = False, event_id: Optional[str] = None, reset: bool = False) -> str:
+    """
+    格式化 SSE 响应；event_id 为对应的 Stream 条目 ID，客户端重连时通过 Last-Event-ID 带回
+    reset 为 True 时 data 是完整结果，客户端应丢弃已收到的内容后整体替换
+    """
     response = {
         "code": 200,
         "message": "内容生成成功" if is_end else None,
@@ -95,57 +144,75 @@ def format_sse(data: str, is_end: bool = False) -> str:
         "data": data,
         "is_end": is_end
     }
-    return f"data: {json.dumps(response, ensure_ascii=False)}\n\n"
+    if reset:
+        response["reset"] = True
+    frame = f"data: {json.dumps(response, ensure_ascii=False)}\n\n"
+    if event_id:
+        frame = f"id: {event_id}\n{frame}"
+    return frame
+
+
+# Stream 条目 ID（毫秒-序号），分布式任务带子任务序号前缀
+_STREAM_ID_PATTERN = re.compile(r"^(\d+:)?\d+-\d+$")
+
+
+async def _completed_result(task_id: str) -> Optional[str]:
+    """
+    已完成任务的结果，任务未完成或不存在时返回 None
+    优先读取元信息中保存的结果（TASK_RESULT_RETENTION 为 full / compressed 时），没有时读任务表
+    """
+    meta = await async_redis_stream_manager.get_task_meta(task_id)
+    if meta and meta.get("status") == "completed" and meta.get("result"):
+        return decompress_text(meta["result"])
+    async with AsyncSessionLocal() as session:
+        task_record = await session.get(AiTask, task_id)
+        if task_record and task_record.status == "completed":
+            return task_record.result or ""
+    return None
 
 
 @router.get("/{task_id}/stream")
-async def stream_task_result(task_id: str, req: Request):
+async def stream_task_result(task_id: str, req: Request, last_event_id: Optional[str] = None):
     """
     SSE 流式输出任务结果（支持断线重连）
+    由进程内推送中心统一读取任务 Stream：先下发已有内容，之后有新内容立即推送，收到结束事件后关闭
+    每帧带 id（Stream 条目 ID）；重连时通过 Last-Event-ID 请求头或 last_event_id 参数只补发其后的内容
+    带 reset: true 的帧表示从头回放（Stream 已过期时的完整结果，或续传位置已被断点续写删除），客户端需丢弃已收到的内容
     """
+    resume_id = req.headers.get("last-event-id") or last_event_id
+    if resume_id and not _STREAM_ID_PATTERN.match(resume_id):
+        mylog.warning(f"忽略无效的 Last-Event-ID: {resume_id}")
+        resume_id = None
+    
     async def generate():
         try:
-            last_id = "0"
-            sent_count = 0
-            
-            all_messages = redis_stream_manager.read_all_content(task_id)
+            if await async_redis_stream_manager.get_last_entry(task_id) is None:
+                result = await _completed_result(task_id)
+                if result is not None:
+                    # 已完成任务的 Stream 已按保留策略过期，无法按 Last-Event-ID 补发：
+                    # 一次性下发完整结果，断线重连的客户端已有部分内容，标记 reset 让其整体替换
+                    if result or resume_id:
+                        yield format_sse(result, reset=bool(resume_id))
+                    yield format_sse("", True)
+                    return
             
-            if all_messages:
-                for msg in all_messages:
-                    content = msg.get("content", "")
-                    if content:
-                        yield format_sse(content, False)
-                        sent_count += 1
-                        last_id = msg.get("id", "0")
-            
-            meta = redis_stream_manager.get_task_meta(task_id)
-            if meta and meta.get("status") in ["completed", "failed"]:
-                yield format_sse("", True)
-                return
-            
-            while True:
-                new_messages = redis_stream_manager.read_new_content(task_id, last_id)
-                
-                if new_messages:
-                    for msg in new_messages:
-                        content = msg.get("content", "")
-                        if content:
-                            yield format_sse(content, False)
-                            sent_count += 1
-                            last_id = msg.get("id", "0")
+            async for batch in task_stream_hub.subscribe(task_id, resume_id):
+                # 一批内容条目合并为一帧，id 取其中最后一个内容条目
+                batch_id = next((item["id"] for item in reversed(batch) if item.get("id") and not item.get("event")), None)
+                content = "".join(item.get("content", "") for item in batch)
+                reset = any(item.get("event") == STREAM_EVENT_RESET for item in batch)
+                if content or reset:
+                    yield format_sse(content, False, batch_id, reset)
                 
-                meta = redis_stream_manager.get_task_meta(task_id)
-                if meta:
-                    status = meta.get("status")
-                    if status == "completed":
-                        yield format_sse("", True)
-                        break
-                    elif status == "failed":
-                        error_msg = meta.get("error_message", "任务执行失败")
-                        yield format_sse(f"\n\n错误: {error_msg}", True)
-                        break
-                
-                await asyncio.sleep(0.5)
+                for item in batch:
+                    event = item.get("event")
+                    if event == STREAM_EVENT_ERROR:
+                        error_msg = item.get("message") or "任务执行失败"
+                        yield format_sse(f"\n\n错误: {error_msg}", True, item.get("id"))
+                        return
+                    if event in TERMINAL_STREAM_EVENTS:
+                        yield format_sse("", True, item.get("id"))
+                        return
                 
         except Exception as e:
             mylog.error(f"流式输出错误: {str(e)}")
@@ -179,7 +246,7 @@ async def get_task_status(
                 })
             )
         
-        meta = redis_stream_manager.get_task_meta(task_id)
+        meta = await async_redis_stream_manager.get_task_meta(task_id)
         
         data = {
             "task_id": task_record.task_id,
@@ -196,6 +263,8 @@ async def get_task_status(
         if meta:
             data["status"] = meta.get("status", task_record.status)
             data["progress"] = meta.get("progress", task_record.progress)
+            # 正在生成的章节标题（节点边界更新）
+            data["current_section"] = meta.get("current_section")
         
         return JSONResponse(
             status_code=200,
@@ -228,12 +297,16 @@ async def get_user_tasks(
     查询用户任务列表
     """
     try:
-        stmt = select(AiTask).filter(
+        # 列表不需要结果正文与输入参数，只取元数据列
+        stmt = select(
+            AiTask.task_id, AiTask.task_type, AiTask.status, AiTask.progress,
+            AiTask.created_at, AiTask.completed_at
+        ).filter(
             AiTask.user_id == user_id
         ).order_by(AiTask.created_at.desc()).limit(50)
         
         result = await db.execute(stmt)
-        tasks = result.scalars().all()
+        tasks = result.all()
         
         task_list = []
         for task in tasks:
@@ -285,7 +358,10 @@ async def cancel_task(
             task_record.updated_at = datetime.now()
             await db.commit()
         
-        redis_stream_manager.update_task_meta(task_id, "cancelled", 0)
+        await async_redis_stream_manager.update_task_meta(task_id, "cancelled", 0)
+        await async_redis_stream_manager.write_event(task_id, STREAM_EVENT_CANCELLED)
+        # 释放预算占用（排队中的任务同时移出队列），放行后续排队任务
+        await dispatch_admitted(await admission_controller.release_async(task_id))
         
         return JSONResponse(
             status_code=200,
@@ -308,3 +384,85 @@ async def cancel_task(
             })
         )
 
+
+
+@router.post("/{task_id}/resume")
+async def resume_task(
+    task_id: str,
+    modelId: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    从检查点继续执行失败或已取消的文章生成任务（已完成的章节不会重新调用大模型）
+    """
+    try:
+        task_record = await db.get(AiTask, task_id)
+        if not task_record:
+            return JSONResponse(
+                status_code=200,
+                content=jsonable_encoder({
+                    "code": 404,
+                    "message": "任务不存在",
+                    "type": "error",
+                    "data": None
+                })
+            )
+        
+        if task_record.status not in ("failed", "cancelled", "rejected"):
+            return JSONResponse(
+                status_code=200,
+                content=jsonable_encoder({
+                    "code": 400,
+                    "message": f"任务当前状态为 {task_record.status}，仅失败、已取消或被拒绝的任务可以续写",
+                    "type": "error",
+                    "data": None
+                })
+            )
+        
+        outline_dict = json.loads(task_record.input_params or "{}")
+        meta = await async_redis_stream_manager.get_task_meta(task_id)
+        parts = (meta or {}).get("parts", 0)
+        if modelId:
+            task_record.model_id = modelId
+        estimate = await task_estimator.estimate(db, outline_dict, task_record.model_id, distributed=bool(parts))
+        
+        task_record.status = "queued"
+        task_record.error_message = None
+        task_record.updated_at = datetime.now()
+        await db.commit()
+        
+        await async_redis_stream_manager.update_task_meta(task_id, "queued", 0)
+        
+        # 分布式任务重新分发全部子任务：已完成的子任务直接跳过，其余从各自的检查点继续
+        decision = await _admit_and_dispatch(db, task_record, outline_dict, parts, estimate)
+        if decision == ADMISSION_REJECTED:
+            return JSONResponse(
+                status_code=200,
+                content=jsonable_encoder({
+                    "code": 429,
+                    "message": task_record.error_message,
+                    "type": "error",
+                    "data": {"task_id": task_id, "estimate": estimate}
+                })
+            )
+        
+        return JSONResponse(
+            status_code=200,
+            content=jsonable_encoder({
+                "code": 200,
+                "message": "任务已重新提交" if decision == ADMISSION_ADMITTED else "任务已重新提交，正在排队",
+                "type": "success",
+                "data": {"task_id": task_id, "status": task_record.status, "estimate": estimate}
+            })
+        )
+    except Exception as e:
+        mylog.error(f"续写任务失败: {str(e)}")
+        return JSONResponse(
+            status_code=200,
+            content=jsonable_encoder({
+                "code": 500,
+                "message": f"续写任务失败: {str(e)}",
+                "type": "error",
+                "data": None
+            })
+        )
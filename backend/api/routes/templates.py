@@ -15,6 +15,7 @@ from models.templates import (
 )
 from services.templates import TemplateService
 from ai.llm.llm_factory import LLMFactory
+from ai.llm.rate_limit import set_llm_user
 from utils.logger import mylog
 from pydantic import ValidationError
 from config import get_async_db
@@ -352,6 +353,7 @@ async def create_template_entry_table(request_data: TemplateCreate, db: AsyncSes
     mylog.info(f"请求数据: {request_data}")
     try:
         # === 获取用户的模型配置 ===
+        set_llm_user(request_data.userId)
         if request_data.modelId:
             llm = await LLMFactory.get_llm_by_id(db, request_data.modelId)
             if not llm:
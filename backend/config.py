@@ -93,16 +93,119 @@ CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:{REDIS_PORT}/1"
 if REDIS_PASSWORD:
     CELERY_RESULT_BACKEND = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/1"
 
+# Celery Worker 执行模式
+# prefork：每个进程一次执行一篇文章（原有行为）
+# asyncio：线程池接收任务，文章协程在进程内共享的事件循环上并发执行，单进程最多同时生成 ARTICLE_WORKER_ASYNC_CONCURRENCY 篇
+ARTICLE_WORKER_MODE = os.getenv("ARTICLE_WORKER_MODE", _cfg("worker.mode", "prefork"))
+ARTICLE_WORKER_ASYNC_CONCURRENCY = int(os.getenv("ARTICLE_WORKER_ASYNC_CONCURRENCY", str(_cfg("worker.async_concurrency", "32"))))
+
+# 文章生成调度配置
+# sequential：按大纲深度优先逐节生成（原有行为）；concurrent：同级章节并发生成，按文档顺序输出
+ARTICLE_GEN_MODE = os.getenv("ARTICLE_GEN_MODE", _cfg("generation.mode", "sequential"))
+ARTICLE_GEN_CONCURRENCY = int(os.getenv("ARTICLE_GEN_CONCURRENCY", str(_cfg("generation.concurrency", "4"))))
+# 传给下一章节的"上一章节内容"token 预算（按 tiktoken cl100k 计）
+ARTICLE_CONTEXT_TOKENS = int(os.getenv("ARTICLE_CONTEXT_TOKENS", str(_cfg("generation.context_tokens", "1500"))))
+
+# LLM 生成结果缓存（Redis，默认关闭）：相同模型配置 + 提示词版本 + 完整输入时直接回放历史结果
+LLM_RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE_ENABLED", str(_cfg("llm_cache.enabled", "false"))).lower() in ("1", "true", "yes")
+LLM_RESPONSE_CACHE_TTL = int(os.getenv("LLM_RESPONSE_CACHE_TTL", str(_cfg("llm_cache.ttl_seconds", "86400"))))
+LLM_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", str(_cfg("llm_cache.max_entries", "5000"))))
+
+# 流式输出合并：写 Redis Stream / 推 SSE 前按时间或字符数合并 token 分片（间隔为 0 表示不合并）
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv("STREAM_FLUSH_INTERVAL_MS", str(_cfg("stream.flush_interval_ms", "100"))))
+STREAM_FLUSH_MAX_CHARS = int(os.getenv("STREAM_FLUSH_MAX_CHARS", str(_cfg("stream.flush_max_chars", "256"))))
+# SSE 读取任务 Stream 时单次 XREAD 最长阻塞时间（毫秒），到期后检查任务状态再继续等待
+STREAM_READ_BLOCK_MS = int(os.getenv("STREAM_READ_BLOCK_MS", str(_cfg("stream.read_block_ms", "1000"))))
+# 异步 Redis 连接池上限（每个 SSE 连接阻塞读取时占用一个连接）
+REDIS_ASYNC_MAX_CONNECTIONS = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", str(_cfg("redis.async_max_connections", "200"))))
+# 完成任务的结果保留方式（任务表 ai_task.result 始终是完整结果的唯一权威副本）：
+# full：Stream 保留 stream_expire_days 天，元信息中保存完整结果（原有行为）
+# compressed：元信息中保存压缩后的结果，Stream 在完成后 STREAM_COMPLETED_TTL 秒过期
+# pointer：元信息中不保存结果，Stream 在完成后 STREAM_COMPLETED_TTL 秒过期，之后 SSE 从任务表读取结果
+TASK_RESULT_RETENTION = os.getenv("TASK_RESULT_RETENTION", _cfg("retention.mode", "compressed"))
+# 完成后 Stream 的保留时长（秒），供刚断线的客户端重连补发
+STREAM_COMPLETED_TTL = int(os.getenv("STREAM_COMPLETED_TTL", str(_cfg("retention.completed_stream_ttl", "3600"))))
+
+# 任务耗时预估：历史吞吐不足时的默认值
+ESTIMATE_DEFAULT_TOKENS_PER_SEC = float(os.getenv("ESTIMATE_DEFAULT_TOKENS_PER_SEC", str(_cfg("estimate.default_tokens_per_sec", "20"))))
+# 无参考输出时每个章节的默认输出 token 数、每次调用的提示词模板开销 token 数
+ESTIMATE_NODE_OUTPUT_TOKENS = int(os.getenv("ESTIMATE_NODE_OUTPUT_TOKENS", str(_cfg("estimate.node_output_tokens", "600"))))
+ESTIMATE_PROMPT_OVERHEAD_TOKENS = int(os.getenv("ESTIMATE_PROMPT_OVERHEAD_TOKENS", str(_cfg("estimate.prompt_overhead_tokens", "400"))))
+# 统计历史吞吐时每个模型取最近完成的任务数
+ESTIMATE_HISTORY_SAMPLES = int(os.getenv("ESTIMATE_HISTORY_SAMPLES", str(_cfg("estimate.history_samples", "20"))))
+
+# 任务准入控制：进行中任务的预估 token 总量上限（全局 / 单用户，0 表示不限制）
+ADMISSION_GLOBAL_TOKEN_BUDGET = int(os.getenv("ADMISSION_GLOBAL_TOKEN_BUDGET", str(_cfg("admission.global_token_budget", "0"))))
+ADMISSION_USER_TOKEN_BUDGET = int(os.getenv("ADMISSION_USER_TOKEN_BUDGET", str(_cfg("admission.user_token_budget", "0"))))
+# 超出预算时的处理：queue（排队，有任务结束后按提交顺序放行）/ reject（直接拒绝）
+ADMISSION_POLICY = os.getenv("ADMISSION_POLICY", _cfg("admission.policy", "queue"))
+# 预算占用的最长持有时间（秒），Worker 异常退出未释放时到期自动回收
+ADMISSION_LEASE_TTL = int(os.getenv("ADMISSION_LEASE_TTL", str(_cfg("admission.lease_ttl", "7200"))))
+
+# 模型接口 HTTP 连接池（同一 base_url 的所有模型实例共享）：每个 base_url 的最大连接数 / 最大空闲长连接数 / 空闲连接保持秒数
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", str(_cfg("llm_http.max_connections", "100"))))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", str(_cfg("llm_http.max_keepalive", "20"))))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", str(_cfg("llm_http.keepalive_expiry", "60"))))
+# 建连超时（秒）；读取不设上限（流式生成可能持续较长时间）
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", str(_cfg("llm_http.connect_timeout", "10"))))
+# 启用 HTTP/2（需安装 h2，未安装时回退 HTTP/1.1）
+LLM_HTTP2 = os.getenv("LLM_HTTP2", str(_cfg("llm_http.http2", "false"))).lower() in ("1", "true", "yes")
+
+# LLMFactory 模型配置行缓存时长（秒）；配置变更通过 Redis 发布订阅即时通知各进程，TTL 只兜底广播丢失的情况，0 表示不缓存
+LLM_CONFIG_CACHE_TTL = int(os.getenv("LLM_CONFIG_CACHE_TTL", str(_cfg("llm_config.cache_ttl", "300"))))
+
+# 模型组路由（ai/llm/router.py）：EWMA 平滑系数、进入冷却的错误率阈值、冷却时长（秒）
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", str(_cfg("llm_router.ewma_alpha", "0.3"))))
+LLM_ROUTER_ERROR_THRESHOLD = float(os.getenv("LLM_ROUTER_ERROR_THRESHOLD", str(_cfg("llm_router.error_threshold", "0.5"))))
+LLM_ROUTER_COOLDOWN_SECONDS = float(os.getenv("LLM_ROUTER_COOLDOWN_SECONDS", str(_cfg("llm_router.cooldown_seconds", "30"))))
+
+# 模型调用限流（ai/llm/rate_limit.py）：模型配置未设置 rpm_limit / tpm_limit 时的默认每分钟请求数 / token 数，0 表示不限制
+LLM_RATE_DEFAULT_RPM = int(os.getenv("LLM_RATE_DEFAULT_RPM", str(_cfg("llm_rate.default_rpm", "0"))))
+LLM_RATE_DEFAULT_TPM = int(os.getenv("LLM_RATE_DEFAULT_TPM", str(_cfg("llm_rate.default_tpm", "0"))))
+# 单次调用最长排队时间（秒），超过后直接放行
+LLM_RATE_MAX_WAIT = float(os.getenv("LLM_RATE_MAX_WAIT", str(_cfg("llm_rate.max_wait", "300"))))
+
+# 自适应并发限制（ai/llm/adaptive_limit.py）：按上游地址（base_url）的 AIMD 并发上限，false 表示不限制
+LLM_AIMD_ENABLED = os.getenv("LLM_AIMD_ENABLED", str(_cfg("llm_aimd.enabled", "true"))).lower() in ("1", "true", "yes")
+# 初始 / 最小 / 最大并发上限
+LLM_AIMD_INITIAL_LIMIT = int(os.getenv("LLM_AIMD_INITIAL_LIMIT", str(_cfg("llm_aimd.initial_limit", "16"))))
+LLM_AIMD_MIN_LIMIT = int(os.getenv("LLM_AIMD_MIN_LIMIT", str(_cfg("llm_aimd.min_limit", "2"))))
+LLM_AIMD_MAX_LIMIT = int(os.getenv("LLM_AIMD_MAX_LIMIT", str(_cfg("llm_aimd.max_limit", "256"))))
+# 超时 / 5xx / 429 时上限乘以该系数
+LLM_AIMD_BACKOFF = float(os.getenv("LLM_AIMD_BACKOFF", str(_cfg("llm_aimd.backoff", "0.5"))))
+# 健康延迟目标（秒）：首 token 时间、平均 token 间隔均不超过目标时才提升上限
+LLM_AIMD_TTFT_TARGET = float(os.getenv("LLM_AIMD_TTFT_TARGET", str(_cfg("llm_aimd.ttft_target", "10"))))
+LLM_AIMD_ITL_TARGET = float(os.getenv("LLM_AIMD_ITL_TARGET", str(_cfg("llm_aimd.itl_target", "0.5"))))
+# 同步调用（invoke / stream）等待名额的最长时间（秒），超过后直接放行
+LLM_AIMD_SYNC_MAX_WAIT = float(os.getenv("LLM_AIMD_SYNC_MAX_WAIT", str(_cfg("llm_aimd.sync_max_wait", "10"))))
+
+# 流式生成看门狗（ai/llm/watchdog.py）：首 token 超时 / token 间隔超时（秒），0 表示不限制；首 token 超时后的重试次数
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", str(_cfg("llm_watchdog.first_token_timeout", "60"))))
+LLM_INTER_TOKEN_TIMEOUT = float(os.getenv("LLM_INTER_TOKEN_TIMEOUT", str(_cfg("llm_watchdog.inter_token_timeout", "30"))))
+LLM_STREAM_RETRIES = int(os.getenv("LLM_STREAM_RETRIES", str(_cfg("llm_watchdog.retries", "1"))))
+
+# 对冲请求（生成章节、AiEditor 代理）：首 token 在该端点最近首 token 时间的 LLM_HEDGE_QUANTILE 分位数内未到达时，向第二个健康端点重复发起请求
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", str(_cfg("llm_hedge.enabled", "false"))).lower() in ("1", "true", "yes")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", str(_cfg("llm_hedge.quantile", "0.9"))))
+# 对冲延迟下限（秒），以及样本不足时使用的对冲延迟（秒）
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", str(_cfg("llm_hedge.min_delay", "0.5"))))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", str(_cfg("llm_hedge.default_delay", "3"))))
+
+def _create_db_engine():
+    """创建异步数据库引擎"""
+    return create_async_engine(
+        DATABASE_URL,
+        echo=False,  # 关闭 SQL 日志输出
+        pool_pre_ping=True,
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=30,
+        pool_recycle=1800
+    )
+
+
 # 创建异步数据库引擎
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,  # 关闭 SQL 日志输出
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
-    pool_timeout=30,
-    pool_recycle=1800
-)
+engine = _create_db_engine()
 
 # 创建异步会话工厂
 AsyncSessionLocal = async_sessionmaker(
@@ -112,6 +215,18 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+def reset_db_engine():
+    """
+    重建数据库引擎并让 AsyncSessionLocal 绑定到新引擎。
+    用于 Celery 子进程初始化：不复用 fork 前父进程创建的引擎及其连接池，
+    新引擎的连接在子进程自己的事件循环中建立并在任务之间复用。
+    """
+    global engine
+    engine = _create_db_engine()
+    AsyncSessionLocal.configure(bind=engine)
+    return engine
+
+
 async def get_async_db():
     """获取异步数据库会话"""
     async with AsyncSessionLocal() as session:
@@ -180,6 +180,15 @@ async def migrate_database(engine):
                                 MODIFY COLUMN create_date DATETIME NOT NULL COMMENT '创建时间'
                             """)
                         )
+                    # solution_content -> LONGBLOB（压缩存储，见 models.database.CompressedText；原文本按字节保留，读取时兼容）
+                    if 'solution_content' in cols and cols['solution_content'].lower() != 'longblob':
+                        mylog.info("修改 ai_solution_save.solution_content 为 LONGBLOB...")
+                        await session.execute(
+                            text("""
+                                ALTER TABLE ai_solution_save 
+                                MODIFY COLUMN solution_content LONGBLOB NOT NULL COMMENT '方案内容（压缩存储）'
+                            """)
+                        )
                     # update_date -> DATETIME NULL
                     if 'update_date' in cols and cols['update_date'].lower() != 'datetime':
                         mylog.info("修改 ai_solution_save.update_date 为 DATETIME...")
@@ -196,6 +205,80 @@ async def migrate_database(engine):
                 mylog.error(f"调整 ai_solution_save 表结构失败: {e}")
                 await session.rollback()
 
+            # 4) ai_task 新增 model_id / output_tokens 列（按模型统计历史生成速度，用于任务耗时预估）；result 改为 LONGBLOB 压缩存储
+            try:
+                result = await session.execute(
+                    text("""
+                        SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS 
+                        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ai_task'
+                    """)
+                )
+                cols = {row[0]: row[1] for row in result.fetchall()}
+                if 'result' in cols and cols['result'].lower() != 'longblob':
+                    mylog.info("修改 ai_task.result 为 LONGBLOB...")
+                    await session.execute(
+                        text("""
+                            ALTER TABLE ai_task 
+                            MODIFY COLUMN result LONGBLOB NULL COMMENT '生成结果（压缩存储）'
+                        """)
+                    )
+                    await session.commit()
+                if cols and 'model_id' not in cols:
+                    mylog.info("添加 ai_task.model_id 列...")
+                    await session.execute(
+                        text("""
+                            ALTER TABLE ai_task 
+                            ADD COLUMN model_id INT NULL COMMENT '使用的模型配置ID' AFTER user_id,
+                            ADD INDEX idx_model_completed (model_id, completed_at)
+                        """)
+                    )
+                    await session.commit()
+                if cols and 'output_tokens' not in cols:
+                    mylog.info("添加 ai_task.output_tokens 列...")
+                    await session.execute(
+                        text("""
+                            ALTER TABLE ai_task 
+                            ADD COLUMN output_tokens INT NULL COMMENT '结果token数' AFTER result
+                        """)
+                    )
+                    await session.commit()
+            except Exception as e:
+                mylog.error(f"调整 ai_task 表结构失败: {e}")
+                await session.rollback()
+
+            # 5) ai_model_config 新增 model_group 列（模型组路由）、rpm_limit / tpm_limit 列（调用限流）
+            try:
+                result = await session.execute(
+                    text("""
+                        SELECT COLUMN_NAME FROM information_schema.COLUMNS 
+                        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ai_model_config'
+                    """)
+                )
+                cols = {row[0] for row in result.fetchall()}
+                if cols and 'model_group' not in cols:
+                    mylog.info("添加 ai_model_config.model_group 列...")
+                    await session.execute(
+                        text("""
+                            ALTER TABLE ai_model_config 
+                            ADD COLUMN model_group VARCHAR(64) NULL COMMENT '模型组（同组配置按延迟与错误率路由）' AFTER remark,
+                            ADD INDEX ix_ai_model_config_model_group (model_group)
+                        """)
+                    )
+                    await session.commit()
+                if cols and 'rpm_limit' not in cols:
+                    mylog.info("添加 ai_model_config.rpm_limit / tpm_limit 列...")
+                    await session.execute(
+                        text("""
+                            ALTER TABLE ai_model_config 
+                            ADD COLUMN rpm_limit INT NULL COMMENT '每分钟请求数限额（空为默认值，0 不限制）' AFTER model_group,
+                            ADD COLUMN tpm_limit INT NULL COMMENT '每分钟 token 数限额（空为默认值，0 不限制）' AFTER rpm_limit
+                        """)
+                    )
+                    await session.commit()
+            except Exception as e:
+                mylog.error(f"调整 ai_model_config 表结构失败: {e}")
+                await session.rollback()
+
         except Exception as e:
             mylog.error(f"数据库迁移失败: {str(e)}")
             # 不抛出异常，避免影响应用启动
@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes.api import api_router
 from initialization import init_database
+from tasks.redis_stream import async_redis_stream_manager
+from ai.llm.http_pool import llm_http_pool
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +35,14 @@ async def on_startup():
     await init_database()
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    # 关闭异步 Redis 连接池
+    await async_redis_stream_manager.close()
+    # 关闭模型接口 HTTP 连接池
+    await llm_http_pool.aclose()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=29847)
\ No newline at end of file
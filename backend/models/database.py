@@ -2,6 +2,36 @@
 数据库基础配置
 只包含 Base 和共享的数据库配置
 """
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects.mysql import LONGBLOB
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
+
+from utils.compression import compress_blob, decompress_blob
 
 Base = declarative_base()
+
+
+class CompressedText(TypeDecorator):
+    """
+    透明压缩的长文本列（MySQL 中为 LONGBLOB）：写入时压缩并加格式标记，读取时按标记解压，
+    原 TEXT 列迁移过来的旧数据（UTF-8 原文字节）按原文读取。压缩后的列不能再做 LIKE 等文本查询。
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(LONGBLOB())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_blob(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_blob(value)
@@ -25,6 +25,11 @@ class AiModelConfig(Base):
     visible_to_users = Column(Text, nullable=True)  # 可见用户ID列表，JSON数组格式
     status_cd = Column(String(1), nullable=False, default='Y')  # Y/N
     remark = Column(String(255), nullable=True)
+    # 模型组：同组的多个配置视为同一逻辑模型，由 ai.llm.router 按延迟与错误率路由；为空表示不参与路由
+    model_group = Column(String(64), nullable=True, index=True)
+    # 每分钟请求数 / token 数限额（所有进程共享），为空时使用默认值（LLM_RATE_DEFAULT_RPM / TPM），0 表示不限制
+    rpm_limit = Column(Integer, nullable=True)
+    tpm_limit = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
@@ -44,6 +49,9 @@ class ModelConfigBase(BaseModel):
     visible_to_users: Optional[List[str]] = Field(default=None, description="可见用户ID列表")
     status_cd: Optional[Literal['Y', 'N']] = Field(default='Y')
     remark: Optional[str] = None
+    model_group: Optional[str] = Field(default=None, description="模型组，同组配置按延迟与错误率路由")
+    rpm_limit: Optional[int] = Field(default=None, ge=0, description="每分钟请求数限额，空为默认值，0 不限制")
+    tpm_limit: Optional[int] = Field(default=None, ge=0, description="每分钟 token 数限额，空为默认值，0 不限制")
 
 
 class ModelConfigCreate(ModelConfigBase):
@@ -62,6 +70,9 @@ class ModelConfigUpdate(BaseModel):
     visible_to_users: Optional[List[str]] = None
     status_cd: Optional[Literal['Y', 'N']] = None
     remark: Optional[str] = None
+    model_group: Optional[str] = None  # 空串表示移出模型组
+    rpm_limit: Optional[int] = Field(default=None, ge=0)
+    tpm_limit: Optional[int] = Field(default=None, ge=0)
 
 
 class ModelConfigQuery(BaseModel):
@@ -87,6 +98,9 @@ class ModelConfigResponse(BaseModel):
     visible_to_users: Optional[List[str]] = None
     status_cd: str
     remark: Optional[str]
+    model_group: Optional[str] = None
+    rpm_limit: Optional[int] = None
+    tpm_limit: Optional[int] = None
     created_at: datetime
     updated_at: datetime
 
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List, Any
-from sqlalchemy import Column, String, Integer, Text, DateTime
-from models.database import Base
+from sqlalchemy import Column, String, Integer, DateTime
+from models.database import Base, CompressedText
 from .templates import TemplateChild, TemplateData
 
 
@@ -13,7 +13,7 @@ class AiSolutionSave(Base):
     # 使用业务自生成主键：YYYYMMDD + 4位序列，例如 202511140001
     solution_id = Column(String(20), primary_key=True, nullable=False, comment='方案ID')
     solution_title = Column(String(255), nullable=False, comment='方案标题')
-    solution_content = Column(Text, nullable=False, comment='方案内容')
+    solution_content = Column(CompressedText, nullable=False, comment='方案内容（压缩存储）')
     create_phone = Column(String(255), comment='创建人手机号')
     create_name = Column(String(255), comment='创建人姓名')
     create_date = Column(DateTime, nullable=False, comment='创建时间')
@@ -35,6 +35,7 @@ class ArticleGenerationRequest(BaseModel):
     templateId: Optional[str] = None
     userId: Optional[str] = None
     modelId: int = Field(description="使用的模型配置ID")
+    distributed: bool = Field(False, description="是否按一级章节拆分为多个子任务在 Worker 集群上并行生成（仅异步任务接口）")
 
 
 class GenerationResponse(BaseModel):
@@ -3,7 +3,7 @@
 """
 from sqlalchemy import Column, String, Integer, Text, DateTime, Index
 from sqlalchemy.sql import func
-from models.database import Base
+from models.database import Base, CompressedText
 
 
 class AiTask(Base):
@@ -13,10 +13,12 @@ class AiTask(Base):
     task_id = Column(String(64), primary_key=True, nullable=False)
     task_type = Column(String(50), nullable=False)
     user_id = Column(String(255), nullable=True)
+    model_id = Column(Integer, nullable=True)
     status = Column(String(20), nullable=False)
     progress = Column(Integer, default=0)
     input_params = Column(Text, nullable=True)
-    result = Column(Text, nullable=True)
+    result = Column(CompressedText, nullable=True)
+    output_tokens = Column(Integer, nullable=True)  # 结果 token 数，完成时写入，供耗时预估统计
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, nullable=False, server_default=func.now())
     updated_at = Column(DateTime, nullable=True, onupdate=func.now())
@@ -24,5 +26,6 @@ class AiTask(Base):
     
     __table_args__ = (
         Index('idx_user_created', 'user_id', 'created_at'),
+        Index('idx_model_completed', 'model_id', 'completed_at'),
     )
 
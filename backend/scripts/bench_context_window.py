@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+微基准：对比 generate_outline_recursive 中两种上文累积方式在 100 个小节大纲上的耗时与峰值内存。
+
+- legacy：每层递归 `content += token`，子章节开始时取 `content[-2000:]`（原实现）
+- window：每层递归 `ContextWindow.append(token)`，子章节开始时取 `tail(token 预算)`
+
+不调用大模型，按固定大小的 token 分片模拟流式输出。
+
+用法示例：
+  cd backend && python3 scripts/bench_context_window.py --chapters 10 --sections 9 --chunks 3000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.context_window import ContextWindow  # noqa: E402
+
+
+TOKEN = "数据要素"  # 模拟单个流式分片
+
+
+def build_outline(chapters: int, sections: int):
+    """构造 chapters 个一级章节、每章 sections 个二级小节的大纲（共 chapters * (sections + 1) 个节点）"""
+    return [{"children": [{"children": []} for _ in range(sections)]} for _ in range(chapters)]
+
+
+def stream_node(chunks: int):
+    for _ in range(chunks):
+        yield TOKEN
+
+
+def legacy_walk(sink: list, nodes, chunks: int):
+    """原实现：字符串累加 + 字符切片"""
+    def recurse(node, last_para_content):
+        sink.append(len(last_para_content))
+        yield from stream_node(chunks)
+        current_content = ""
+        for child in node["children"]:
+            for token in recurse(child, current_content[-2000:] if len(current_content) > 2000 else current_content):
+                current_content += token
+                yield token
+
+    last_content = ""
+    for chapter in nodes:
+        for token in recurse(chapter, last_content[-2000:] if len(last_content) > 2000 else last_content):
+            last_content += token
+            yield token
+
+
+def window_walk(sink: list, nodes, chunks: int, max_tokens: int):
+    """新实现：有界滚动窗口 + token 预算"""
+    def recurse(node, last_para_content):
+        sink.append(len(last_para_content))
+        yield from stream_node(chunks)
+        context = ContextWindow(max_tokens)
+        for child in node["children"]:
+            for token in recurse(child, context.tail()):
+                context.append(token)
+                yield token
+
+    context = ContextWindow(max_tokens)
+    for chapter in nodes:
+        for token in recurse(chapter, context.tail()):
+            context.append(token)
+            yield token
+
+
+def run(name: str, walker, *args):
+    """先计时（不开 tracemalloc，避免干扰），再单独跑一遍统计峰值内存"""
+    sink: list = []
+    start = time.perf_counter()
+    total = 0
+    for token in walker(sink, *args):
+        total += len(token)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in walker([], *args):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<8} 耗时={elapsed * 1000:9.1f} ms  峰值内存={peak / 1024 / 1024:7.2f} MB  输出字符={total}  节点={len(sink)}")
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上文累积方式微基准")
+    parser.add_argument("--chapters", type=int, default=10, help="一级章节数")
+    parser.add_argument("--sections", type=int, default=9, help="每章二级小节数")
+    parser.add_argument("--chunks", type=int, default=3000, help="每个节点的流式分片数")
+    parser.add_argument("--tokens", type=int, default=1500, help="上文 token 预算")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    nodes = build_outline(args.chapters, args.sections)
+    print(f"大纲节点数={args.chapters * (args.sections + 1)}, 每节点分片={args.chunks}, 分片='{TOKEN}'")
+
+    legacy = min(run("legacy", legacy_walk, nodes, args.chunks) for _ in range(args.repeat))
+    window = min(run("window", window_walk, nodes, args.chunks, args.tokens) for _ in range(args.repeat))
+    print(f"耗时比(legacy/window): {legacy[0] / window[0]:.2f}x  峰值内存比(legacy/window): {legacy[1] / window[1]:.2f}x")
+    print("注：CPython 对局部变量的 `str +=` 有原地扩容优化，legacy 的耗时主要随文章长度线性增长；"
+          "window 的额外耗时来自每个子章节一次 tiktoken 编码（约 2ms），换来与文章长度无关的内存占用和按 token 计的上文预算。")
+
+
+if __name__ == "__main__":
+    main()
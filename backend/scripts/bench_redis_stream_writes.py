@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+基准：统计一篇文章写入任务 Stream 的 Redis 往返次数与命令数（改造前 vs 改造后）。
+
+- legacy：每个 token 分片 XADD + EXPIRE，每 10 个分片 HSET + EXPIRE 更新进度，结束时两次 HSET 写结果（原实现）
+- batched：coalesce_stream 合并分片 + RedisStreamWriter pipeline 写入（EXPIRE 每个 Stream 只设一次，进度随批次发送）
+
+模拟大模型按固定速率输出 token；往返次数与 Redis 实例无关，耗时只有连接真实 Redis 时才有参考意义。
+默认使用 fakeredis（需 pip install fakeredis），也可通过 --redis-url 指向真实实例。
+
+用法示例：
+  cd backend && python3 scripts/bench_redis_stream_writes.py --tokens 2000 --rate 400
+  cd backend && python3 scripts/bench_redis_stream_writes.py --redis-url redis://127.0.0.1:6379/15
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import redis  # noqa: E402
+
+from tasks.redis_stream import redis_stream_manager  # noqa: E402
+from utils.stream_coalesce import coalesce_stream  # noqa: E402
+
+
+TOKEN = "数据"  # 模拟单个流式分片
+
+
+class RoundTripCounter:
+    """包装 redis 客户端：单条命令计 1 次往返，pipeline.execute 计 1 次往返 + 栈内命令数"""
+
+    def __init__(self, client):
+        self.round_trips = 0
+        self.commands = 0
+        original_execute = client.execute_command
+        original_pipeline = client.pipeline
+
+        def execute_command(*args, **kwargs):
+            self.round_trips += 1
+            self.commands += 1
+            return original_execute(*args, **kwargs)
+
+        def pipeline(*args, **kwargs):
+            pipe = original_pipeline(*args, **kwargs)
+            original_pipe_execute = pipe.execute
+
+            def pipe_execute(*e_args, **e_kwargs):
+                if pipe.command_stack:
+                    self.round_trips += 1
+                    self.commands += len(pipe.command_stack)
+                return original_pipe_execute(*e_args, **e_kwargs)
+
+            pipe.execute = pipe_execute
+            return pipe
+
+        client.execute_command = execute_command
+        client.pipeline = pipeline
+
+    def reset(self):
+        self.round_trips = 0
+        self.commands = 0
+
+
+async def token_source(tokens: int, rate: float):
+    """按 rate token/s 产出分片"""
+    delay = 1.0 / rate if rate > 0 else 0
+    for _ in range(tokens):
+        await asyncio.sleep(delay)
+        yield TOKEN
+
+
+async def legacy_write(client, task_id: str, tokens: int, rate: float):
+    stream_key = f"task:{task_id}:stream"
+    meta_key = f"task:{task_id}:meta"
+    total_chunks = 0
+    content = ""
+    async for chunk in token_source(tokens, rate):
+        content += chunk
+        total_chunks += 1
+        client.xadd(stream_key, {"content": chunk})
+        client.expire(stream_key, timedelta(days=7))
+        if total_chunks % 10 == 0:
+            client.hset(meta_key, mapping={"status": "processing", "progress": "0", "updated_at": datetime.now().isoformat()})
+            client.expire(meta_key, timedelta(days=7))
+    client.hset(meta_key, "result", content)
+    client.hset(meta_key, "completed_at", datetime.now().isoformat())
+    client.hset(meta_key, mapping={"status": "completed", "progress": "100", "updated_at": datetime.now().isoformat()})
+    client.expire(meta_key, timedelta(days=7))
+
+
+async def batched_write(task_id: str, tokens: int, rate: float):
+    total_chunks = 0
+    content = ""
+    with redis_stream_manager.writer(task_id) as writer:
+        async for chunk in coalesce_stream(token_source(tokens, rate)):
+            content += chunk
+            total_chunks += 1
+            writer.write(chunk)
+            if total_chunks % 10 == 0:
+                writer.update_meta("processing", 0)
+            writer.flush()
+    redis_stream_manager.set_task_result(task_id, content)
+    redis_stream_manager.update_task_meta(task_id, "completed", 100)
+
+
+def make_client(url: str):
+    if url:
+        return redis.Redis.from_url(url, decode_responses=True)
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("未安装 fakeredis，请 pip install fakeredis 或通过 --redis-url 指定 Redis 实例")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务 Stream 写入往返次数基准")
+    parser.add_argument("--tokens", type=int, default=2000, help="文章 token 分片数")
+    parser.add_argument("--rate", type=float, default=400, help="模拟输出速率（token/s）")
+    parser.add_argument("--redis-url", default="", help="Redis 地址（缺省使用 fakeredis）")
+    args = parser.parse_args()
+
+    client = make_client(args.redis_url)
+    redis_stream_manager.redis_client = client
+    counter = RoundTripCounter(client)
+    print(f"分片数={args.tokens}, 速率={args.rate} token/s, Redis={'fakeredis' if not args.redis_url else args.redis_url}")
+
+    results = {}
+    for name in ("legacy", "batched"):
+        task_id = f"bench-{uuid.uuid4()}"
+        counter.reset()
+        start = time.perf_counter()
+        if name == "legacy":
+            asyncio.run(legacy_write(client, task_id, args.tokens, args.rate))
+        else:
+            asyncio.run(batched_write(task_id, args.tokens, args.rate))
+        elapsed = time.perf_counter() - start
+        entries = client.xlen(f"task:{task_id}:stream")
+        client.delete(f"task:{task_id}:stream", f"task:{task_id}:meta")
+        results[name] = counter.round_trips
+        print(f"{name:<8} 往返={counter.round_trips:6d}  命令={counter.commands:6d}  Stream 条目={entries:6d}  耗时={elapsed:6.2f}s")
+
+    print(f"往返次数比(legacy/batched): {results['legacy'] / max(1, results['batched']):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
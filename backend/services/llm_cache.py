@@ -0,0 +1,102 @@
+"""
+LLM 生成结果缓存
+相同模型配置、相同提示词版本、完全相同输入的章节生成 / 内容优化请求，直接回放缓存结果。
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import AsyncGenerator, Dict, Optional
+
+import redis.asyncio as aioredis
+
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD,
+    LLM_RESPONSE_CACHE_ENABLED, LLM_RESPONSE_CACHE_TTL, LLM_RESPONSE_CACHE_MAX_ENTRIES,
+)
+from utils.logger import mylog
+
+
+class LLMResponseCache:
+    """
+    基于 Redis 的内容寻址缓存（需配置开启）：
+    - key 为 (类型, 模型标识, 提示词版本, 完整输入) 的 sha256
+    - 每条结果带 TTL；索引 ZSET 按写入时间排序，超过条目上限时淘汰最早写入的结果
+    - 命中时按小分片回放，上层 SSE 协议保持不变
+    缓存读写失败只记录日志，不影响生成主流程。
+    读写在 SSE 路由 / Worker 的事件循环中进行，使用异步客户端，不阻塞循环。
+    """
+
+    replay_chunk_size = 24
+
+    def __init__(self):
+        self.enabled = LLM_RESPONSE_CACHE_ENABLED
+        self.ttl_seconds = LLM_RESPONSE_CACHE_TTL
+        self.max_entries = LLM_RESPONSE_CACHE_MAX_ENTRIES
+        self.redis_client = aioredis.Redis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            password=REDIS_PASSWORD,
+            decode_responses=True
+        )
+
+    def _get_entry_key(self, digest: str) -> str:
+        return f"llm_cache:{digest}"
+
+    def _get_index_key(self) -> str:
+        return "llm_cache:index"
+
+    @staticmethod
+    def make_key(kind: str, model_identity: Optional[str], prompt_version: Optional[str], inputs: Dict) -> Optional[str]:
+        """缓存 key；模型或提示词没有稳定标识时返回 None（不缓存）"""
+        if model_identity is None or prompt_version is None:
+            return None
+        payload = json.dumps(
+            {"kind": kind, "model": model_identity, "prompt": prompt_version, "inputs": inputs},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, digest: str) -> Optional[str]:
+        try:
+            text = await self.redis_client.get(self._get_entry_key(digest))
+            if text:
+                mylog.info(f"[LLMResponseCache] 命中缓存 {digest[:12]}, 长度={len(text)}")
+            return text or None
+        except Exception as e:
+            mylog.error(f"读取 LLM 结果缓存失败: {e}")
+            return None
+
+    async def set(self, digest: str, text: str) -> bool:
+        if not text:
+            return False
+        try:
+            now = time.time()
+            index_key = self._get_index_key()
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.set(self._get_entry_key(digest), text, ex=self.ttl_seconds)
+            pipe.zadd(index_key, {digest: now})
+            # 清理已按 TTL 过期的索引项
+            pipe.zremrangebyscore(index_key, "-inf", now - self.ttl_seconds)
+            pipe.zcard(index_key)
+            size = (await pipe.execute())[-1]
+            overflow = int(size) - self.max_entries
+            if overflow > 0:
+                evicted = [member for member, _ in await self.redis_client.zpopmin(index_key, overflow)]
+                if evicted:
+                    await self.redis_client.delete(*[self._get_entry_key(d) for d in evicted])
+            return True
+        except Exception as e:
+            mylog.error(f"写入 LLM 结果缓存失败: {e}")
+            return False
+
+    async def replay(self, text: str) -> AsyncGenerator[str, None]:
+        """把缓存结果切成小分片模拟流式输出"""
+        for i in range(0, len(text), self.replay_chunk_size):
+            yield text[i:i + self.replay_chunk_size]
+            await asyncio.sleep(0)
+
+
+# 全局实例
+llm_response_cache = LLMResponseCache()
@@ -28,6 +28,16 @@ def _deserialize_visible_users(data: Optional[str]) -> Optional[List[str]]:
         return None
 
 
+async def _invalidate_llm_cache(model_id: int) -> None:
+    """清理 LLMFactory 中该模型的配置与实例缓存，并广播给其他进程"""
+    try:
+        # 延迟导入以避免循环依赖
+        from ai.llm.llm_factory import LLMFactory
+        await LLMFactory.invalidate(model_id)
+    except Exception:
+        pass
+
+
 async def create_model_config(db: AsyncSession, data: ModelConfigCreate) -> AiModelConfig:
     """创建模型配置。"""
     obj = AiModelConfig(
@@ -43,6 +53,9 @@ async def create_model_config(db: AsyncSession, data: ModelConfigCreate) -> AiMo
         visible_to_users=_serialize_visible_users(data.visible_to_users),
         status_cd=data.status_cd or 'Y',
         remark=data.remark,
+        model_group=data.model_group or None,
+        rpm_limit=data.rpm_limit,
+        tpm_limit=data.tpm_limit,
     )
     db.add(obj)
     await db.commit()
@@ -51,6 +64,8 @@ async def create_model_config(db: AsyncSession, data: ModelConfigCreate) -> AiMo
     # 如果设置了默认，则取消同用户其他默认
     if obj.is_default:
         await _unset_others_default(db, obj)
+        # 默认模型发生变化，清理缓存的默认配置
+        await _invalidate_llm_cache(obj.id)
 
     return obj
 
@@ -61,6 +76,15 @@ async def get_model_config(db: AsyncSession, model_id: int) -> Optional[AiModelC
     return res.scalar_one_or_none()
 
 
+async def list_group_configs(db: AsyncSession, model_group: str) -> List[AiModelConfig]:
+    """模型组内的全部启用配置（按 ID 排序）"""
+    stmt = select(AiModelConfig).where(
+        AiModelConfig.model_group == model_group, AiModelConfig.status_cd == 'Y'
+    ).order_by(AiModelConfig.id)
+    res = await db.execute(stmt)
+    return list(res.scalars().all())
+
+
 async def list_model_configs(db: AsyncSession, q: ModelConfigQuery) -> Tuple[List[AiModelConfig], int]:
     stmt = select(AiModelConfig)
     if q.status_cd:
@@ -110,6 +134,12 @@ async def update_model_config(db: AsyncSession, model_id: int, data: ModelConfig
         obj.status_cd = data.status_cd
     if data.remark is not None:
         obj.remark = data.remark
+    if data.model_group is not None:
+        obj.model_group = data.model_group or None
+    if data.rpm_limit is not None:
+        obj.rpm_limit = data.rpm_limit
+    if data.tpm_limit is not None:
+        obj.tpm_limit = data.tpm_limit
 
     await db.commit()
     await db.refresh(obj)
@@ -118,13 +148,8 @@ async def update_model_config(db: AsyncSession, model_id: int, data: ModelConfig
     if obj.is_default:
         await _unset_others_default(db, obj)
 
-    # 配置更新后清理对应模型的缓存，确保新配置（base_url/api_key 等）立即生效
-    try:
-        # 延迟导入以避免循环依赖
-        from ai.llm.llm_factory import LLMFactory
-        LLMFactory.clear_cache(model_id)
-    except Exception:
-        pass
+    # 配置更新后清理对应模型的缓存（并广播给其他进程），确保新配置（base_url/api_key 等）立即生效
+    await _invalidate_llm_cache(model_id)
 
     return obj
 
@@ -137,11 +162,7 @@ async def delete_model_config(db: AsyncSession, model_id: int) -> bool:
     obj.is_default = False
     await db.commit()
     # 清理缓存
-    try:
-        from ai.llm.llm_factory import LLMFactory
-        LLMFactory.clear_cache(model_id)
-    except Exception:
-        pass
+    await _invalidate_llm_cache(model_id)
     return True
 
 
@@ -154,11 +175,7 @@ async def set_default_model(db: AsyncSession, model_id: int) -> Optional[AiModel
     await _unset_others_default(db, obj)
     await db.refresh(obj)
     # 清理缓存，避免仍使用旧默认
-    try:
-        from ai.llm.llm_factory import LLMFactory
-        LLMFactory.clear_cache(model_id)
-    except Exception:
-        pass
+    await _invalidate_llm_cache(model_id)
     return obj
 
 
@@ -256,6 +273,9 @@ async def list_visible_models(
             'visible_to_users': _deserialize_visible_users(row.visible_to_users),
             'status_cd': row.status_cd,
             'remark': row.remark,
+            'model_group': row.model_group,
+            'rpm_limit': row.rpm_limit,
+            'tpm_limit': row.tpm_limit,
             'created_at': row.created_at,
             'updated_at': row.updated_at,
         }
@@ -280,6 +300,9 @@ def model_to_dict(row: AiModelConfig) -> dict:
         'visible_to_users': _deserialize_visible_users(row.visible_to_users),
         'status_cd': row.status_cd,
         'remark': row.remark,
+        'model_group': row.model_group,
+        'rpm_limit': row.rpm_limit,
+        'tpm_limit': row.tpm_limit,
         'created_at': row.created_at,
         'updated_at': row.updated_at,
     }
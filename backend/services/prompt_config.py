@@ -1,4 +1,9 @@
-from typing import List, Optional, Tuple
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.prompts import PromptTemplate
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -7,6 +12,84 @@ from models.prompt_config import (
     PromptConfigCreate,
     PromptConfigUpdate,
 )
+from utils.logger import mylog
+
+
+def _digest(text: Optional[str]) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:12]
+
+
+class PromptRegistry:
+    """
+    进程内提示词缓存：
+    - 按 prompt_type 缓存数据库中的提示词内容与版本号，带 TTL（兜底其他进程的修改）
+    - 按 (prompt_type, 版本号, 示例输出摘要) 缓存解析后的 PromptTemplate，LRU 有界
+    - 本进程内通过本模块增删改提示词时立即失效对应类型
+    版本号由记录 ID 与内容摘要组成，内容变化即版本变化。
+    """
+
+    _contents: Dict[str, Dict] = {}
+    _templates: "OrderedDict[tuple, PromptTemplate]" = OrderedDict()
+    _lock = threading.Lock()
+    _ttl_seconds = 60
+    _max_templates = 256
+
+    @classmethod
+    async def get_content(cls, db: Optional[AsyncSession], prompt_type: str, default_content: str) -> Tuple[str, str]:
+        """返回 (提示词内容, 版本号)；无 db 或数据库中不存在时返回默认提示词。"""
+        if not db:
+            return default_content, f"default-{_digest(default_content)}"
+        now = time.time()
+        with cls._lock:
+            entry = cls._contents.get(prompt_type)
+            if entry and now - entry["ts"] < cls._ttl_seconds:
+                return entry["content"], entry["version"]
+        try:
+            prompt_config = await get_prompt_by_type(db, prompt_type)
+        except Exception as e:
+            # 读取失败时本次使用默认提示词，不写缓存，下次重试
+            mylog.error(f"❌ 数据库读取提示词失败({prompt_type}): {str(e)}")
+            return default_content, f"default-{_digest(default_content)}"
+        if prompt_config:
+            content = prompt_config.prompt_content
+            version = f"{prompt_config.id}-{_digest(content)}"
+            mylog.info(f"📝 [提示词] {prompt_type} 来源: 数据库(ID:{prompt_config.id}), 长度: {len(content)}字符")
+        else:
+            content = default_content
+            version = f"default-{_digest(content)}"
+            mylog.warning(f"⚠️ 数据库中未找到 {prompt_type}，使用默认提示词")
+        with cls._lock:
+            cls._contents[prompt_type] = {"content": content, "version": version, "ts": now}
+        return content, version
+
+    @classmethod
+    def get_template(cls, prompt_type: str, version: str, example_output: Optional[str],
+                     build: Callable[[], PromptTemplate]) -> PromptTemplate:
+        """按版本与示例输出获取已解析的模板，未命中时调用 build 解析并缓存。"""
+        key = (prompt_type, version, _digest(example_output))
+        with cls._lock:
+            template = cls._templates.get(key)
+            if template is not None:
+                cls._templates.move_to_end(key)
+                return template
+        template = build()
+        template.metadata = {**(template.metadata or {}), "prompt_type": prompt_type, "prompt_version": version}
+        with cls._lock:
+            cls._templates[key] = template
+            while len(cls._templates) > cls._max_templates:
+                cls._templates.popitem(last=False)
+        return template
+
+    @classmethod
+    def invalidate(cls, prompt_type: Optional[str] = None) -> None:
+        with cls._lock:
+            if prompt_type is None:
+                cls._contents.clear()
+                cls._templates.clear()
+                return
+            cls._contents.pop(prompt_type, None)
+            for key in [k for k in cls._templates if k[0] == prompt_type]:
+                cls._templates.pop(key, None)
 
 
 async def create_prompt_config(db: AsyncSession, data: PromptConfigCreate) -> AiPromptConfig:
@@ -19,6 +102,7 @@ async def create_prompt_config(db: AsyncSession, data: PromptConfigCreate) -> Ai
     db.add(obj)
     await db.commit()
     await db.refresh(obj)
+    PromptRegistry.invalidate(obj.prompt_type)
     return obj
 
 
@@ -59,6 +143,7 @@ async def update_prompt_config(db: AsyncSession, prompt_id: int, data: PromptCon
 
     await db.commit()
     await db.refresh(obj)
+    PromptRegistry.invalidate(obj.prompt_type)
     return obj
 
 
@@ -75,6 +160,7 @@ async def update_prompt_by_type(db: AsyncSession, prompt_type: str, data: Prompt
 
     await db.commit()
     await db.refresh(obj)
+    PromptRegistry.invalidate(obj.prompt_type)
     return obj
 
 
@@ -85,5 +171,6 @@ async def delete_prompt_config(db: AsyncSession, prompt_id: int) -> bool:
         return False
     obj.status_cd = 'N'
     await db.commit()
+    PromptRegistry.invalidate(obj.prompt_type)
     return True
 
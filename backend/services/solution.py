@@ -4,15 +4,20 @@ import logging  # 导入 logging 模块
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from ai.agents.paragraph_writer import build_paragraph_chain
-from ai.agents.content_optimizer import build_optimize_chain
+from ai.agents.content_optimizer import build_optimize_chain, CONTENT_OPTIMIZE_PROMPT_VERSION
 from ai.llm.llm_factory import LLMFactory
-from typing import List, Dict, Any, AsyncGenerator, Optional, Union
+from ai.llm.watchdog import LLMStreamTimeout
+from typing import List, Dict, Any, AsyncGenerator, Optional, Union, Callable, Tuple
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import asyncio
+import contextlib
 from utils.logger import mylog
 from models.templates import TemplateChild as OutlineItem  # 从templates.py导入OutlineItem
+from config import AsyncSessionLocal, ARTICLE_GEN_MODE, ARTICLE_GEN_CONCURRENCY, ARTICLE_CONTEXT_TOKENS
+from utils.context_window import ContextWindow
+from services.llm_cache import llm_response_cache
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -103,6 +108,53 @@ def generate_markdown_title(title: str, level: int, numbering: str) -> str:
         return f"{hashes} {numbering} {title}\n\n"
 
 
+# 检查点：无子章节时根节点正文的路径；其余节点以编号（如 "1"、"1.2"）为路径
+ROOT_CHECKPOINT_PATH = "root"
+
+# 节点正文完成回调：(节点路径, 节点正文)，在该节点正文及其后的换行都已产出之后调用
+NodeDoneCallback = Callable[[str, str], None]
+
+
+def outline_nodes(outline: OutlineItem) -> List[Tuple[str, OutlineItem]]:
+    """按文档顺序列出大纲各节点的（检查点路径，节点），与 generate_article 的输出顺序一致"""
+    root_children = getattr(outline, "children", None) or []
+    if not root_children:
+        return [(ROOT_CHECKPOINT_PATH, outline)]
+
+    nodes: List[Tuple[str, OutlineItem]] = []
+
+    def recurse(children, prefix: str):
+        for idx, child in enumerate(children, start=1):
+            numbering = f"{prefix}.{idx}" if prefix else str(idx)
+            nodes.append((numbering, child))
+            recurse(getattr(child, "children", None) or [], numbering)
+
+    recurse(root_children, "")
+    return nodes
+
+
+def outline_node_paths(outline: OutlineItem) -> List[str]:
+    """按文档顺序列出大纲各节点的检查点路径（与 generate_article 的输出顺序一致）"""
+    return [path for path, _ in outline_nodes(outline)]
+
+
+async def _node_body(
+    node: OutlineItem,
+    path: str,
+    last_para_content: str,
+    highest_level_title: str,
+    llm,
+    db,
+    checkpoints: Optional[Dict[str, str]]
+) -> AsyncGenerator[str, None]:
+    """节点正文：有检查点时直接回放已完成的正文，否则调用大模型生成"""
+    if checkpoints and path in checkpoints:
+        yield checkpoints[path]
+        return
+    async for token in generate_chapter_content(node, last_para_content, highest_level_title, llm, db=db):
+        yield token or ""
+
+
 # 递归生成章节内容
 async def generate_outline_recursive(
     node: OutlineItem, 
@@ -111,12 +163,16 @@ async def generate_outline_recursive(
     highest_level_title: str,
     last_para_content: str,
     level: int,
-    numbering: str
+    numbering: str,
+    checkpoints: Optional[Dict[str, str]] = None,
+    on_node_done: Optional[NodeDoneCallback] = None
 ) -> AsyncGenerator[str, None]:
     """
     递归遍历大纲，自动生成标题和内容
     - level: 当前层级 (1=一级章节, 2=二级, 3=三级)
     - numbering: 当前编号 (如 "1", "1.1", "1.1.1")
+    - checkpoints: 已完成节点的正文（路径 -> 正文），命中时跳过大模型调用
+    - on_node_done: 每个节点正文完成后的回调，用于持久化检查点
     """
     title = getattr(node, "titleName", None) or ""
     children = getattr(node, "children", None) or []
@@ -125,32 +181,57 @@ async def generate_outline_recursive(
     yield generate_markdown_title(title, level, numbering)
     
     # 2. 大模型生成该章节的内容（不含标题）
-    async for token in generate_chapter_content(node, last_para_content, highest_level_title, llm, db=db):
-        yield token or ""
+    body: List[str] = []
+    async for token in _node_body(node, numbering, last_para_content, highest_level_title, llm, db, checkpoints):
+        body.append(token)
+        yield token
     
     yield "\n\n"
+    if on_node_done is not None:
+        on_node_done(numbering, "".join(body))
     
     # 3. 递归处理子章节
-    current_content = ""
+    context = ContextWindow(ARTICLE_CONTEXT_TOKENS)
     for idx, child in enumerate(children, start=1):
         child_numbering = f"{numbering}.{idx}" if numbering else str(idx)
         async for token in generate_outline_recursive(
             child, llm, db, highest_level_title, 
-            current_content[-2000:] if len(current_content) > 2000 else current_content,
+            context.tail(),
             level + 1, 
-            child_numbering
+            child_numbering,
+            checkpoints,
+            on_node_done
         ):
-            current_content += token or ""
+            context.append(token)
             yield token
 
 
 # 完整章节生成
-async def generate_article(state: ChapterGenerationState, llm, db=None) -> AsyncGenerator[str, None]:
+async def generate_article(
+    state: ChapterGenerationState,
+    llm,
+    db=None,
+    mode: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    checkpoints: Optional[Dict[str, str]] = None,
+    on_node_done: Optional[NodeDoneCallback] = None
+) -> AsyncGenerator[str, None]:
     """
     生成完整文章：
     1. 代码自动生成 Markdown 标题（## 1. xxx, ### 1.1 xxx）
     2. 大模型只生成内容
+    - mode: sequential（逐节生成）/ concurrent（同级并发），缺省取配置 ARTICLE_GEN_MODE
+    - concurrency: 并发模式下同时生成的章节数上限，缺省取配置 ARTICLE_GEN_CONCURRENCY
+    - checkpoints / on_node_done: 断点续写，见 generate_outline_recursive；
+      命中检查点的节点输出与首次生成完全一致，调用方可据此跳过已写出的部分
     """
+    if (mode or ARTICLE_GEN_MODE) == "concurrent":
+        async for token in generate_article_concurrent(
+            state, llm, db=db, concurrency=concurrency, checkpoints=checkpoints, on_node_done=on_node_done
+        ):
+            yield token
+        return
+
     highest_level_title = getattr(state.outline, "titleName", None) or ""
     root_children = getattr(state.outline, 'children', None) or []
     
@@ -159,24 +240,190 @@ async def generate_article(state: ChapterGenerationState, llm, db=None) -> Async
     
     # 如果没有子章节，直接生成根节点内容
     if not root_children:
-        async for token in generate_chapter_content(state.outline, "", highest_level_title, llm, db=db):
-            yield token or ""
+        body: List[str] = []
+        async for token in _node_body(state.outline, ROOT_CHECKPOINT_PATH, "", highest_level_title, llm, db, checkpoints):
+            body.append(token)
+            yield token
+        if on_node_done is not None:
+            on_node_done(ROOT_CHECKPOINT_PATH, "".join(body))
         return
     
     # 遍历一级章节
-    last_content = ""
+    context = ContextWindow(ARTICLE_CONTEXT_TOKENS)
     for idx, chapter in enumerate(root_children, start=1):
         numbering = str(idx)
         async for token in generate_outline_recursive(
             chapter, llm, db, highest_level_title,
-            last_content[-2000:] if len(last_content) > 2000 else last_content,
+            context.tail(),
             level=1,
-            numbering=numbering
+            numbering=numbering,
+            checkpoints=checkpoints,
+            on_node_done=on_node_done
         ):
-            last_content += token or ""
+            context.append(token)
             yield token
 
 
+# 分布式生成：单个一级章节
+async def generate_article_part(
+    state: ChapterGenerationState,
+    llm,
+    index: int,
+    db=None,
+    checkpoints: Optional[Dict[str, str]] = None,
+    on_node_done: Optional[NodeDoneCallback] = None
+) -> AsyncGenerator[str, None]:
+    """
+    只生成第 index 个一级章节（从 0 开始，含其全部子章节），第 0 部分额外输出文章总标题。
+    各部分按顺序拼接后与 generate_article 的结构一致；部分之间相互独立，一级章节不以前一章节内容作为上文。
+    """
+    highest_level_title = getattr(state.outline, "titleName", None) or ""
+    root_children = getattr(state.outline, 'children', None) or []
+
+    if index == 0:
+        yield f"# {highest_level_title}\n\n"
+
+    async for token in generate_outline_recursive(
+        root_children[index], llm, db, highest_level_title,
+        "",
+        level=1,
+        numbering=str(index + 1),
+        checkpoints=checkpoints,
+        on_node_done=on_node_done
+    ):
+        yield token
+
+
+# 并发调度：扁平化后的大纲节点
+class _OutlineNode:
+    """并发模式下的大纲节点：记录层级/编号/父节点，并持有本节正文的输出缓冲"""
+
+    def __init__(self, node: OutlineItem, level: int, numbering: str, parent: Optional["_OutlineNode"]):
+        self.node = node
+        self.level = level
+        self.numbering = numbering
+        self.parent = parent
+        self.buffer: asyncio.Queue = asyncio.Queue()  # 正文 token 缓冲，None 表示本节结束
+        self.done = asyncio.Event()  # 本节正文生成完毕（子节点据此开始）
+        self.context = ContextWindow(ARTICLE_CONTEXT_TOKENS)  # 本节正文，供子节点作为上文
+        self.error: Optional[BaseException] = None
+
+
+def _flatten_outline(children, level: int = 1, prefix: str = "", parent: Optional[_OutlineNode] = None) -> List[_OutlineNode]:
+    """按文档顺序（先序遍历）展开大纲"""
+    nodes: List[_OutlineNode] = []
+    for idx, child in enumerate(children, start=1):
+        numbering = f"{prefix}.{idx}" if prefix else str(idx)
+        item = _OutlineNode(child, level, numbering, parent)
+        nodes.append(item)
+        nodes.extend(_flatten_outline(getattr(child, "children", None) or [], level + 1, numbering, item))
+    return nodes
+
+
+async def _produce_outline_node(
+    item: _OutlineNode,
+    llm,
+    db,
+    highest_level_title: str,
+    semaphore: asyncio.Semaphore,
+    checkpoints: Optional[Dict[str, str]] = None
+):
+    """
+    生成单个节点的正文并写入其缓冲区。
+    节点只依赖父节点正文作为上文，因此同级节点之间可以并发；
+    AsyncSession 不支持并发使用，每个节点在有 db 时单独开会话。
+    命中检查点的节点直接回放已完成正文，不占用并发名额。
+    """
+    try:
+        if checkpoints and item.numbering in checkpoints:
+            body = checkpoints[item.numbering]
+            item.context.append(body)
+            item.buffer.put_nowait(body)
+            return
+        if item.parent is not None:
+            await item.parent.done.wait()
+            if item.parent.error is not None:
+                # 父节点失败，子节点缺少上文，直接传递失败，不占用并发名额
+                item.error = item.parent.error
+                return
+        last_para_content = item.parent.context.tail() if item.parent is not None else ""
+        async with semaphore:
+            session_cm = AsyncSessionLocal() if db is not None else contextlib.nullcontext(None)
+            async with session_cm as node_db:
+                async for token in generate_chapter_content(item.node, last_para_content, highest_level_title, llm, db=node_db):
+                    if token:
+                        item.context.append(token)
+                        item.buffer.put_nowait(token)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        mylog.error(f"[并发生成] 章节 {item.numbering} 生成失败: {e}")
+        item.error = e
+    finally:
+        item.done.set()
+        item.buffer.put_nowait(None)
+
+
+async def generate_article_concurrent(
+    state: ChapterGenerationState,
+    llm,
+    db=None,
+    concurrency: Optional[int] = None,
+    checkpoints: Optional[Dict[str, str]] = None,
+    on_node_done: Optional[NodeDoneCallback] = None
+) -> AsyncGenerator[str, None]:
+    """
+    并发生成完整文章：
+    - 同级章节并发调用大模型，上限为 concurrency；子章节在父章节正文完成后开始
+    - 输出严格按文档顺序：靠后的章节先完成时缓冲在各自队列中，等前面章节输出完再依次吐出
+    - 与逐节模式的区别：章节上文取父章节正文，而不是前一兄弟章节的内容
+    - on_node_done 按文档顺序在节点输出完成后调用，与逐节模式一致
+    """
+    highest_level_title = getattr(state.outline, "titleName", None) or ""
+    root_children = getattr(state.outline, 'children', None) or []
+
+    yield f"# {highest_level_title}\n\n"
+
+    if not root_children:
+        body: List[str] = []
+        async for token in _node_body(state.outline, ROOT_CHECKPOINT_PATH, "", highest_level_title, llm, db, checkpoints):
+            body.append(token)
+            yield token
+        if on_node_done is not None:
+            on_node_done(ROOT_CHECKPOINT_PATH, "".join(body))
+        return
+
+    nodes = _flatten_outline(root_children)
+    limit = max(1, concurrency or ARTICLE_GEN_CONCURRENCY)
+    semaphore = asyncio.Semaphore(limit)
+    mylog.info(f"[并发生成] 节点数={len(nodes)}, 并发上限={limit}")
+    tasks = [
+        asyncio.create_task(_produce_outline_node(item, llm, db, highest_level_title, semaphore, checkpoints))
+        for item in nodes
+    ]
+    try:
+        for item in nodes:
+            title = getattr(item.node, "titleName", None) or ""
+            yield generate_markdown_title(title, item.level, item.numbering)
+            body: List[str] = []
+            while True:
+                token = await item.buffer.get()
+                if token is None:
+                    break
+                body.append(token)
+                yield token
+            if item.error is not None:
+                raise item.error
+            yield "\n\n"
+            if on_node_done is not None:
+                on_node_done(item.numbering, "".join(body))
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 # 单个章节内容生成（只生成内容，不含标题）
 async def generate_chapter_content(chapter: OutlineItem, last_para_content: str, highest_level_title: str, llm, db=None) -> AsyncGenerator[str, None]:
     # 入参兼容与结构拼装
@@ -208,7 +455,9 @@ async def generate_chapter_content(chapter: OutlineItem, last_para_content: str,
         from templates.ai_templates.paragraph_generate import get_paragraph_generate_prompt
         
         llm_no_usage = llm.bind(stream_options={"include_usage": False})
-        chain = await build_paragraph_chain_async(llm_no_usage, db=db, example_output=example_output)
+        # 提示词只取一次：既用于构建 chain，也用于打印调试日志
+        prompt_template = await get_paragraph_generate_prompt(db=db, example_output=example_output)
+        chain = await build_paragraph_chain_async(llm_no_usage, prompt=prompt_template)
         inputs = {
             "complete_title": highest_level_title or "",
             "last_para_content": last_para_content or "",
@@ -218,10 +467,24 @@ async def generate_chapter_content(chapter: OutlineItem, last_para_content: str,
         }
         
         # 打印完整提示词（用于调试）
-        prompt_template = await get_paragraph_generate_prompt(db=db, example_output=example_output)
         full_prompt = prompt_template.format(**inputs)
         mylog.info(f"{'='*60}\n📜 [完整提示词] 章节: {chapter_title}\n{'-'*60}\n{full_prompt}\n{'='*60}")
 
+        # 结果缓存（需开启）：同模型、同提示词版本、同输入直接回放
+        cache_key = None
+        if llm_response_cache.enabled:
+            cache_key = llm_response_cache.make_key(
+                "chapter", LLMFactory.identity(llm_no_usage), (prompt_template.metadata or {}).get("prompt_version"),
+                {**inputs, "exampleOutput": example_output or ""}
+            )
+            cached_text = await llm_response_cache.get(cache_key) if cache_key else None
+            if cached_text is not None:
+                async for piece in llm_response_cache.replay(cached_text):
+                    yield piece
+                yield "\n"
+                return
+
+        generated: List[str] = []
         try:
             # 直接使用 astream 返回的增量结果（AIMessageChunk 或字符串）
             async for chunk in chain.astream(inputs):
@@ -237,34 +500,37 @@ async def generate_chapter_content(chapter: OutlineItem, last_para_content: str,
                         except Exception:
                             text = ""
                 if text:
+                    generated.append(text)
                     yield text
         except Exception as se:
             # 处理流式异常；若为已知的 AIMessageChunk usage 校验问题，则强制回退
             STREAM_ONLY = (os.getenv("AI_STREAM_ONLY", "").lower() in ("1", "true", "yes"))
             err_msg = str(se)
             force_fallback = ("AIMessageChunk" in err_msg) or ("usage_metadata" in err_msg)
-            if STREAM_ONLY and not force_fallback:
-                # 静默跳过（不回退）
-                pass
-            else:
-                # 回退到非流式一次性生成
+            # 以下情况不回退，向上抛出（文章任务据此从检查点重试，交互接口返回错误）：
+            # - 看门狗超时：首 token 超时已重试、模型组已切换过端点，上游卡住时一次性生成同样会挂起
+            # - 已输出部分内容：一次性生成会重复输出已有内容
+            # - AI_STREAM_ONLY 开启
+            if isinstance(se, LLMStreamTimeout) or ((generated or STREAM_ONLY) and not force_fallback):
+                raise
+            # 回退到非流式一次性生成
+            resp = await chain.ainvoke(inputs)
+            content_text = getattr(resp, "content", resp) or ""
+            if not isinstance(content_text, str):
                 try:
-                    resp = await chain.ainvoke(inputs)
-                    content_text = getattr(resp, "content", resp) or ""
-                    if not isinstance(content_text, str):
-                        try:
-                            content_text = str(content_text)
-                        except Exception:
-                            content_text = ""
-                    chunk_size = 500
-                    for i in range(0, len(content_text), chunk_size):
-                        yield content_text[i:i+chunk_size]
+                    content_text = str(content_text)
                 except Exception:
-                    # 静默失败
-                    pass
-    except Exception:
-        # 静默失败
-        pass
+                    content_text = ""
+            chunk_size = 500
+            for i in range(0, len(content_text), chunk_size):
+                yield content_text[i:i+chunk_size]
+            generated = [content_text]
+        # 只缓存完整生成的结果（出错时已抛出）
+        if cache_key:
+            await llm_response_cache.set(cache_key, "".join(generated))
+    except Exception as e:
+        mylog.error(f"[章节生成] {chapter_title} 生成失败: {e}")
+        raise
     yield "\n"  # 在章节结束后添加一个换行
 
 # 优化内容
@@ -276,12 +542,27 @@ async def optimize_content(original_text: str, article_type: str, user_requireme
         except Exception:
             llm_no_usage = llm
         chain = build_optimize_chain(llm_no_usage)
+        inputs = {
+            "original_text": original_text,
+            "article_type": article_type,
+            "user_requirements": user_requirements
+        }
+
+        # 结果缓存（需开启）：同模型、同输入直接回放
+        cache_key = None
+        if llm_response_cache.enabled:
+            cache_key = llm_response_cache.make_key(
+                "optimize", LLMFactory.identity(llm_no_usage), CONTENT_OPTIMIZE_PROMPT_VERSION, inputs
+            )
+            cached_text = await llm_response_cache.get(cache_key) if cache_key else None
+            if cached_text is not None:
+                async for piece in llm_response_cache.replay(cached_text):
+                    yield piece
+                return
+
+        generated: List[str] = []
         try:
-            async for chunk in chain.astream({
-                "original_text": original_text,
-                "article_type": article_type,
-                "user_requirements": user_requirements
-            }):
+            async for chunk in chain.astream(inputs):
                 text = getattr(chunk, "content", None)
                 if text is None:
                     if isinstance(chunk, str):
@@ -292,35 +573,32 @@ async def optimize_content(original_text: str, article_type: str, user_requireme
                         except Exception:
                             text = ""
                 if text:
+                    generated.append(text)
                     yield text
         except Exception as se:
-            # 与章节生成一致的回退策略
+            # 与章节生成一致的回退策略：超时、已输出部分内容或 AI_STREAM_ONLY 时向上抛出
             STREAM_ONLY = (os.getenv("AI_STREAM_ONLY", "").lower() in ("1", "true", "yes"))
             err_msg = str(se)
             force_fallback = ("AIMessageChunk" in err_msg) or ("usage_metadata" in err_msg)
-            if STREAM_ONLY and not force_fallback:
-                pass
-            else:
+            if isinstance(se, LLMStreamTimeout) or ((generated or STREAM_ONLY) and not force_fallback):
+                raise
+            resp = await chain.ainvoke(inputs)
+            content_text = getattr(resp, "content", resp) or ""
+            if not isinstance(content_text, str):
                 try:
-                    resp = await chain.ainvoke({
-                        "original_text": original_text,
-                        "article_type": article_type,
-                        "user_requirements": user_requirements
-                    })
-                    content_text = getattr(resp, "content", resp) or ""
-                    if not isinstance(content_text, str):
-                        try:
-                            content_text = str(content_text)
-                        except Exception:
-                            content_text = ""
-                    chunk_size = 500
-                    for i in range(0, len(content_text), chunk_size):
-                        yield content_text[i:i+chunk_size]
+                    content_text = str(content_text)
                 except Exception:
-                    pass
-    except Exception:
-        # 静默降级
-        yield original_text
+                    content_text = ""
+            chunk_size = 500
+            for i in range(0, len(content_text), chunk_size):
+                yield content_text[i:i+chunk_size]
+            generated = [content_text]
+        if cache_key:
+            await llm_response_cache.set(cache_key, "".join(generated))
+    except Exception as e:
+        # 不再静默返回原文：由调用方向前端返回错误
+        mylog.error(f"[内容优化] 生成失败: {e}")
+        raise
 
 # 测试函数
 async def test_generate_article():
@@ -0,0 +1,385 @@
+"""
+文章任务成本预估与准入控制
+- 预估：遍历大纲，按调用次数（节点数）、标题 / 写作要求 / 参考输出的 token 数（tiktoken）以及该模型最近完成任务的
+  实际生成速度，估算 token 用量与耗时，提交任务时返回给前端
+- 准入：进行中的任务按预估 token 数占用预算（全局 / 单用户），由 Redis Lua 脚本原子地检查并占用；
+  超出预算时按配置直接拒绝或排队，任务结束释放占用时按提交顺序放行排队任务
+"""
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy import select
+
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD, ARTICLE_CONTEXT_TOKENS,
+    ESTIMATE_DEFAULT_TOKENS_PER_SEC, ESTIMATE_NODE_OUTPUT_TOKENS, ESTIMATE_PROMPT_OVERHEAD_TOKENS,
+    ESTIMATE_HISTORY_SAMPLES, ADMISSION_GLOBAL_TOKEN_BUDGET, ADMISSION_USER_TOKEN_BUDGET,
+    ADMISSION_POLICY, ADMISSION_LEASE_TTL,
+)
+from models.task import AiTask
+from utils.logger import mylog
+from utils.tools import compute_gpt_tokens
+
+
+def _children(node) -> list:
+    if isinstance(node, dict):
+        return node.get("children") or []
+    return getattr(node, "children", None) or []
+
+
+def _field(node, name: str) -> str:
+    if isinstance(node, dict):
+        return node.get(name) or ""
+    return getattr(node, name, None) or ""
+
+
+def count_outline_nodes(outline) -> int:
+    """大纲中需要调用大模型的节点数（无子章节时根节点自身生成一次）"""
+    def recurse(children) -> int:
+        return sum(1 + recurse(_children(child)) for child in children)
+    return recurse(_children(outline)) or 1
+
+
+def estimate_node_output(node, default_tokens: int = ESTIMATE_NODE_OUTPUT_TOKENS) -> int:
+    """单个节点的预估输出 token 数：有参考输出时取参考输出长度，否则取默认值"""
+    reference = _field(node, "referenceOutput")
+    return compute_gpt_tokens(reference) if reference else default_tokens
+
+
+class TaskEstimator:
+    """
+    文章任务成本预估
+    - 每个节点一次调用：输入 = 提示词模板开销 + 总标题 + 节点标题 / 写作要求 / 参考输出 + 上一节内容（不超过上文预算），
+      输出 = 参考输出长度（有参考输出时）或该模型历史平均每节输出
+    - 耗时 = 输出 token 数 / 历史生成速度（最近完成任务的结果 token 数（完成时写入 output_tokens）/ 从提交到完成的秒数，含排队与检索）
+    """
+
+    history_ttl_seconds = 600
+
+    def __init__(self):
+        self._history: Dict[int, Tuple[float, Dict]] = {}
+
+    def _history_stats(self, rows) -> Dict:
+        """由最近完成的任务计算生成速度与平均每节输出"""
+        total_tokens, total_seconds, total_nodes, samples = 0, 0.0, 0, 0
+        for output_tokens, input_params, created_at, completed_at in rows:
+            if not output_tokens or not created_at or not completed_at:
+                continue
+            seconds = (completed_at - created_at).total_seconds()
+            if seconds <= 0:
+                continue
+            try:
+                nodes = count_outline_nodes(json.loads(input_params or "{}"))
+            except (TypeError, ValueError):
+                nodes = 1
+            total_tokens += output_tokens
+            total_seconds += seconds
+            total_nodes += nodes
+            samples += 1
+        if not total_tokens:
+            return {"samples": 0}
+        return {
+            "samples": samples,
+            "tokens_per_sec": total_tokens / total_seconds,
+            "node_output_tokens": total_tokens // max(1, total_nodes),
+        }
+
+    async def model_history(self, db, model_id: Optional[int]) -> Dict:
+        """模型最近完成任务的统计（进程内缓存 history_ttl_seconds 秒）；查询失败或无历史时返回 samples=0"""
+        if not model_id:
+            return {"samples": 0}
+        cached = self._history.get(model_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        try:
+            # 只读完成时记录的 token 数，不加载、解压结果正文（未记录的旧任务不参与统计）
+            stmt = select(AiTask.output_tokens, AiTask.input_params, AiTask.created_at, AiTask.completed_at).filter(
+                AiTask.model_id == model_id,
+                AiTask.status == "completed",
+                AiTask.completed_at.isnot(None),
+                AiTask.output_tokens.isnot(None)
+            ).order_by(AiTask.completed_at.desc()).limit(ESTIMATE_HISTORY_SAMPLES)
+            rows = (await db.execute(stmt)).all()
+            stats = self._history_stats(rows)
+        except Exception as e:
+            mylog.error(f"[TaskEstimator] 读取模型 {model_id} 历史任务失败: {e}")
+            stats = {"samples": 0}
+        self._history[model_id] = (time.monotonic() + self.history_ttl_seconds, stats)
+        return stats
+
+    def estimate_outline(
+        self,
+        outline,
+        tokens_per_sec: float = ESTIMATE_DEFAULT_TOKENS_PER_SEC,
+        node_output_tokens: int = ESTIMATE_NODE_OUTPUT_TOKENS,
+        distributed: bool = False
+    ) -> Dict:
+        """
+        按大纲估算调用次数、token 用量与耗时（秒）
+        - distributed: 按一级章节并行生成时，耗时取输出最多的一级章节
+        """
+        title_tokens = compute_gpt_tokens(_field(outline, "titleName"))
+        calls, input_tokens = 0, 0
+
+        def node_cost(node, context_tokens: int) -> int:
+            """累计单个节点的调用开销，返回其输出 token 数"""
+            nonlocal calls, input_tokens
+            reference = _field(node, "referenceOutput")
+            output = estimate_node_output(node, node_output_tokens)
+            calls += 1
+            input_tokens += (
+                ESTIMATE_PROMPT_OVERHEAD_TOKENS + title_tokens + context_tokens
+                + compute_gpt_tokens(_field(node, "titleName"))
+                + compute_gpt_tokens(_field(node, "writingRequirement"))
+                + compute_gpt_tokens(reference)
+            )
+            return output
+
+        def subtree_cost(node, context_tokens: int) -> int:
+            """节点及其子章节的输出 token 数；子章节以前面兄弟章节的输出作为上文"""
+            output = node_cost(node, context_tokens)
+            previous = 0
+            for child in _children(node):
+                previous += subtree_cost(child, min(ARTICLE_CONTEXT_TOKENS, previous))
+            return output + previous
+
+        chapters = _children(outline)
+        if chapters:
+            chapter_outputs, previous = [], 0
+            for chapter in chapters:
+                # 分布式生成时一级章节之间不传递上文
+                output = subtree_cost(chapter, 0 if distributed else min(ARTICLE_CONTEXT_TOKENS, previous))
+                chapter_outputs.append(output)
+                previous += output
+        else:
+            chapter_outputs = [node_cost(outline, 0)]
+
+        output_tokens = sum(chapter_outputs)
+        critical_tokens = max(chapter_outputs) if distributed else output_tokens
+        rate = tokens_per_sec if tokens_per_sec > 0 else ESTIMATE_DEFAULT_TOKENS_PER_SEC
+        return {
+            "llm_calls": calls,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "tokens_per_sec": round(rate, 2),
+            "eta_seconds": int(critical_tokens / rate) + 1,
+        }
+
+    async def estimate(self, db, outline, model_id: Optional[int] = None, distributed: bool = False) -> Dict:
+        """结合模型历史统计预估任务成本，history_samples 为参与统计的历史任务数（0 表示使用默认值）"""
+        history = await self.model_history(db, model_id)
+        estimate = self.estimate_outline(
+            outline,
+            tokens_per_sec=history.get("tokens_per_sec", ESTIMATE_DEFAULT_TOKENS_PER_SEC),
+            node_output_tokens=history.get("node_output_tokens", ESTIMATE_NODE_OUTPUT_TOKENS),
+            distributed=distributed
+        )
+        estimate["history_samples"] = history["samples"]
+        return estimate
+
+
+# 占用 / 释放 / 放行在一个脚本内原子完成，每次调用先回收到期的占用
+# KEYS: 占用到期时间(zset) 占用信息(hash) 已用预算(hash) 排队顺序(zset) 排队信息(hash)
+# ARGV: 操作 当前时间(毫秒) 任务ID 用户 token数 到期时长(毫秒) 全局预算 单用户预算 是否排队
+# 返回: {结果(1 放行 / 0 排队 / -1 拒绝), 因占用释放而放行的排队任务ID...}
+_ADMISSION_SCRIPT = """
+local leases, info, used, queue, queued = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local op, now, id = ARGV[1], tonumber(ARGV[2]), ARGV[3]
+local user, tokens, ttl = ARGV[4], tonumber(ARGV[5]), tonumber(ARGV[6])
+local global_limit, user_limit = tonumber(ARGV[7]), tonumber(ARGV[8])
+
+local function parse(value)
+  local u, t = string.match(value, '^(.*)|(%d+)$')
+  return u, tonumber(t)
+end
+
+local function release(task_id)
+  local value = redis.call('HGET', info, task_id)
+  if value then
+    local u, t = parse(value)
+    redis.call('HINCRBY', used, '*', -t)
+    if redis.call('HINCRBY', used, 'u:' .. u, -t) <= 0 then
+      redis.call('HDEL', used, 'u:' .. u)
+    end
+    redis.call('HDEL', info, task_id)
+  end
+  redis.call('ZREM', leases, task_id)
+end
+
+-- 返回 0 可以占用，1 超出单用户预算，2 超出全局预算；没有进行中的任务时总是放行，避免单个大任务永远无法执行
+local function check(u, t)
+  local g = tonumber(redis.call('HGET', used, '*') or '0')
+  local uu = tonumber(redis.call('HGET', used, 'u:' .. u) or '0')
+  if global_limit > 0 and g > 0 and g + t > global_limit then return 2 end
+  if user_limit > 0 and uu > 0 and uu + t > user_limit then return 1 end
+  return 0
+end
+
+local function reserve(task_id, u, t)
+  redis.call('HSET', info, task_id, u .. '|' .. t)
+  redis.call('HINCRBY', used, '*', t)
+  redis.call('HINCRBY', used, 'u:' .. u, t)
+  redis.call('ZADD', leases, now + ttl, task_id)
+end
+
+-- 按提交顺序放行排队任务：超出单用户预算的跳过（不阻塞其他用户），超出全局预算时停止
+local function admit_queued(admitted)
+  for _, task_id in ipairs(redis.call('ZRANGE', queue, 0, -1)) do
+    local u, t = parse(redis.call('HGET', queued, task_id) or '|0')
+    local status = check(u, t)
+    if status == 2 then break end
+    if status == 0 then
+      reserve(task_id, u, t)
+      redis.call('ZREM', queue, task_id)
+      redis.call('HDEL', queued, task_id)
+      table.insert(admitted, task_id)
+    end
+  end
+end
+
+for _, task_id in ipairs(redis.call('ZRANGEBYSCORE', leases, '-inf', now)) do
+  release(task_id)
+end
+
+local result = {0}
+if op == 'acquire' then
+  if redis.call('ZSCORE', leases, id) then
+    redis.call('ZADD', leases, now + ttl, id)
+    result[1] = 1
+    return result
+  end
+  admit_queued(result)
+  if redis.call('ZSCORE', leases, id) then
+    result[1] = 1
+  elseif redis.call('ZCARD', queue) == 0 and check(user, tokens) == 0 then
+    reserve(id, user, tokens)
+    result[1] = 1
+  elseif ARGV[9] == '1' then
+    if not redis.call('ZSCORE', queue, id) then
+      redis.call('ZADD', queue, now, id)
+      redis.call('HSET', queued, id, user .. '|' .. tokens)
+    end
+    result[1] = 0
+  else
+    result[1] = -1
+  end
+  -- 本次放行的排队任务中不包含自身
+  for i = #result, 2, -1 do
+    if result[i] == id then table.remove(result, i) end
+  end
+elseif op == 'renew' then
+  if redis.call('ZSCORE', leases, id) then
+    redis.call('ZADD', leases, now + ttl, id)
+    result[1] = 1
+  end
+elseif op == 'release' then
+  release(id)
+  redis.call('ZREM', queue, id)
+  redis.call('HDEL', queued, id)
+  admit_queued(result)
+end
+return result
+"""
+
+ADMISSION_ADMITTED = "admitted"
+ADMISSION_QUEUED = "queued"
+ADMISSION_REJECTED = "rejected"
+
+_ADMISSION_RESULTS = {1: ADMISSION_ADMITTED, 0: ADMISSION_QUEUED, -1: ADMISSION_REJECTED}
+
+
+class AdmissionController:
+    """
+    任务准入控制（配置了全局或单用户预算时启用）：
+    - acquire：提交 / 续写时按预估 token 数占用预算，超出时按 ADMISSION_POLICY 排队或拒绝
+    - release：任务完成、失败或取消时释放占用（可重复调用），返回因此放行的排队任务，由调用方分发执行
+    - renew_async：Worker 在每个大纲节点完成时续期占用，运行时间（含重试）超过 ADMISSION_LEASE_TTL 的任务不会被提前回收
+    Worker 异常退出未释放的占用在 ADMISSION_LEASE_TTL 秒后自动回收。
+    """
+
+    def __init__(self):
+        self.global_budget = ADMISSION_GLOBAL_TOKEN_BUDGET
+        self.user_budget = ADMISSION_USER_TOKEN_BUDGET
+        self.policy = ADMISSION_POLICY
+        self.lease_ttl = ADMISSION_LEASE_TTL
+        self.enabled = self.global_budget > 0 or self.user_budget > 0
+        redis_kwargs = dict(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD, decode_responses=True)
+        # 同步客户端供线程中的调用使用，异步客户端供 API 与 Worker 事件循环使用，均按需建立连接
+        self.redis_client = redis.Redis(**redis_kwargs)
+        self.async_redis_client = aioredis.Redis(**redis_kwargs)
+
+    def _keys(self) -> List[str]:
+        return [
+            "admission:leases", "admission:lease_info", "admission:used",
+            "admission:queue", "admission:queue_info"
+        ]
+
+    def _args(self, op: str, task_id: str, user_id: Optional[str] = None, tokens: int = 0) -> list:
+        return [
+            op, int(time.time() * 1000), task_id, user_id or "", int(tokens), self.lease_ttl * 1000,
+            self.global_budget, self.user_budget, "1" if self.policy == "queue" else "0"
+        ]
+
+    async def acquire(self, task_id: str, user_id: Optional[str], tokens: int) -> Tuple[str, List[str]]:
+        """
+        占用预算，返回（admitted / queued / rejected，因到期回收而放行的其他排队任务）
+        未启用或 Redis 不可用时直接放行，不影响任务提交
+        """
+        if not self.enabled:
+            return ADMISSION_ADMITTED, []
+        try:
+            result = await self.async_redis_client.eval(
+                _ADMISSION_SCRIPT, len(self._keys()), *self._keys(), *self._args("acquire", task_id, user_id, tokens)
+            )
+            return _ADMISSION_RESULTS[int(result[0])], list(result[1:])
+        except Exception as e:
+            mylog.error(f"[AdmissionController] 占用预算失败，直接放行: {e}")
+            return ADMISSION_ADMITTED, []
+
+    async def renew_async(self, task_id: str) -> bool:
+        """把任务占用的到期时间顺延 ADMISSION_LEASE_TTL 秒，返回占用是否仍存在（已回收的不会重新占用）"""
+        if not self.enabled:
+            return False
+        try:
+            result = await self.async_redis_client.eval(
+                _ADMISSION_SCRIPT, len(self._keys()), *self._keys(), *self._args("renew", task_id)
+            )
+            return int(result[0]) == 1
+        except Exception as e:
+            mylog.error(f"[AdmissionController] 续期占用失败: {e}")
+            return False
+
+    def release(self, task_id: str) -> List[str]:
+        """释放任务占用的预算（同时移出排队），返回因此放行的排队任务ID"""
+        if not self.enabled:
+            return []
+        try:
+            result = self.redis_client.eval(
+                _ADMISSION_SCRIPT, len(self._keys()), *self._keys(), *self._args("release", task_id)
+            )
+            return list(result[1:])
+        except Exception as e:
+            mylog.error(f"[AdmissionController] 释放预算失败: {e}")
+            return []
+
+    async def release_async(self, task_id: str) -> List[str]:
+        """release 的异步版本，供 API 路由使用"""
+        if not self.enabled:
+            return []
+        try:
+            result = await self.async_redis_client.eval(
+                _ADMISSION_SCRIPT, len(self._keys()), *self._keys(), *self._args("release", task_id)
+            )
+            return list(result[1:])
+        except Exception as e:
+            mylog.error(f"[AdmissionController] 释放预算失败: {e}")
+            return []
+
+
+# 全局实例
+task_estimator = TaskEstimator()
+admission_controller = AdmissionController()
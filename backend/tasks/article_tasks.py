@@ -2,118 +2,456 @@
 文章生成异步任务
 """
 import asyncio
-import sys
+import concurrent.futures
+import json
 from datetime import datetime
+from typing import AsyncGenerator, Callable, Coroutine, Dict, List, Optional, Tuple
+from celery import chord, group
+from celery.exceptions import SoftTimeLimitExceeded, Reject
 from tasks.celery_app import celery_app
-from tasks.redis_stream import redis_stream_manager
-from services.solution import generate_article, ChapterGenerationState
+from tasks.redis_stream import redis_stream_manager, async_redis_stream_manager, part_stream_id, STREAM_EVENT_END, STREAM_EVENT_ERROR
+from tasks.worker_runtime import worker_runtime
+from services.task_estimator import admission_controller, estimate_node_output
+from services.solution import (
+    generate_article, generate_article_part, ChapterGenerationState, outline_nodes, NodeDoneCallback
+)
+from utils.stream_coalesce import coalesce_stream
 from models.templates import TemplateChild as OutlineItem
 from models.task import AiTask
-from config import AsyncSessionLocal
+from config import AsyncSessionLocal, ARTICLE_WORKER_MODE, TASK_RESULT_RETENTION, STREAM_COMPLETED_TTL
 from utils.logger import mylog
+from utils.tools import compute_gpt_tokens
+from ai.llm.adaptive_limit import is_overload_error
 from ai.llm.llm_factory import LLMFactory
+from ai.llm.rate_limit import set_llm_user
 
 
-@celery_app.task(bind=True)
+class _RetryFromCheckpoint(Exception):
+    """模型调用失败（流式超时、连接失败、5xx / 429）且任务还有重试次数：由外层从检查点重试，不标记失败"""
+
+
+def _should_retry(task, error: BaseException) -> bool:
+    return is_overload_error(error) and task.request.retries < task.max_retries
+
+
+def _resume_point(paths: List[str], checkpoints: Dict[str, Dict]) -> int:
+    """
+    按文档顺序（paths）找出连续已完成的节点前缀，返回前缀最后一个节点在本 Stream 输出中的结束位置（字符数）；
+    没有可续写的前缀时返回 0（从头生成）
+    """
+    offset = 0
+    for path in paths:
+        checkpoint = checkpoints.get(path)
+        if not checkpoint or not isinstance(checkpoint.get("offset"), int):
+            break
+        offset = checkpoint["offset"]
+    return offset
+
+
+def _part_nodes(outline: OutlineItem, index: int) -> List[Tuple[str, OutlineItem]]:
+    """第 index 个一级章节（含子章节）的节点"""
+    prefix = str(index + 1)
+    return [(path, node) for path, node in outline_nodes(outline) if path == prefix or path.startswith(prefix + ".")]
+
+
+class _NodeProgress:
+    """
+    按大纲节点计算进度：已完成节点的预估输出 token 数之和 / 全部节点之和（有参考输出的节点按其长度加权），
+    完成前最多 99；同时给出正在生成的章节标题
+    """
+
+    def __init__(self, nodes: List[Tuple[str, OutlineItem]]):
+        self.paths = [path for path, _ in nodes]
+        self.titles = {path: getattr(node, "titleName", None) or "" for path, node in nodes}
+        self.weights = {path: estimate_node_output(node) for path, node in nodes}
+        self.total = sum(self.weights.values()) or 1
+        self.done = 0
+
+    def current_section(self, index: int = 0) -> str:
+        return self.titles[self.paths[index]] if index < len(self.paths) else ""
+
+    def advance(self, path: str) -> Tuple[int, str]:
+        """节点完成，返回（进度，下一个章节标题）"""
+        self.done += self.weights.get(path, 0)
+        index = self.paths.index(path) + 1 if path in self.weights else len(self.paths)
+        return min(99, self.done * 100 // self.total), self.current_section(index)
+
+
+async def _get_llm(session, model_id: Optional[int]):
+    """按模型 ID 获取 LLM，未指定或不存在时回退到默认模型"""
+    llm = None
+    if model_id:
+        llm = await LLMFactory.get_llm_by_id(session, model_id)
+    if not llm:
+        # 尝试获取默认模型
+        llm = await LLMFactory.get_default_llm(session)
+    if not llm:
+        mylog.error(f"[article_tasks] 未找到可用的 LLM 模型")
+        raise Exception("未找到可用的 LLM 模型，请先配置模型")
+    return llm
+
+
+async def _stream_with_checkpoints(
+    stream_id: str,
+    nodes: List[Tuple[str, OutlineItem]],
+    make_stream: Callable[[Dict[str, str], NodeDoneCallback], AsyncGenerator[str, None]],
+    report_progress: bool = True,
+    lease_id: Optional[str] = None
+) -> str:
+    """
+    把生成结果写入 stream_id 对应的 Stream，返回完整输出
+    
+    断点续写：每个大纲节点完成后写入检查点（task:{stream_id}:ckpt），记录节点结束时本 Stream 的累计输出字符数；
+    再次执行时丢弃第一个未完成节点之后的残留输出，已完成节点回放检查点正文，Stream 中已有的前缀直接跳过。
+    - nodes: 本 Stream 覆盖的大纲节点（文档顺序）
+    - make_stream(checkpoints, on_node_done): 创建生成器
+    - report_progress: 是否在节点边界更新 stream_id 的进度与当前章节（子任务 Stream 不单独维护元信息）
+    - lease_id: 准入控制占用所属的任务 ID（默认 stream_id），开始执行及每个节点完成时续期
+    """
+    lease_id = lease_id or stream_id
+    await admission_controller.renew_async(lease_id)
+    paths = [path for path, _ in nodes]
+    saved = await async_redis_stream_manager.load_checkpoints(stream_id)
+    skip_chars = await async_redis_stream_manager.truncate_stream(stream_id, _resume_point(paths, saved))
+    checkpoints = {path: ckpt.get("body", "") for path, ckpt in saved.items()}
+    if checkpoints:
+        mylog.info(f"[article_tasks] {stream_id} 从检查点续写，已完成节点={len(checkpoints)}，已输出字符={skip_chars}")
+    
+    # 合并写入后 Stream 条目与节点边界不再对齐，检查点按字符数定位
+    emitted_chars = 0
+    progress = _NodeProgress(nodes) if report_progress else None
+    
+    async def counted(source):
+        nonlocal emitted_chars
+        async for chunk in source:
+            emitted_chars += len(chunk)
+            yield chunk
+    
+    complete_content = ""
+    lease_due = False
+    # 合并 token 分片后再写 Redis：每批内容（连同检查点、进度更新）一次 pipeline 往返；退出时 flush 并为 Stream 续期。
+    # 全部走异步客户端：asyncio 执行模式下多篇文章共用 Worker 的事件循环，同步往返会卡住其他文章的模型流
+    async with async_redis_stream_manager.writer(stream_id) as writer:
+        def on_node_done(path: str, body: str):
+            nonlocal lease_due
+            # 回调由生成器同步调用：检查点与进度随下一批内容一起写入，占用在写入后续期
+            writer.save_checkpoint(path, body, emitted_chars)
+            lease_due = True
+            if progress is not None:
+                node_progress, section = progress.advance(path)
+                writer.update_meta("processing", node_progress, current_section=section)
+        
+        if progress is not None:
+            writer.update_meta("processing", 0, current_section=progress.current_section())
+            await writer.flush()
+        
+        async for content_chunk in coalesce_stream(counted(make_stream(checkpoints, on_node_done))):
+            complete_content += content_chunk
+            
+            if skip_chars:
+                dropped = min(skip_chars, len(content_chunk))
+                content_chunk = content_chunk[dropped:]
+                skip_chars -= dropped
+            
+            if content_chunk:
+                writer.write(content_chunk)
+            await writer.flush()
+            if lease_due:
+                lease_due = False
+                await admission_controller.renew_async(lease_id)
+    return complete_content
+
+
+async def _complete_task(task_id: str, complete_content: str, parts: int = 0) -> Dict:
+    """
+    标记任务完成：结果写入任务表（唯一的完整副本），Stream 写入结束事件，更新元信息；
+    返回结果指针作为 Celery 任务结果，结果后端不再保存文章内容
+    """
+    await async_redis_stream_manager.set_task_result(task_id, complete_content)
+    # 结束事件写入 Stream，SSE 订阅方收到即关闭；先于元信息更新，元信息为终态时事件一定已存在
+    await async_redis_stream_manager.write_event(task_id, STREAM_EVENT_END)
+    await async_redis_stream_manager.update_task_meta(task_id, "completed", 100, current_section="")
+    await async_redis_stream_manager.clear_checkpoints(task_id)
+    # 结果 token 数随任务保存，耗时预估只读这一列，不再解压、重算历史结果
+    output_tokens = await asyncio.get_running_loop().run_in_executor(None, compute_gpt_tokens, complete_content)
+    
+    async with AsyncSessionLocal() as session:
+        task_record = await session.get(AiTask, task_id)
+        if task_record:
+            task_record.status = "completed"
+            task_record.progress = 100
+            task_record.result = complete_content
+            task_record.output_tokens = output_tokens
+            task_record.completed_at = datetime.now()
+            await session.commit()
+    
+    if TASK_RESULT_RETENTION != "full":
+        # 完整内容已在任务表中，Stream 只再保留一段时间供断线重连
+        await async_redis_stream_manager.expire_task_streams(task_id, STREAM_COMPLETED_TTL, parts)
+    
+    await dispatch_admitted(await admission_controller.release_async(task_id))
+    return {"status": "completed", "task_id": task_id, "result_ref": "ai_task", "length": len(complete_content)}
+
+
+async def _mark_task_failed(task_id: str, error_msg: str):
+    """标记任务失败：Stream 写入失败事件，更新元信息与任务表"""
+    await async_redis_stream_manager.write_event(task_id, STREAM_EVENT_ERROR, error_msg)
+    await async_redis_stream_manager.update_task_meta(task_id, "failed", 0, error_msg)
+    
+    async with AsyncSessionLocal() as session:
+        task_record = await session.get(AiTask, task_id)
+        if task_record:
+            task_record.status = "failed"
+            task_record.error_message = error_msg
+            await session.commit()
+    
+    await dispatch_admitted(await admission_controller.release_async(task_id))
+
+
+async def _finished_status(task_id: str, statuses: tuple = ("completed", "cancelled")) -> Optional[str]:
+    """任务已处于 statuses 中的状态时返回该状态（消息重复投递时据此跳过），否则返回 None"""
+    meta = await async_redis_stream_manager.get_task_meta(task_id)
+    if meta and meta.get("status") in statuses:
+        return meta["status"]
+    async with AsyncSessionLocal() as session:
+        task_record = await session.get(AiTask, task_id)
+        if task_record and task_record.status in statuses:
+            return task_record.status
+    return None
+
+
+def _run_in_worker(task, task_id: str, coro: Coroutine, on_timeout: Callable[[str], Coroutine]):
+    """
+    在 Worker 进程的常驻事件循环中执行任务协程：数据库连接池、LLM 客户端在任务之间复用。
+    asyncio 执行模式下 threads 池不支持 Celery 时间限制，改为等待结果时按 task_soft_time_limit 超时；
+    软超时时检查点保留，还有重试次数则从第一个未完成节点重试，否则调用 on_timeout 标记失败；
+    模型调用失败（协程抛出 _RetryFromCheckpoint）同样从检查点重试。
+    """
+    timeout = celery_app.conf.task_soft_time_limit if ARTICLE_WORKER_MODE == "asyncio" else None
+    try:
+        return worker_runtime.run(coro, timeout=timeout)
+    except _RetryFromCheckpoint as e:
+        # 已完成节点的检查点保留，重试时只重新生成出错的节点；上游过载时间隔逐次加长
+        countdown = 10 * (task.request.retries + 1)
+        mylog.warning(f"[{task.name}] 任务 {task_id} 模型调用失败，{countdown}s 后从检查点重试: {e}")
+        raise task.retry(exc=e.__cause__ or e, countdown=countdown)
+    except (SoftTimeLimitExceeded, concurrent.futures.TimeoutError) as e:
+        if task.request.retries < task.max_retries:
+            mylog.warning(f"[{task.name}] 任务 {task_id} 软超时，将从检查点重试")
+            raise task.retry(exc=e, countdown=5)
+        worker_runtime.run(on_timeout("任务执行超时"))
+        raise
+
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=2)
 def generate_article_task(self, task_id: str, outline_dict: dict, user_id: str = None, model_id: int = None):
     """
     文章生成异步任务
+    
+    断点续写：每个大纲节点完成后写入检查点（task:{task_id}:ckpt）。
+    Worker 被杀（acks_late 使消息重新投递）、软超时自动重试或通过 /resume 重新提交时，
+    已完成节点直接回放检查点正文，只从第一个未完成节点开始调用大模型。
+    
+    asyncio 执行模式下同一进程内多篇文章在共享事件循环上并发生成；threads 池不支持 Celery 时间限制，
+    改为等待结果时按 task_soft_time_limit 超时，超时处理与软超时一致。
     """
+    if worker_runtime.closing:
+        # Worker 正在关闭：不开始新任务，消息退回队列由其他 Worker 处理
+        raise Reject("worker shutting down", requeue=True)
+    
     async def _run():
         try:
-            redis_stream_manager.update_task_meta(task_id, "processing", 0)
+            finished = await _finished_status(task_id)
+            if finished:
+                # 消息重复投递（如完成后 Worker 未来得及 ack 即退出）时不再重复生成
+                mylog.info(f"[generate_article_task] 任务 {task_id} 已{finished}，跳过")
+                return {"status": finished}
+            
+            await async_redis_stream_manager.update_task_meta(task_id, "processing", 0)
             
             outline = OutlineItem(**outline_dict)
             state = ChapterGenerationState(outline)
             
-            total_chunks = 0
-            complete_content = ""
-            
             # 使用数据库会话获取 LLM 和提示词配置
             async with AsyncSessionLocal() as session:
-                # 获取 LLM
-                llm = None
-                if model_id:
-                    llm = await LLMFactory.get_llm_by_id(session, model_id)
-                if not llm:
-                    # 尝试获取默认模型
-                    llm = await LLMFactory.get_default_llm(session)
-                
-                if not llm:
-                    mylog.error(f"[generate_article_task] 未找到可用的 LLM 模型")
-                    raise Exception("未找到可用的 LLM 模型，请先配置模型")
-                
-
-                
-                async for content_chunk in generate_article(state, llm=llm, db=session):
-                    complete_content += content_chunk
-                    total_chunks += 1
-                    
-                    redis_stream_manager.write_content(task_id, content_chunk)
-                    
-                    if total_chunks % 10 == 0:
-                        progress = min(90, int(total_chunks / 100))
-                        redis_stream_manager.update_task_meta(task_id, "processing", progress)
-            
-            redis_stream_manager.set_task_result(task_id, complete_content)
-            redis_stream_manager.update_task_meta(task_id, "completed", 100)
-            
-            async with AsyncSessionLocal() as session:
-                task_record = await session.get(AiTask, task_id)
-                if task_record:
-                    task_record.status = "completed"
-                    task_record.progress = 100
-                    task_record.result = complete_content
-                    task_record.completed_at = datetime.now()
-                    await session.commit()
+                # 调用限流按用户公平排队（上下文变量随本协程创建的子任务传递）
+                set_llm_user(user_id)
+                llm = await _get_llm(session, model_id)
+                complete_content = await _stream_with_checkpoints(
+                    task_id,
+                    outline_nodes(outline),
+                    lambda checkpoints, on_node_done: generate_article(
+                        state, llm=llm, db=session, checkpoints=checkpoints, on_node_done=on_node_done
+                    )
+                )
             
-            return {"status": "completed", "result": complete_content}
+            return await _complete_task(task_id, complete_content)
             
         except Exception as e:
+            if _should_retry(self, e):
+                raise _RetryFromCheckpoint(str(e)) from e
             error_msg = str(e)
             mylog.error(f"任务执行失败: {error_msg}")
             import traceback
             mylog.error(traceback.format_exc())
             
-            redis_stream_manager.update_task_meta(task_id, "failed", 0, error_msg)
+            await _mark_task_failed(task_id, error_msg)
+            raise
+    
+    return _run_in_worker(self, task_id, _run(), lambda msg: _mark_task_failed(task_id, msg))
+
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=2)
+def generate_article_part_task(self, task_id: str, index: int, outline_dict: dict, user_id: str = None, model_id: int = None):
+    """
+    分布式生成子任务：生成第 index 个一级章节，写入子任务 Stream（part_stream_id(task_id, index)）
+    
+    子任务以结束事件收尾，推送中心按顺序把各子任务 Stream 合并成一个输出流；
+    检查点、重新投递与软超时处理与 generate_article_task 相同，已写入结束事件的子任务重复投递时直接跳过。
+    任一子任务失败即标记整个任务失败（chord 回调不再执行），/resume 重新提交时已完成的子任务不会重复生成。
+    """
+    if worker_runtime.closing:
+        raise Reject("worker shutting down", requeue=True)
+    
+    part_id = part_stream_id(task_id, index)
+    
+    async def _fail(error_msg: str):
+        await async_redis_stream_manager.write_event(part_id, STREAM_EVENT_ERROR, error_msg)
+        await _mark_task_failed(task_id, error_msg)
+    
+    async def _run():
+        try:
+            # 其他子任务已失败时不再生成（/resume 会把状态重置为 pending 后重新分发）
+            finished = await _finished_status(task_id, ("completed", "cancelled", "failed"))
+            if finished:
+                mylog.info(f"[generate_article_part_task] 任务 {task_id} 已{finished}，跳过子任务 {index}")
+                return {"index": index, "status": finished}
+            last_entry = await async_redis_stream_manager.get_last_entry(part_id)
+            if last_entry and last_entry.get("event") == STREAM_EVENT_END:
+                mylog.info(f"[generate_article_part_task] 任务 {task_id} 子任务 {index} 已完成，跳过")
+                return {"index": index, "status": "completed"}
+            
+            await async_redis_stream_manager.update_task_meta(task_id, "processing", 0)
+            
+            outline = OutlineItem(**outline_dict)
+            state = ChapterGenerationState(outline)
             
             async with AsyncSessionLocal() as session:
-                task_record = await session.get(AiTask, task_id)
-                if task_record:
-                    task_record.status = "failed"
-                    task_record.error_message = error_msg
-                    await session.commit()
+                # 调用限流按用户公平排队（上下文变量随本协程创建的子任务传递）
+                set_llm_user(user_id)
+                llm = await _get_llm(session, model_id)
+                await _stream_with_checkpoints(
+                    part_id,
+                    _part_nodes(outline, index),
+                    lambda checkpoints, on_node_done: generate_article_part(
+                        state, llm, index, db=session, checkpoints=checkpoints, on_node_done=on_node_done
+                    ),
+                    report_progress=False,
+                    lease_id=task_id
+                )
             
+            await async_redis_stream_manager.write_event(part_id, STREAM_EVENT_END)
+            await async_redis_stream_manager.clear_checkpoints(part_id)
+            return {"index": index, "status": "completed"}
+            
+        except Exception as e:
+            if _should_retry(self, e):
+                raise _RetryFromCheckpoint(str(e)) from e
+            error_msg = str(e)
+            mylog.error(f"任务 {task_id} 子任务 {index} 执行失败: {error_msg}")
+            import traceback
+            mylog.error(traceback.format_exc())
+            
+            await _fail(error_msg)
             raise
     
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-    
-    try:
-        existing_loop = asyncio.get_event_loop()
-        if existing_loop.is_running():
-            existing_loop.close()
-    except RuntimeError:
-        pass
-    
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    return _run_in_worker(self, task_id, _run(), _fail)
+
+
+@celery_app.task(bind=True, acks_late=True)
+def finalize_article_task(self, part_results: list, task_id: str, parts: int):
+    """
+    分布式生成的 chord 回调：所有子任务完成后按顺序拼接各子任务 Stream 的内容，
+    保存结果并在主 Stream 写入结束事件（SSE 订阅方在最后一个子任务之后收到结束）
+    """
+    async def _run():
+        try:
+            finished = await _finished_status(task_id)
+            if finished:
+                return {"status": finished}
+            
+            contents = []
+            for index in range(parts):
+                entries = await async_redis_stream_manager.read_all_content(part_stream_id(task_id, index))
+                contents.append("".join(entry["content"] for entry in entries if not entry.get("event")))
+            complete_content = "".join(contents)
+            
+            return await _complete_task(task_id, complete_content, parts)
+        except Exception as e:
+            mylog.error(f"任务 {task_id} 合并子任务结果失败: {e}")
+            await _mark_task_failed(task_id, str(e))
+            raise
     
-    try:
-        return loop.run_until_complete(_run())
-    finally:
+    return worker_runtime.run(_run())
+
+
+def dispatch_article(task_id: str, outline_dict: dict, user_id: str = None, model_id: int = None, parts: int = 0) -> None:
+    """分发文章生成任务：parts 为子任务数（元信息 parts 字段），大于 0 时按一级章节分布式生成"""
+    if parts:
+        dispatch_distributed_article(task_id, outline_dict, user_id, model_id)
+    else:
+        generate_article_task.delay(task_id, outline_dict, user_id, model_id)
+
+
+async def dispatch_article_async(
+    task_id: str, outline_dict: dict, user_id: str = None, model_id: int = None, parts: int = 0
+) -> None:
+    """
+    dispatch_article 的异步版本，供 API 路由与 Worker 的事件循环使用：
+    Celery 发布（含分布式任务的 Stream 截断与 chord 发布）为同步调用，可能因 Broker 变慢而阻塞，放到线程池执行
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, dispatch_article, task_id, outline_dict, user_id, model_id, parts)
+
+
+async def dispatch_admitted(task_ids: List[str]) -> None:
+    """
+    分发准入控制放行的排队任务（排队期间已被取消的跳过）
+    在 API 进程与 Worker 的事件循环中调用：Redis 走异步客户端，分发走 dispatch_article_async
+    """
+    for task_id in task_ids:
         try:
-            pending = asyncio.all_tasks(loop)
-            for task in pending:
-                task.cancel()
-            if pending:
-                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            async with AsyncSessionLocal() as session:
+                task_record = await session.get(AiTask, task_id)
+                if not task_record or task_record.status != "queued":
+                    mylog.warning(f"[dispatch_admitted] 任务 {task_id} 不在排队状态，释放占用")
+                    task_ids.extend(await admission_controller.release_async(task_id))
+                    continue
+                task_record.status = "pending"
+                task_record.updated_at = datetime.now()
+                await session.commit()
+                outline_dict = json.loads(task_record.input_params or "{}")
+                user_id, model_id = task_record.user_id, task_record.model_id
+            
+            meta = await async_redis_stream_manager.get_task_meta(task_id) or {}
+            await async_redis_stream_manager.update_task_meta(task_id, "pending", 0)
+            await dispatch_article_async(task_id, outline_dict, user_id, model_id, meta.get("parts", 0))
+            mylog.info(f"[dispatch_admitted] 排队任务 {task_id} 已放行")
         except Exception as e:
-            mylog.error(f"清理任务时出错: {e}")
-        finally:
-            try:
-                loop.close()
-            except Exception:
-                pass
-            asyncio.set_event_loop(None)
+            mylog.error(f"[dispatch_admitted] 分发排队任务 {task_id} 失败: {e}")
 
+
+def dispatch_distributed_article(task_id: str, outline_dict: dict, user_id: str = None, model_id: int = None) -> int:
+    """
+    按一级章节把文章拆成子任务（group）并行生成，全部完成后由 finalize_article_task 汇总（chord），返回子任务数。
+    调用前需通过 set_task_parts 把子任务数写入元信息，推送中心据此合并子任务 Stream。
+    """
+    parts = len(outline_dict.get("children") or [])
+    # 主 Stream 只承载结束 / 失败事件，重新提交时清掉上次运行留下的事件
+    redis_stream_manager.truncate_stream(task_id, 0)
+    header = group(
+        generate_article_part_task.s(task_id, index, outline_dict, user_id, model_id)
+        for index in range(parts)
+    )
+    chord(header)(finalize_article_task.s(task_id, parts))
+    return parts
@@ -7,7 +7,7 @@ Celery 应用配置
 2. 显式设置默认队列为 `celery`，避免 Worker 以 `-Q` 监听其它队列时收不到默认任务。
 """
 from celery import Celery
-from config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND
+from config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, ARTICLE_WORKER_MODE, ARTICLE_WORKER_ASYNC_CONCURRENCY
 
 # 创建 Celery 应用
 celery_app = Celery(
@@ -34,6 +34,14 @@ celery_app.conf.update(
     task_default_queue='celery'
 )
 
+# asyncio 模式：线程池只负责收取消息并等待结果，文章协程在进程内常驻事件循环上并发执行
+# （见 tasks/worker_runtime.py）；命令行 --concurrency 会覆盖这里的线程数，需不小于 ARTICLE_WORKER_ASYNC_CONCURRENCY
+if ARTICLE_WORKER_MODE == "asyncio":
+    celery_app.conf.update(
+        worker_pool='threads',
+        worker_concurrency=ARTICLE_WORKER_ASYNC_CONCURRENCY
+    )
+
 # 为了兼容命令 `celery -A tasks.celery_app worker`
 # Celery CLI 会默认寻找变量名 `celery` 的应用实例
 celery = celery_app
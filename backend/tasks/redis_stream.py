@@ -1,17 +1,295 @@
 """
 Redis Stream 工具类
 用于管理任务流式内容的存储和读取
+- RedisStreamManager：同步客户端，Celery Worker 写入使用
+- AsyncRedisStreamManager：redis.asyncio 客户端 + 连接池，FastAPI 异步接口（SSE 等）与 Worker 事件循环上的生成任务使用，避免阻塞事件循环
 """
 import redis
+import redis.asyncio as aioredis
 import json
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from config import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD
+from typing import List, Dict, Optional, Tuple
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD,
+    REDIS_ASYNC_MAX_CONNECTIONS, STREAM_READ_BLOCK_MS, TASK_RESULT_RETENTION
+)
+from utils.compression import compress_text
 from utils.logger import mylog
 
 
-class RedisStreamManager:
-    """Redis Stream 管理器"""
+# Stream 中的事件条目（字段 event / message），与内容条目（字段 content）共用一个 Stream
+STREAM_EVENT_END = "end"
+STREAM_EVENT_ERROR = "error"
+STREAM_EVENT_CANCELLED = "cancelled"
+TERMINAL_STREAM_EVENTS = (STREAM_EVENT_END, STREAM_EVENT_ERROR, STREAM_EVENT_CANCELLED)
+# truncate_stream 删除过条目（断点续写丢弃残留输出）后追加的标记：已读过被删条目的订阅方需从头回放
+STREAM_EVENT_TRUNCATED = "truncated"
+
+
+def part_stream_id(task_id: str, index: int) -> str:
+    """
+    分布式生成中第 index 个子任务的 Stream 标识：task:{task_id}:part:{index}:stream
+    子任务的 Stream / 检查点直接复用本模块按 task_id 组织 key 的各方法
+    """
+    return f"{task_id}:part:{index}"
+
+
+class _StreamWriterBase:
+    """
+    单个任务的批量写入器（同步 / 异步共用的命令缓冲）：
+    - write / write_event / update_meta / save_checkpoint 只把命令放进 pipeline，flush 时一次往返发送
+    - Stream 的 EXPIRE 只在首次 flush 时设置一次，close 时再续期一次
+    - XADD 不裁剪：回放、断点续写的字符偏移与子任务合并都依赖 Stream 从头完整，长度由完成后的过期时间回收
+    用法：
+        with redis_stream_manager.writer(task_id) as writer:
+            writer.write(chunk)
+            writer.flush()
+        async with async_redis_stream_manager.writer(task_id) as writer:
+            writer.write(chunk)
+            await writer.flush()
+    """
+
+    def __init__(self, manager: "_TaskStreamKeys", task_id: str):
+        self.manager = manager
+        self.task_id = task_id
+        self.stream_key = manager._get_stream_key(task_id)
+        self.meta_key = manager._get_meta_key(task_id)
+        self.checkpoint_key = manager._get_checkpoint_key(task_id)
+        self._pipe = manager.redis_client.pipeline(transaction=False)
+        self._pending = 0
+        self._has_entries = False
+        self._expire_set = False
+        self.closed = False
+
+    def write(self, content: str) -> None:
+        """追加内容片段（未发送，等待 flush）"""
+        self._pipe.xadd(self.stream_key, {"content": content})
+        self._pending += 1
+        self._has_entries = True
+
+    def write_event(self, event: str, message: str = "") -> None:
+        """追加事件条目（如结束 / 失败），订阅方据此结束推送"""
+        self._pipe.xadd(self.stream_key, {"event": event, "message": message or ""})
+        self._pending += 1
+        self._has_entries = True
+
+    def update_meta(self, status: str, progress: int = 0, error_message: Optional[str] = None,
+                    current_section: Optional[str] = None) -> None:
+        """更新任务元信息（随下一次 flush 一起发送）"""
+        self._pipe.hset(self.meta_key, mapping=self.manager._build_meta(status, progress, error_message, current_section))
+        self._pipe.expire(self.meta_key, timedelta(days=self.manager.stream_expire_days))
+        self._pending += 1
+
+    def save_checkpoint(self, path: str, body: str, offset: int) -> None:
+        """保存章节检查点（随下一次 flush 一起发送），参数见 RedisStreamManager.save_checkpoint"""
+        self._pipe.hset(self.checkpoint_key, path, self.manager._checkpoint_value(body, offset))
+        self._pipe.expire(self.checkpoint_key, timedelta(days=self.manager.stream_expire_days))
+        self._pending += 1
+
+    def _begin_flush(self) -> bool:
+        """flush 前补上 Stream 的首次 EXPIRE，返回本次是否设置了过期时间"""
+        set_expire = self._has_entries and not self._expire_set
+        if set_expire:
+            self._pipe.expire(self.stream_key, timedelta(days=self.manager.stream_expire_days))
+        return set_expire
+
+    def _begin_close(self) -> None:
+        if self._has_entries and self._expire_set:
+            self._pipe.expire(self.stream_key, timedelta(days=self.manager.stream_expire_days))
+            self._pending += 1
+
+
+class RedisStreamWriter(_StreamWriterBase):
+    """同步批量写入器（redis_stream_manager.writer）"""
+
+    def flush(self) -> bool:
+        """发送积压的命令（一次往返）"""
+        if not self._pending:
+            return True
+        set_expire = self._begin_flush()
+        try:
+            self._pipe.execute()
+            if set_expire:
+                self._expire_set = True
+            return True
+        except Exception as e:
+            mylog.error(f"批量写入 Redis Stream 失败: {e}")
+            self._pipe.reset()
+            return False
+        finally:
+            self._pending = 0
+
+    def close(self) -> bool:
+        """发送剩余命令并为 Stream 续期，之后不可再写入"""
+        if self.closed:
+            return True
+        self._begin_close()
+        ok = self.flush()
+        self.closed = True
+        return ok
+
+    def __enter__(self) -> "RedisStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class AsyncRedisStreamWriter(_StreamWriterBase):
+    """异步批量写入器（async_redis_stream_manager.writer），供 Worker 事件循环上的生成任务使用"""
+
+    async def flush(self) -> bool:
+        """发送积压的命令（一次往返）"""
+        if not self._pending:
+            return True
+        set_expire = self._begin_flush()
+        try:
+            await self._pipe.execute()
+            if set_expire:
+                self._expire_set = True
+            return True
+        except Exception as e:
+            mylog.error(f"批量写入 Redis Stream 失败: {e}")
+            await self._pipe.reset()
+            return False
+        finally:
+            self._pending = 0
+
+    async def close(self) -> bool:
+        """发送剩余命令并为 Stream 续期，之后不可再写入"""
+        if self.closed:
+            return True
+        self._begin_close()
+        ok = await self.flush()
+        self.closed = True
+        return ok
+
+    async def __aenter__(self) -> "AsyncRedisStreamWriter":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+
+class _TaskStreamKeys:
+    """同步 / 异步管理器共用的 key 规则与数据格式"""
+    
+    stream_expire_days = 7
+    
+    def _get_stream_key(self, task_id: str) -> str:
+        """获取 Stream key"""
+        return f"task:{task_id}:stream"
+    
+    def _get_meta_key(self, task_id: str) -> str:
+        """获取任务元信息 key"""
+        return f"task:{task_id}:meta"
+    
+    def _get_checkpoint_key(self, task_id: str) -> str:
+        """获取章节检查点 key（hash：节点路径 -> 正文及其在整篇输出中的结束位置）"""
+        return f"task:{task_id}:ckpt"
+    
+    def _task_keys(self, task_id: str, parts: int = 0) -> List[str]:
+        """任务相关的全部 key（分布式生成时包含各子任务的 Stream 与检查点）"""
+        keys = [self._get_stream_key(task_id), self._get_meta_key(task_id), self._get_checkpoint_key(task_id)]
+        for index in range(parts):
+            part_id = part_stream_id(task_id, index)
+            keys += [self._get_stream_key(part_id), self._get_checkpoint_key(part_id)]
+        return keys
+    
+    def _build_meta(self, status: str, progress: int = 0, error_message: Optional[str] = None,
+                    current_section: Optional[str] = None) -> Dict[str, str]:
+        """组装任务元信息字段"""
+        meta_data = {
+            "status": status,
+            "progress": str(progress),
+            "updated_at": datetime.now().isoformat()
+        }
+        if error_message:
+            meta_data["error_message"] = error_message
+        if current_section is not None:
+            meta_data["current_section"] = current_section
+        return meta_data
+    
+    @staticmethod
+    def _checkpoint_value(body: str, offset: int) -> str:
+        return json.dumps({"body": body, "offset": offset}, ensure_ascii=False)
+    
+    @staticmethod
+    def _parse_checkpoints(raw: Dict[str, str]) -> Dict[str, Dict]:
+        checkpoints = {}
+        for path, value in raw.items():
+            try:
+                checkpoints[path] = json.loads(value)
+            except (TypeError, ValueError):
+                continue
+        return checkpoints
+    
+    @staticmethod
+    def _truncate_plan(entries, keep_chars: int) -> Tuple[List[str], str, int]:
+        """
+        truncate_stream 的截断方案：返回（需删除的条目 ID，跨边界条目在边界内的部分，边界之前完整保留的字符数）
+        截断标记跳过；遇到其他事件条目（上次运行的结束 / 失败事件）时其后全部删除
+        """
+        kept = 0
+        head = ""
+        stale_from = len(entries)
+        for index, (_, fields) in enumerate(entries):
+            if fields.get("event") == STREAM_EVENT_TRUNCATED:
+                continue
+            if "event" in fields:
+                stale_from = index
+                break
+            content = fields.get("content", "")
+            if kept + len(content) > keep_chars:
+                head = content[:keep_chars - kept]
+                stale_from = index
+                break
+            kept += len(content)
+            if kept == keep_chars:
+                stale_from = index + 1
+                break
+        return [msg_id for msg_id, _ in entries[stale_from:]], head, kept
+    
+    @staticmethod
+    def _result_mapping(result: str, mode: str) -> Dict[str, str]:
+        """set_task_result 写入元信息的字段（保留方式见 set_task_result）"""
+        mapping = {"completed_at": datetime.now().isoformat()}
+        if mode == "full":
+            mapping["result"] = result
+        elif mode == "compressed":
+            mapping["result"] = compress_text(result)
+        else:
+            mapping["result_ref"] = "ai_task"
+        return mapping
+    
+    @staticmethod
+    def _parse_messages(messages) -> List[Dict]:
+        """
+        Stream 条目转为 [{"id": "xxx", "content": "xxx"}, ...]
+        事件条目额外带 event / message 字段，content 为空
+        """
+        result = []
+        for msg_id, fields in messages:
+            item = {"id": msg_id, "content": fields.get("content", "")}
+            if "event" in fields:
+                item["event"] = fields["event"]
+                item["message"] = fields.get("message", "")
+            result.append(item)
+        return result
+    
+    @staticmethod
+    def _parse_meta(meta_data: Dict) -> Optional[Dict]:
+        """元信息 hash 转换：progress 转为整数，空 hash 返回 None"""
+        if not meta_data:
+            return None
+        meta_data["progress"] = int(meta_data.get("progress", 0))
+        if "parts" in meta_data:
+            meta_data["parts"] = int(meta_data["parts"])
+        return meta_data
+
+
+class RedisStreamManager(_TaskStreamKeys):
+    """Redis Stream 管理器（同步）"""
     
     def __init__(self):
         self.redis_client = redis.Redis(
@@ -21,27 +299,124 @@ class RedisStreamManager:
             password=REDIS_PASSWORD,
             decode_responses=True
         )
-        self.stream_expire_days = 7
     
-    def _get_stream_key(self, task_id: str) -> str:
-        """获取 Stream key"""
-        return f"task:{task_id}:stream"
+    def writer(self, task_id: str) -> RedisStreamWriter:
+        """创建任务的批量写入器（生成任务内使用，替代逐片 write_content）"""
+        return RedisStreamWriter(self, task_id)
     
-    def _get_meta_key(self, task_id: str) -> str:
-        """获取任务元信息 key"""
-        return f"task:{task_id}:meta"
+    def write_content(self, task_id: str, content: str) -> Optional[str]:
+        """
+        写入单个内容片段到 Redis Stream（XADD 与 EXPIRE 合并为一次往返）
+        返回写入条目的 Stream ID，失败返回 None
+        """
+        try:
+            stream_key = self._get_stream_key(task_id)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.xadd(stream_key, {"content": content})
+            pipe.expire(stream_key, timedelta(days=self.stream_expire_days))
+            entry_id, _ = pipe.execute()
+            return entry_id
+        except Exception as e:
+            mylog.error(f"写入 Redis Stream 失败: {e}")
+            return None
     
-    def write_content(self, task_id: str, content: str) -> bool:
+    def write_event(self, task_id: str, event: str, message: str = "") -> bool:
         """
-        写入内容片段到 Redis Stream
+        写入事件条目（end / error / cancelled），SSE 订阅方收到后结束推送
         """
         try:
             stream_key = self._get_stream_key(task_id)
-            self.redis_client.xadd(stream_key, {"content": content})
-            self.redis_client.expire(stream_key, timedelta(days=self.stream_expire_days))
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.xadd(stream_key, {"event": event, "message": message or ""})
+            pipe.expire(stream_key, timedelta(days=self.stream_expire_days))
+            pipe.execute()
             return True
         except Exception as e:
-            mylog.error(f"写入 Redis Stream 失败: {e}")
+            mylog.error(f"写入 Stream 事件失败: {e}")
+            return False
+    
+    def get_last_entry(self, task_id: str) -> Optional[Dict]:
+        """
+        获取 Stream 最后一个条目（Stream 不存在时返回 None）
+        """
+        try:
+            latest = self.redis_client.xrevrange(self._get_stream_key(task_id), "+", "-", count=1)
+            return self._parse_messages(latest)[0] if latest else None
+        except Exception as e:
+            mylog.error(f"读取 Stream 最新条目失败: {e}")
+            return None
+    
+    def truncate_stream(self, task_id: str, keep_chars: int) -> int:
+        """
+        只保留 Stream 中前 keep_chars 个字符的内容，用于断点续写前丢弃未完成章节的残留输出和上次运行的结束事件
+        跨越边界的条目会被删除并把边界内的部分以新 ID 重新追加到末尾（其后条目已全部删除，顺序不变）
+        删除过条目时再追加一个 truncated 标记：被删条目的 ID 不再存在，已读过它们的订阅方（正在推送的连接、
+        带着被删 ID 重连的客户端）由推送中心（tasks/stream_hub.py）从头回放
+        返回实际保留的字符数；失败时抛出异常，避免续写出重复内容
+        """
+        try:
+            stream_key = self._get_stream_key(task_id)
+            if keep_chars <= 0:
+                if self.redis_client.delete(stream_key):
+                    self._mark_truncated(stream_key)
+                return 0
+            stale_ids, head, kept = self._truncate_plan(self.redis_client.xrange(stream_key, "-", "+"), keep_chars)
+            if stale_ids:
+                self.redis_client.xdel(stream_key, *stale_ids)
+            if head:
+                self.redis_client.xadd(stream_key, {"content": head})
+                kept += len(head)
+            if stale_ids:
+                self._mark_truncated(stream_key)
+            return kept
+        except Exception as e:
+            mylog.error(f"截断 Redis Stream 失败: {e}")
+            raise
+    
+    def _mark_truncated(self, stream_key: str) -> None:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.xadd(stream_key, {"event": STREAM_EVENT_TRUNCATED, "message": ""})
+        pipe.expire(stream_key, timedelta(days=self.stream_expire_days))
+        pipe.execute()
+    
+    def save_checkpoint(self, task_id: str, path: str, body: str, offset: int) -> bool:
+        """
+        保存章节检查点
+        - path: 节点路径（如 "1.2"）
+        - body: 该节点正文（不含标题）
+        - offset: 该节点输出结束时整篇输出的累计字符数
+        """
+        try:
+            ckpt_key = self._get_checkpoint_key(task_id)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(ckpt_key, path, self._checkpoint_value(body, offset))
+            pipe.expire(ckpt_key, timedelta(days=self.stream_expire_days))
+            pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"保存章节检查点失败: {e}")
+            return False
+    
+    def load_checkpoints(self, task_id: str) -> Dict[str, Dict]:
+        """
+        读取任务的全部章节检查点
+        返回格式: {"1.2": {"body": "xxx", "offset": 123}, ...}
+        """
+        try:
+            return self._parse_checkpoints(self.redis_client.hgetall(self._get_checkpoint_key(task_id)))
+        except Exception as e:
+            mylog.error(f"读取章节检查点失败: {e}")
+            return {}
+    
+    def clear_checkpoints(self, task_id: str) -> bool:
+        """
+        删除任务的章节检查点
+        """
+        try:
+            self.redis_client.delete(self._get_checkpoint_key(task_id))
+            return True
+        except Exception as e:
+            mylog.error(f"删除章节检查点失败: {e}")
             return False
     
     def read_all_content(self, task_id: str) -> List[Dict]:
@@ -52,60 +427,39 @@ class RedisStreamManager:
         try:
             stream_key = self._get_stream_key(task_id)
             messages = self.redis_client.xrange(stream_key, "-", "+")
-            result = []
-            for msg_id, fields in messages:
-                result.append({
-                    "id": msg_id,
-                    "content": fields.get("content", "")
-                })
-            return result
+            return self._parse_messages(messages)
         except Exception as e:
             mylog.error(f"读取 Redis Stream 失败: {e}")
             return []
     
-    def read_new_content(self, task_id: str, last_id: str = "0") -> List[Dict]:
+    def read_new_content(self, task_id: str, last_id: str = "0", block_ms: Optional[int] = None) -> List[Dict]:
         """
-        读取新内容（从指定 ID 之后）
+        读取新内容（从指定 ID 之后），最多阻塞 block_ms 毫秒（缺省取配置 STREAM_READ_BLOCK_MS）
         """
         try:
             stream_key = self._get_stream_key(task_id)
             if last_id == "0":
                 messages = self.redis_client.xrange(stream_key, "-", "+")
             else:
-                messages = self.redis_client.xread({stream_key: last_id}, count=100, block=0)
-                if messages:
-                    messages = messages[0][1]
-                else:
-                    messages = []
-            
-            result = []
-            for msg_id, fields in messages:
-                result.append({
-                    "id": msg_id,
-                    "content": fields.get("content", "")
-                })
-            return result
+                block = STREAM_READ_BLOCK_MS if block_ms is None else block_ms
+                messages = self.redis_client.xread({stream_key: last_id}, count=100, block=block)
+                messages = messages[0][1] if messages else []
+            return self._parse_messages(messages)
         except Exception as e:
             mylog.error(f"读取新内容失败: {e}")
             return []
     
     def update_task_meta(self, task_id: str, status: str, progress: int = 0, 
-                        error_message: Optional[str] = None) -> bool:
+                        error_message: Optional[str] = None, current_section: Optional[str] = None) -> bool:
         """
         更新任务元信息
         """
         try:
             meta_key = self._get_meta_key(task_id)
-            meta_data = {
-                "status": status,
-                "progress": str(progress),
-                "updated_at": datetime.now().isoformat()
-            }
-            if error_message:
-                meta_data["error_message"] = error_message
-            
-            self.redis_client.hset(meta_key, mapping=meta_data)
-            self.redis_client.expire(meta_key, timedelta(days=self.stream_expire_days))
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(meta_key, mapping=self._build_meta(status, progress, error_message, current_section))
+            pipe.expire(meta_key, timedelta(days=self.stream_expire_days))
+            pipe.execute()
             return True
         except Exception as e:
             mylog.error(f"更新任务元信息失败: {e}")
@@ -117,42 +471,285 @@ class RedisStreamManager:
         """
         try:
             meta_key = self._get_meta_key(task_id)
-            meta_data = self.redis_client.hgetall(meta_key)
-            if meta_data:
-                meta_data["progress"] = int(meta_data.get("progress", 0))
-            return meta_data if meta_data else None
+            return self._parse_meta(self.redis_client.hgetall(meta_key))
         except Exception as e:
             mylog.error(f"获取任务元信息失败: {e}")
             return None
     
-    def set_task_result(self, task_id: str, result: str) -> bool:
+    def set_task_result(self, task_id: str, result: str, retention: Optional[str] = None) -> bool:
         """
-        设置任务最终结果
+        设置任务最终结果，按保留方式（缺省取配置 TASK_RESULT_RETENTION）决定元信息中保存的内容：
+        full 保存完整结果，compressed 保存压缩结果（读取时用 decompress_text 还原），pointer 不保存结果
         """
         try:
+            mode = retention or TASK_RESULT_RETENTION
             meta_key = self._get_meta_key(task_id)
-            self.redis_client.hset(meta_key, "result", result)
-            self.redis_client.hset(meta_key, "completed_at", datetime.now().isoformat())
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(meta_key, mapping=self._result_mapping(result, mode))
+            if mode not in ("full", "compressed"):
+                # 结果只在任务表中，元信息里可能残留的旧结果一并删除
+                pipe.hdel(meta_key, "result")
+            pipe.execute()
             return True
         except Exception as e:
             mylog.error(f"设置任务结果失败: {e}")
             return False
     
+    def expire_task_streams(self, task_id: str, seconds: int, parts: int = 0) -> bool:
+        """
+        缩短任务（及各子任务）Stream 的保留时间，任务完成后调用；到期后 SSE 从任务表读取结果
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.expire(self._get_stream_key(task_id), seconds)
+            for index in range(parts):
+                pipe.expire(self._get_stream_key(part_stream_id(task_id, index)), seconds)
+            pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"缩短 Stream 保留时间失败: {e}")
+            return False
+    
     def delete_task(self, task_id: str) -> bool:
         """
         删除任务相关的 Redis 数据
         """
+        try:
+            parts = self.redis_client.hget(self._get_meta_key(task_id), "parts")
+            self.redis_client.delete(*self._task_keys(task_id, int(parts or 0)))
+            return True
+        except Exception as e:
+            mylog.error(f"删除任务数据失败: {e}")
+            return False
+
+
+class AsyncRedisStreamManager(_TaskStreamKeys):
+    """
+    Redis Stream 管理器（异步）
+    供 FastAPI 路由与 Worker 常驻事件循环上的生成任务（tasks/worker_runtime.py）使用：所有命令走 redis.asyncio 连接池，
+    XREAD 只做有限时长阻塞，不会卡住事件循环上的其他请求或其他文章的模型流
+    """
+    
+    def __init__(self):
+        self.pool = aioredis.ConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            password=REDIS_PASSWORD,
+            decode_responses=True,
+            max_connections=REDIS_ASYNC_MAX_CONNECTIONS
+        )
+        self.redis_client = aioredis.Redis(connection_pool=self.pool)
+    
+    async def read_all_content(self, task_id: str) -> List[Dict]:
+        """
+        读取所有已生成的内容
+        返回格式: [{"id": "xxx", "content": "xxx"}, ...]
+        """
+        try:
+            messages = await self.redis_client.xrange(self._get_stream_key(task_id), "-", "+")
+            return self._parse_messages(messages)
+        except Exception as e:
+            mylog.error(f"读取 Redis Stream 失败: {e}")
+            return []
+    
+    async def read_content_after(self, task_id: str, last_id: str) -> List[Dict]:
+        """
+        读取 last_id 之后的全部内容（不含 last_id 本身），用于断线重连时只补发错过的部分
+        """
+        try:
+            messages = await self.redis_client.xrange(self._get_stream_key(task_id), last_id, "+")
+            return self._parse_messages([(msg_id, fields) for msg_id, fields in messages if msg_id != last_id])
+        except Exception as e:
+            mylog.error(f"读取 Redis Stream 失败: {e}")
+            return []
+    
+    async def has_entry(self, task_id: str, entry_id: str) -> bool:
+        """Stream 中是否存在该条目（被 truncate_stream 删除或 Stream 已过期时返回 False）"""
+        try:
+            return bool(await self.redis_client.xrange(self._get_stream_key(task_id), entry_id, entry_id, count=1))
+        except Exception as e:
+            mylog.error(f"读取 Redis Stream 失败: {e}")
+            return True
+    
+    async def read_new_content(self, task_id: str, last_id: str = "0", block_ms: Optional[int] = None) -> List[Dict]:
+        """
+        读取 last_id 之后的新内容，无新内容时最多阻塞 block_ms 毫秒（缺省取配置 STREAM_READ_BLOCK_MS，0 表示不阻塞）
+        """
+        try:
+            block = STREAM_READ_BLOCK_MS if block_ms is None else block_ms
+            messages = await self.redis_client.xread(
+                {self._get_stream_key(task_id): last_id or "0"}, count=100, block=block if block > 0 else None
+            )
+            return self._parse_messages(messages[0][1]) if messages else []
+        except Exception as e:
+            mylog.error(f"读取新内容失败: {e}")
+            return []
+    
+    async def get_last_entry(self, task_id: str) -> Optional[Dict]:
+        """获取 Stream 最后一个条目（Stream 不存在时返回 None）"""
+        try:
+            latest = await self.redis_client.xrevrange(self._get_stream_key(task_id), "+", "-", count=1)
+            return self._parse_messages(latest)[0] if latest else None
+        except Exception as e:
+            mylog.error(f"读取 Stream 最新条目失败: {e}")
+            return None
+    
+    async def get_last_id(self, task_id: str) -> str:
+        """获取 Stream 最新条目 ID（Stream 不存在时返回 "0-0"），作为阻塞读取的起点"""
+        latest = await self.get_last_entry(task_id)
+        return latest["id"] if latest else "0-0"
+    
+    async def set_task_parts(self, task_id: str, parts: int) -> bool:
+        """
+        记录分布式生成的子任务数（元信息 parts 字段），推送中心据此按顺序合并各子任务的 Stream
+        """
+        try:
+            meta_key = self._get_meta_key(task_id)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(meta_key, "parts", str(parts))
+                pipe.expire(meta_key, timedelta(days=self.stream_expire_days))
+                await pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"记录子任务数失败: {e}")
+            return False
+    
+    def writer(self, task_id: str) -> AsyncRedisStreamWriter:
+        """创建任务的异步批量写入器（Worker 事件循环上的生成任务使用）"""
+        return AsyncRedisStreamWriter(self, task_id)
+    
+    async def truncate_stream(self, task_id: str, keep_chars: int) -> int:
+        """truncate_stream 的异步版本（语义见 RedisStreamManager.truncate_stream），失败时抛出异常"""
+        try:
+            stream_key = self._get_stream_key(task_id)
+            if keep_chars <= 0:
+                if await self.redis_client.delete(stream_key):
+                    await self._mark_truncated(stream_key)
+                return 0
+            stale_ids, head, kept = self._truncate_plan(await self.redis_client.xrange(stream_key, "-", "+"), keep_chars)
+            if stale_ids:
+                await self.redis_client.xdel(stream_key, *stale_ids)
+            if head:
+                await self.redis_client.xadd(stream_key, {"content": head})
+                kept += len(head)
+            if stale_ids:
+                await self._mark_truncated(stream_key)
+            return kept
+        except Exception as e:
+            mylog.error(f"截断 Redis Stream 失败: {e}")
+            raise
+    
+    async def _mark_truncated(self, stream_key: str) -> None:
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.xadd(stream_key, {"event": STREAM_EVENT_TRUNCATED, "message": ""})
+            pipe.expire(stream_key, timedelta(days=self.stream_expire_days))
+            await pipe.execute()
+    
+    async def load_checkpoints(self, task_id: str) -> Dict[str, Dict]:
+        """读取任务的全部章节检查点，格式见 RedisStreamManager.load_checkpoints"""
+        try:
+            return self._parse_checkpoints(await self.redis_client.hgetall(self._get_checkpoint_key(task_id)))
+        except Exception as e:
+            mylog.error(f"读取章节检查点失败: {e}")
+            return {}
+    
+    async def clear_checkpoints(self, task_id: str) -> bool:
+        """删除任务的章节检查点"""
+        try:
+            await self.redis_client.delete(self._get_checkpoint_key(task_id))
+            return True
+        except Exception as e:
+            mylog.error(f"删除章节检查点失败: {e}")
+            return False
+    
+    async def set_task_result(self, task_id: str, result: str, retention: Optional[str] = None) -> bool:
+        """设置任务最终结果，保留方式见 RedisStreamManager.set_task_result"""
+        try:
+            mode = retention or TASK_RESULT_RETENTION
+            meta_key = self._get_meta_key(task_id)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(meta_key, mapping=self._result_mapping(result, mode))
+                if mode not in ("full", "compressed"):
+                    pipe.hdel(meta_key, "result")
+                await pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"设置任务结果失败: {e}")
+            return False
+    
+    async def expire_task_streams(self, task_id: str, seconds: int, parts: int = 0) -> bool:
+        """缩短任务（及各子任务）Stream 的保留时间，任务完成后调用"""
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.expire(self._get_stream_key(task_id), seconds)
+                for index in range(parts):
+                    pipe.expire(self._get_stream_key(part_stream_id(task_id, index)), seconds)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"缩短 Stream 保留时间失败: {e}")
+            return False
+    
+    async def write_event(self, task_id: str, event: str, message: str = "") -> bool:
+        """
+        写入事件条目（end / error / cancelled）
+        """
         try:
             stream_key = self._get_stream_key(task_id)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.xadd(stream_key, {"event": event, "message": message or ""})
+                pipe.expire(stream_key, timedelta(days=self.stream_expire_days))
+                await pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"写入 Stream 事件失败: {e}")
+            return False
+    
+    async def update_task_meta(self, task_id: str, status: str, progress: int = 0,
+                               error_message: Optional[str] = None, current_section: Optional[str] = None) -> bool:
+        """
+        更新任务元信息
+        """
+        try:
             meta_key = self._get_meta_key(task_id)
-            self.redis_client.delete(stream_key)
-            self.redis_client.delete(meta_key)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(meta_key, mapping=self._build_meta(status, progress, error_message, current_section))
+                pipe.expire(meta_key, timedelta(days=self.stream_expire_days))
+                await pipe.execute()
+            return True
+        except Exception as e:
+            mylog.error(f"更新任务元信息失败: {e}")
+            return False
+    
+    async def get_task_meta(self, task_id: str) -> Optional[Dict]:
+        """
+        获取任务元信息
+        """
+        try:
+            return self._parse_meta(await self.redis_client.hgetall(self._get_meta_key(task_id)))
+        except Exception as e:
+            mylog.error(f"获取任务元信息失败: {e}")
+            return None
+    
+    async def delete_task(self, task_id: str) -> bool:
+        """
+        删除任务相关的 Redis 数据
+        """
+        try:
+            parts = await self.redis_client.hget(self._get_meta_key(task_id), "parts")
+            await self.redis_client.delete(*self._task_keys(task_id, int(parts or 0)))
             return True
         except Exception as e:
             mylog.error(f"删除任务数据失败: {e}")
             return False
+    
+    async def close(self) -> None:
+        """关闭连接池（应用退出时调用）"""
+        await self.pool.disconnect()
 
 
 # 全局实例
 redis_stream_manager = RedisStreamManager()
+async_redis_stream_manager = AsyncRedisStreamManager()
 
@@ -0,0 +1,284 @@
+"""
+任务 Stream 推送中心
+同一进程内，每个正在被订阅的任务只有一个阻塞 XREAD 读取协程，读到的新条目广播给该任务的所有 SSE 订阅者：
+- Redis 负载与订阅人数无关（每个任务一个读取连接 + 阻塞超时时一次元信息检查）
+- 新内容写入后立即推送，不再按 0.5s 轮询
+- 结束 / 失败 / 取消以 Stream 事件条目送达；旧任务（无事件条目）回退到元信息状态
+- 分布式生成的任务（元信息带 parts）依次读取各子任务 Stream，最后读取主 Stream，对订阅方呈现为一个有序输出流；
+  子任务的结束事件只用于切换到下一个子任务，不下发。条目 ID 形如 "子任务序号:Stream ID"（主 Stream 序号为 parts）
+- 断点续写会删除 Stream 中未完成章节的残留条目（truncate_stream），已读过这些条目的订阅方从头回放，
+  回放批次以 reset 事件开头，SSE 接口据此通知客户端整体替换已收到的内容
+"""
+import asyncio
+from typing import AsyncGenerator, Dict, List, Optional, Set, Tuple
+
+from config import STREAM_READ_BLOCK_MS
+from tasks.redis_stream import (
+    async_redis_stream_manager, AsyncRedisStreamManager, part_stream_id,
+    STREAM_EVENT_END, STREAM_EVENT_ERROR, STREAM_EVENT_CANCELLED, STREAM_EVENT_TRUNCATED, TERMINAL_STREAM_EVENTS
+)
+from utils.logger import mylog
+
+# 推送中心合成的事件（不写入 Stream）：本批从头回放，订阅方需丢弃此前收到的内容
+STREAM_EVENT_RESET = "reset"
+
+
+# 元信息终态 -> 对应的 Stream 事件（兼容没有写事件条目的任务）
+_META_STATUS_EVENTS = {
+    "completed": STREAM_EVENT_END,
+    "failed": STREAM_EVENT_ERROR,
+    "rejected": STREAM_EVENT_ERROR,
+    "cancelled": STREAM_EVENT_CANCELLED,
+}
+
+
+def _split_id(entry_id: Optional[str]) -> Tuple[int, str]:
+    """对外条目 ID 拆分为（子任务序号，Stream ID）；普通任务的 ID 不带序号，视为 0"""
+    if entry_id and ":" in entry_id:
+        part, _, stream_id = entry_id.partition(":")
+        try:
+            return int(part), stream_id
+        except ValueError:
+            return 0, stream_id
+    return 0, entry_id or ""
+
+
+def _id_key(entry_id: Optional[str]) -> Tuple[int, int, int]:
+    """对外条目 ID（[子任务序号:]毫秒-序号）转为可比较的元组"""
+    if not entry_id:
+        return (0, 0, 0)
+    part, stream_id = _split_id(entry_id)
+    ms, _, seq = stream_id.partition("-")
+    try:
+        return (part, int(ms), int(seq or 0))
+    except ValueError:
+        return (0, 0, 0)
+
+
+def _without_truncated(batch: List[Dict]) -> List[Dict]:
+    return [item for item in batch if item.get("event") != STREAM_EVENT_TRUNCATED]
+
+
+def _reset_item() -> Dict:
+    return {"id": None, "content": "", "event": STREAM_EVENT_RESET}
+
+
+def is_terminal(batch: List[Dict]) -> bool:
+    """批次中是否包含终止事件"""
+    return any(item.get("event") in TERMINAL_STREAM_EVENTS for item in batch)
+
+
+def meta_event(meta: Optional[Dict]) -> Optional[Dict]:
+    """元信息为终态时合成对应的事件条目，否则返回 None"""
+    if not meta:
+        return None
+    event = _META_STATUS_EVENTS.get(meta.get("status"))
+    if not event:
+        return None
+    return {"id": None, "content": "", "event": event, "message": meta.get("error_message", "")}
+
+
+class _StreamCursor:
+    """
+    任务的读取位置。普通任务只有主 Stream；分布式任务按序号依次读取各子任务 Stream，序号 parts 为主 Stream
+    读取位置只在 ID 仍存在时有效：truncate_stream 删除的条目（连同跨边界条目的旧 ID）不会再出现，
+    之后的内容以更大的 ID 追加，从被删 ID 继续读会把新内容接在已丢弃的内容后面，这种情况需从头读取（见 subscribe）
+    """
+
+    def __init__(self, task_id: str, parts: int = 0, part: int = 0, last_id: str = "0-0"):
+        self.task_id = task_id
+        self.parts = parts
+        self.part = min(part, parts)
+        self.last_id = last_id or "0-0"
+
+    @property
+    def stream_id(self) -> str:
+        if self.part < self.parts:
+            return part_stream_id(self.task_id, self.part)
+        return self.task_id
+
+    def consume(self, messages: List[Dict]) -> Tuple[List[Dict], bool]:
+        """
+        推进读取位置，返回（转为对外 ID 的条目，是否切换到了下一个 Stream）；
+        子任务的结束事件不下发，之后的条目（不应存在）一并丢弃
+        """
+        items = []
+        for message in messages:
+            self.last_id = message["id"]
+            if self.part < self.parts and message.get("event") == STREAM_EVENT_END:
+                self.part += 1
+                self.last_id = "0-0"
+                return items, True
+            if self.parts:
+                message = dict(message, id=f"{self.part}:{message['id']}")
+            items.append(message)
+        return items, False
+
+
+class _TaskChannel:
+    """单个任务的订阅通道"""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.ready = asyncio.Event()  # 读取起点已确定，订阅者可以读取历史
+        self.reader: Optional[asyncio.Task] = None
+
+
+class TaskStreamHub:
+    """任务 Stream 推送中心"""
+
+    def __init__(self, manager: AsyncRedisStreamManager = async_redis_stream_manager):
+        self.manager = manager
+        self._channels: Dict[str, _TaskChannel] = {}
+
+    def _get_channel(self, task_id: str) -> _TaskChannel:
+        channel = self._channels.get(task_id)
+        if channel is None:
+            channel = _TaskChannel(task_id)
+            self._channels[task_id] = channel
+            channel.reader = asyncio.create_task(self._read_loop(channel))
+        return channel
+
+    def _broadcast(self, channel: _TaskChannel, batch: List[Dict]) -> None:
+        for queue in channel.subscribers:
+            queue.put_nowait(batch)
+
+    async def _current_cursor(self, task_id: str, parts: int) -> _StreamCursor:
+        """当前最新位置：跳过已写入结束事件的子任务，停在正在写入的 Stream 的最新条目"""
+        cursor = _StreamCursor(task_id, parts)
+        while True:
+            latest = await self.manager.get_last_entry(cursor.stream_id)
+            if cursor.part < parts and latest and latest.get("event") == STREAM_EVENT_END:
+                cursor.part += 1
+                continue
+            cursor.last_id = latest["id"] if latest else "0-0"
+            return cursor
+
+    async def _read_new(self, cursor: _StreamCursor, block_ms: int) -> List[Dict]:
+        """从读取位置阻塞读取新条目，子任务结束时不阻塞地继续读取下一个 Stream"""
+        items: List[Dict] = []
+        while True:
+            messages = await self.manager.read_new_content(
+                cursor.stream_id, cursor.last_id, block_ms=0 if items else block_ms
+            )
+            if not messages:
+                return items
+            batch, advanced = cursor.consume(messages)
+            items += batch
+            if not advanced and len(messages) < 100:
+                return items
+
+    async def _read_backlog(self, cursor: _StreamCursor, from_start: bool) -> List[Dict]:
+        """读取位置之后的全部历史（依次跨越已结束的子任务 Stream）"""
+        items: List[Dict] = []
+        while True:
+            if from_start and cursor.last_id == "0-0":
+                messages = await self.manager.read_all_content(cursor.stream_id)
+            else:
+                messages = await self.manager.read_content_after(cursor.stream_id, cursor.last_id)
+            batch, advanced = cursor.consume(messages)
+            items += batch
+            if not advanced:
+                return items
+
+    async def _read_loop(self, channel: _TaskChannel) -> None:
+        """
+        读取协程：从当前最新位置开始阻塞读取并广播；
+        读到终止事件、元信息进入终态或没有订阅者时退出
+        """
+        task_id = channel.task_id
+        try:
+            meta = await self.manager.get_task_meta(task_id)
+            cursor = await self._current_cursor(task_id, (meta or {}).get("parts", 0))
+            channel.ready.set()
+            while channel.subscribers:
+                messages = await self._read_new(cursor, STREAM_READ_BLOCK_MS)
+                if messages:
+                    self._broadcast(channel, messages)
+                    if is_terminal(messages):
+                        return
+                    continue
+                # 阻塞超时：检查一次元信息，兼容未写事件条目的任务（如 Worker 被强制终止）
+                meta = await self.manager.get_task_meta(task_id)
+                event = meta_event(meta)
+                if event:
+                    # 终态之前写入的剩余内容先发出
+                    rest = await self._read_new(cursor, 0)
+                    self._broadcast(channel, rest + [event])
+                    return
+                if meta is None:
+                    # 任务信息不存在或 Redis 暂不可用，稍后重试，避免空转
+                    await asyncio.sleep(0.5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            mylog.error(f"[TaskStreamHub] 任务 {task_id} 读取失败: {e}")
+            self._broadcast(channel, [{"id": None, "content": "", "event": STREAM_EVENT_ERROR, "message": str(e)}])
+        finally:
+            channel.ready.set()
+            if self._channels.get(task_id) is channel:
+                del self._channels[task_id]
+
+    async def subscribe(self, task_id: str, last_id: Optional[str] = None) -> AsyncGenerator[List[Dict], None]:
+        """
+        订阅任务输出，按批次产出条目列表（最后一批包含终止事件）：
+        先登记订阅再读取历史（XRANGE），之后的推送按条目 ID 去重，保证不丢不重
+        - last_id: 客户端已收到的最后一个条目 ID（断线重连），只补发其后的条目
+        """
+        channel = self._get_channel(task_id)
+        queue: asyncio.Queue = asyncio.Queue()
+        channel.subscribers.add(queue)
+        try:
+            await channel.ready.wait()
+            # 先读元信息再读历史：元信息为终态时，终态之前写入的内容一定已在历史中
+            meta = await self.manager.get_task_meta(task_id)
+            parts = (meta or {}).get("parts", 0)
+            part, stream_id = _split_id(last_id)
+            cursor = _StreamCursor(task_id, parts, part, stream_id)
+            reset = False
+            if last_id and not await self.manager.has_entry(cursor.stream_id, cursor.last_id):
+                # 续传位置已被断点续写删除：客户端已有的内容含被丢弃的部分，从头回放
+                mylog.info(f"[TaskStreamHub] 任务 {task_id} 的续传位置 {last_id} 已不存在，从头回放")
+                cursor, reset = _StreamCursor(task_id, parts), True
+            backlog = await self._read_backlog(cursor, from_start=reset or not last_id)
+            last_key = _id_key(backlog[-1]["id"]) if backlog else _id_key(None if reset else last_id)
+            # 历史按当前 Stream 读取，本身是一致的，其中的截断标记不需要处理
+            backlog = _without_truncated(backlog)
+            if reset:
+                backlog = [_reset_item()] + backlog
+            if backlog:
+                yield backlog
+                if is_terminal(backlog):
+                    return
+            event = meta_event(meta)
+            if event:
+                yield [event]
+                return
+
+            while True:
+                batch = await queue.get()
+                batch = [item for item in batch if item["id"] is None or _id_key(item["id"]) > last_key]
+                if not batch:
+                    continue
+                if any(item.get("event") == STREAM_EVENT_TRUNCATED for item in batch):
+                    # 推送过程中任务从检查点重试，已推送的残留内容被删除：从头回放
+                    batch = await self._read_backlog(_StreamCursor(task_id, parts), from_start=True)
+                    if batch:
+                        last_key = _id_key(batch[-1]["id"])
+                    batch = [_reset_item()] + _without_truncated(batch)
+                for item in batch:
+                    if item["id"] is not None:
+                        last_key = max(last_key, _id_key(item["id"]))
+                batch = _without_truncated(batch)
+                if not batch:
+                    continue
+                yield batch
+                if is_terminal(batch):
+                    return
+        finally:
+            channel.subscribers.discard(queue)
+
+
+# 全局实例
+task_stream_hub = TaskStreamHub()
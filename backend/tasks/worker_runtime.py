@@ -0,0 +1,170 @@
+"""
+Celery Worker 异步运行时
+每个 Worker 子进程维护一个常驻事件循环（后台线程 run_forever），所有异步任务都提交到这个循环执行：
+- 数据库引擎在子进程内重建（不继承 fork 前的连接池），aiomysql 连接池在任务之间复用
+- 与事件循环绑定的客户端（如 ai.llm.http_pool 中各模型实例共享的异步 HTTP 客户端）不会因为循环关闭而失效
+- 任务协程的 Redis 读写走 async_redis_stream_manager 的 redis.asyncio 连接池，连接在本循环上建立并在任务之间复用，
+  不会以同步往返卡住同一循环上的其他任务；循环停止前关闭连接池
+通过 worker_process_init / worker_process_shutdown 信号挂接生命周期；未收到信号（如 solo、threads 池）时首次使用自动启动。
+
+asyncio 执行模式（ARTICLE_WORKER_MODE=asyncio）下 Celery 使用 threads 池，多个线程同时把任务协程提交到同一个循环，
+循环内用信号量限制同时执行的协程数；Worker 开始关闭后新收到的任务以 Reject(requeue=True) 退回队列。
+"""
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+from typing import Any, Coroutine, Optional
+
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutting_down, worker_shutdown
+
+import config
+from ai.llm.http_pool import llm_http_pool
+from tasks.redis_stream import async_redis_stream_manager
+from config import ARTICLE_WORKER_ASYNC_CONCURRENCY
+from utils.logger import mylog
+
+
+class WorkerRuntime:
+    """Worker 进程级事件循环"""
+
+    cancel_wait_seconds = 5  # run 被打断时等待协程处理取消的最长时间
+
+    def __init__(self, max_concurrency: int = ARTICLE_WORKER_ASYNC_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self.closing = False  # Worker 正在关闭，不再接收新任务
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def ensure_started(self) -> asyncio.AbstractEventLoop:
+        """启动（或在 fork 后的新进程中重新启动）事件循环，返回该循环"""
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return self._loop
+
+            # fork 继承来的循环线程在子进程中并不存在，直接丢弃重建
+            config.reset_db_engine()
+            # 连接池中可能残留属于旧循环 / 父进程的连接，丢弃后在新循环上重新建立
+            async_redis_stream_manager.pool.reset()
+            if sys.platform == 'win32':
+                asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._run_loop, args=(loop,), name="worker-asyncio-loop", daemon=True)
+            thread.start()
+            self._loop, self._thread, self._pid = loop, thread, os.getpid()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            mylog.info(f"[WorkerRuntime] 进程 {self._pid} 事件循环已启动")
+            return loop
+
+    async def _limited(
+        self, coro: Coroutine, slots: asyncio.Semaphore, timeout: Optional[float] = None,
+        finished: Optional[threading.Event] = None
+    ) -> Any:
+        try:
+            async with slots:
+                if timeout is None:
+                    return await coro
+                # 从占到槽位开始计时，排队等待槽位的时间不计入
+                task = asyncio.ensure_future(coro)
+                try:
+                    done, _ = await asyncio.wait({task}, timeout=timeout)
+                finally:
+                    if not task.done():
+                        # 超时或外层被取消：取消协程并等它退出
+                        task.cancel()
+                        await asyncio.wait({task})
+                if task.cancelled() and not done:
+                    raise concurrent.futures.TimeoutError()
+                return task.result()
+        finally:
+            # 排队期间被取消时协程从未启动，显式关闭避免 "never awaited" 告警
+            coro.close()
+            if finished is not None:
+                finished.set()
+
+    def submit(
+        self, coro: Coroutine, timeout: Optional[float] = None, finished: Optional[threading.Event] = None
+    ) -> concurrent.futures.Future:
+        """
+        把协程提交到常驻循环（受并发上限约束，占到槽位后最多执行 timeout 秒），返回线程安全的 Future；
+        finished 在协程退出（包括被取消后处理完毕）时置位
+        """
+        loop = self.ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._limited(coro, self._slots, timeout, finished), loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        在常驻循环中执行协程并同步等待结果，协程开始执行（占到槽位）timeout 秒后抛出 concurrent.futures.TimeoutError。
+        等待期间调用线程收到异常（如 SoftTimeLimitExceeded）时取消协程，最多等待 cancel_wait_seconds 秒让协程处理取消
+        （关闭模型流、归还数据库连接），再把异常抛给调用方，随后的重试或失败处理不会与仍在运行的协程交错。
+        """
+        finished = threading.Event()
+        future = self.submit(coro, timeout, finished)
+        try:
+            return future.result()
+        except BaseException:
+            if future.cancel() and not finished.wait(self.cancel_wait_seconds):
+                mylog.warning(f"[WorkerRuntime] 协程 {self.cancel_wait_seconds}s 内未处理完取消，继续抛出异常")
+            raise
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """释放数据库连接池、模型接口连接池、Redis 连接池并停止事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid():
+                return
+            self._loop, self._thread, self._pid, self._slots = None, None, None, None
+
+        try:
+            asyncio.run_coroutine_threadsafe(config.engine.dispose(), loop).result(timeout)
+        except Exception as e:
+            mylog.error(f"[WorkerRuntime] 释放数据库连接池失败: {e}")
+        try:
+            asyncio.run_coroutine_threadsafe(llm_http_pool.aclose(), loop).result(timeout)
+        except Exception as e:
+            mylog.error(f"[WorkerRuntime] 关闭模型接口连接池失败: {e}")
+        try:
+            asyncio.run_coroutine_threadsafe(async_redis_stream_manager.close(), loop).result(timeout)
+        except Exception as e:
+            mylog.error(f"[WorkerRuntime] 关闭 Redis 连接池失败: {e}")
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            if not loop.is_running():
+                loop.close()
+            mylog.info(f"[WorkerRuntime] 进程 {os.getpid()} 事件循环已停止")
+
+
+# 全局实例
+worker_runtime = WorkerRuntime()
+
+
+@worker_process_init.connect
+def _on_worker_process_init(**kwargs):
+    worker_runtime.ensure_started()
+
+
+@worker_process_shutdown.connect
+def _on_worker_process_shutdown(**kwargs):
+    worker_runtime.shutdown()
+
+
+@worker_shutting_down.connect
+def _on_worker_shutting_down(**kwargs):
+    # 热关闭：进行中的任务继续执行完，新收到的任务退回队列
+    worker_runtime.closing = True
+
+
+@worker_shutdown.connect
+def _on_worker_shutdown(**kwargs):
+    # threads / solo 池没有子进程关闭信号，在 Worker 退出时释放（prefork 主进程中未启动循环，直接返回）
+    worker_runtime.shutdown()
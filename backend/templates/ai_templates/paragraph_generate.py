@@ -1,7 +1,7 @@
 from langchain_core.prompts import PromptTemplate
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from services.prompt_config import get_prompt_by_type
+from services.prompt_config import PromptRegistry
 
 # 参考输出最大字符数限制（避免 token 超限）
 MAX_EXAMPLE_OUTPUT_CHARS = 3000
@@ -60,52 +60,38 @@ paragraph_generate_template_default = """## 角色
 async def get_paragraph_generate_prompt(db: Optional[AsyncSession] = None, example_output: Optional[str] = None) -> PromptTemplate:
     """
     从数据库获取文章生成提示词，如果数据库中没有则使用默认提示词。
+    提示词内容与解析后的模板均由 PromptRegistry 缓存，同一版本只查询、解析一次。
 
     Args:
         db: 数据库会话
         example_output: 可选的章节级示例输出内容
 
     Returns:
-        PromptTemplate: LangChain 提示词模板
+        PromptTemplate: LangChain 提示词模板（metadata 中带 prompt_version）
     """
-    import logging
-    logger = logging.getLogger(__name__)
-
-    prompt_content = paragraph_generate_template_default
-    prompt_source = "默认提示词(fallback)"
-
-    # 尝试从数据库读取
-    if db:
-        try:
-            prompt_config = await get_prompt_by_type(db, "paragraph_generate")
-            if prompt_config:
-                prompt_content = prompt_config.prompt_content
-                prompt_source = f"数据库(ID:{prompt_config.id})"
-            else:
-                logger.warning(f"⚠️ 数据库中未找到 paragraph_generate，使用默认")
-        except Exception as e:
-            logger.error(f"❌ 数据库读取失败: {str(e)}")
-
-    # 简化日志输出
-    logger.info(f"📝 [提示词] 来源: {prompt_source}, 长度: {len(prompt_content)}字符")
-
-    # 处理示例输出：和模板生成保持一致的注入策略，并应用截断避免 token 超限
+    prompt_content, prompt_version = await PromptRegistry.get_content(
+        db, "paragraph_generate", paragraph_generate_template_default
+    )
+    return PromptRegistry.get_template(
+        "paragraph_generate", prompt_version, example_output,
+        lambda: PromptTemplate.from_template(_inject_example_output(prompt_content, example_output))
+    )
+
+
+def _inject_example_output(prompt_content: str, example_output: Optional[str]) -> str:
+    """处理示例输出：和模板生成保持一致的注入策略，并应用截断避免 token 超限"""
     if example_output and str(example_output).strip():
         # 截断过长的参考输出
         truncated_output = truncate_example_output(str(example_output).strip())
         section = f"\n## 示例输出：\n{truncated_output}\n"
         if "{exampleOutput}" not in prompt_content:
             # 插到本章要求后面
-            prompt_content = prompt_content.replace(
+            return prompt_content.replace(
                 "##【本章要求】={requirements}",
                 f"##【本章要求】={{requirements}}{section}"
             )
-        else:
-            prompt_content = prompt_content.replace("{exampleOutput}", section)
-    else:
-        prompt_content = prompt_content.replace("{exampleOutput}", "")
-
-    return PromptTemplate.from_template(prompt_content)
+        return prompt_content.replace("{exampleOutput}", section)
+    return prompt_content.replace("{exampleOutput}", "")
 
 
 # 保持向后兼容：直接使用默认模板创建 PromptTemplate
@@ -1,7 +1,7 @@
 from langchain_core.prompts import PromptTemplate
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from services.prompt_config import get_prompt_by_type
+from services.prompt_config import PromptRegistry
 
 # 默认提示词模板（作为回退）
 template_generate_template_default = """
@@ -62,6 +62,7 @@ template_generate_template_default = """
 async def get_template_generate_prompt(db: Optional[AsyncSession] = None, example_output: Optional[str] = None) -> PromptTemplate:
     """
     从数据库获取模板生成提示词，如果数据库中没有则使用默认提示词。
+    提示词内容与解析后的模板均由 PromptRegistry 缓存。
     
     Args:
         db: 数据库会话
@@ -70,34 +71,28 @@ async def get_template_generate_prompt(db: Optional[AsyncSession] = None, exampl
     Returns:
         PromptTemplate: LangChain 提示词模板
     """
-    prompt_content = template_generate_template_default
-    
-    # 尝试从数据库读取
-    if db:
-        try:
-            prompt_config = await get_prompt_by_type(db, "template_generate")
-            if prompt_config:
-                prompt_content = prompt_config.prompt_content
-        except Exception:
-            # 如果读取失败，使用默认提示词
-            pass
-    
-    # 处理示例输出
+    prompt_content, prompt_version = await PromptRegistry.get_content(
+        db, "template_generate", template_generate_template_default
+    )
+    return PromptRegistry.get_template(
+        "template_generate", prompt_version, example_output,
+        lambda: PromptTemplate.from_template(_inject_example_output(prompt_content, example_output))
+    )
+
+
+def _inject_example_output(prompt_content: str, example_output: Optional[str]) -> str:
+    """处理示例输出"""
     if example_output and example_output.strip():
         example_section = f"\n## 示例输出：\n{example_output.strip()}\n"
         # 如果提示词中没有 {exampleOutput} 占位符，则在末尾添加示例部分
         if "{exampleOutput}" not in prompt_content:
-            prompt_content = prompt_content.replace(
+            return prompt_content.replace(
                 "## 文章要求：{writingRequirement}",
                 f"## 文章要求：{{writingRequirement}}{example_section}"
             )
-        else:
-            prompt_content = prompt_content.replace("{exampleOutput}", example_section)
-    else:
-        # 如果没有示例输出，移除占位符
-        prompt_content = prompt_content.replace("{exampleOutput}", "")
-    
-    return PromptTemplate.from_template(prompt_content)
+        return prompt_content.replace("{exampleOutput}", example_section)
+    # 如果没有示例输出，移除占位符
+    return prompt_content.replace("{exampleOutput}", "")
 
 
 # 保持向后兼容：直接使用默认模板创建 PromptTemplate
@@ -0,0 +1,57 @@
+"""
+AIMDLimiter 名额交还测试（无需 Redis / 网络）
+运行：cd backend && python -m unittest tests.test_adaptive_limit
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ai.llm.adaptive_limit import AIMDLimiter
+
+
+class AIMDLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_cancel_after_grant_releases_slot(self):
+        limiter = AIMDLimiter("test", initial=1, min_limit=1, max_limit=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.snapshot()["waiting"], 1)
+
+        # 释放后名额转给等待者（_resolve 已设置结果），等待者恢复运行前被取消
+        limiter.release()
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(limiter.snapshot(), {"limit": 1, "inflight": 0, "waiting": 0})
+
+        await asyncio.wait_for(limiter.acquire(), 1)
+        limiter.release()
+
+    async def test_cancel_while_queued_keeps_holder(self):
+        limiter = AIMDLimiter("test", initial=1, min_limit=1, max_limit=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(limiter.snapshot(), {"limit": 1, "inflight": 1, "waiting": 0})
+        limiter.release()
+        self.assertEqual(limiter.snapshot()["inflight"], 0)
+
+    async def test_acquire_sync_wait_is_bounded(self):
+        limiter = AIMDLimiter("test", initial=1, min_limit=1, max_limit=1)
+        await limiter.acquire()
+        self.assertFalse(limiter.acquire_sync(max_wait=0.05))
+        self.assertEqual(limiter.snapshot(), {"limit": 1, "inflight": 1, "waiting": 0})
+        limiter.release()
+        self.assertTrue(limiter.acquire_sync(max_wait=0.05))
+        limiter.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
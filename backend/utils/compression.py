@@ -0,0 +1,64 @@
+"""
+文本压缩
+生成结果以压缩形式保存时带上标记前缀，读取时按前缀识别；不带标记的旧数据原样返回，新旧数据可以混存。
+- compress_text / decompress_text：字符串形式（zlib + base64），用于 Redis
+- compress_blob / decompress_blob：二进制形式，用于数据库 BLOB 列；安装了 zstandard 时使用 zstd，否则使用 zlib
+"""
+import base64
+import zlib
+from typing import Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+# 标记前缀：zlib 压缩后 base64 编码（Redis 客户端按字符串读写，不能直接存二进制）
+COMPRESSED_TEXT_MARKER = "zlib:"
+
+
+def compress_text(text: Optional[str], level: int = 6) -> Optional[str]:
+    """压缩文本为带标记前缀的字符串；空值原样返回"""
+    if not text:
+        return text
+    packed = base64.b64encode(zlib.compress(text.encode("utf-8"), level)).decode("ascii")
+    return COMPRESSED_TEXT_MARKER + packed
+
+
+def decompress_text(value: Optional[str]) -> Optional[str]:
+    """还原 compress_text 的结果；不带标记的值（旧数据 / 未压缩）原样返回"""
+    if not value or not value.startswith(COMPRESSED_TEXT_MARKER):
+        return value
+    packed = value[len(COMPRESSED_TEXT_MARKER):]
+    return zlib.decompress(base64.b64decode(packed)).decode("utf-8")
+
+
+# 二进制格式标记：以 \x00 开头，UTF-8 文本不会以此开头，旧数据（未压缩的原文字节）可以直接识别
+ZSTD_BLOB_MARKER = b"\x00zs1"
+ZLIB_BLOB_MARKER = b"\x00zl1"
+# 小于该字节数的文本不压缩（压缩收益抵不过标记与帧头开销）
+BLOB_COMPRESS_MIN_BYTES = 256
+
+
+def compress_blob(text: str) -> bytes:
+    """文本压缩为带格式标记的字节串；短文本保存为原文字节"""
+    raw = text.encode("utf-8")
+    if len(raw) < BLOB_COMPRESS_MIN_BYTES:
+        return raw
+    if zstandard is not None:
+        return ZSTD_BLOB_MARKER + zstandard.ZstdCompressor(level=6).compress(raw)
+    return ZLIB_BLOB_MARKER + zlib.compress(raw, 6)
+
+
+def decompress_blob(data: Union[bytes, bytearray, memoryview, str]) -> str:
+    """还原 compress_blob 的结果；不带标记的值按 UTF-8 原文返回"""
+    if isinstance(data, str):
+        return data
+    data = bytes(data)
+    if data.startswith(ZSTD_BLOB_MARKER):
+        if zstandard is None:
+            raise RuntimeError("数据使用 zstd 压缩，需要安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data[len(ZSTD_BLOB_MARKER):]).decode("utf-8")
+    if data.startswith(ZLIB_BLOB_MARKER):
+        return zlib.decompress(data[len(ZLIB_BLOB_MARKER):]).decode("utf-8")
+    return data.decode("utf-8")
@@ -0,0 +1,69 @@
+"""
+滚动上下文窗口
+流式生成时逐 token 追加内容，按 token 预算截取尾部作为下一章节的上文，
+替代 `content += token` 后再 `content[-2000:]` 的字符串累加方式。
+"""
+from typing import List
+
+from utils.logger import mylog
+from utils.tools import get_token_encoding
+
+# 候选尾部的字符数 / token 预算比例：先按中文常见比例截取，不足预算时放宽到英文上界（cl100k 约 4 字符/token）
+_CHARS_PER_TOKEN_STEPS = (2, 4)
+
+
+class ContextWindow:
+    """
+    有界的滚动上下文窗口：
+    - append 摊还 O(1)：只追加分片，累计超过 2 倍保留量时才合并、丢弃旧内容，内存不随文章长度增长
+    - tail(max_tokens) 只对尾部少量文本做编码，返回不超过 token 预算的尾部文本
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.max_chars = max(1, max_tokens) * _CHARS_PER_TOKEN_STEPS[-1]
+        self._chunks: List[str] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return min(self._size, self.max_chars)
+
+    def append(self, text: str) -> None:
+        if not text:
+            return
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size > 2 * self.max_chars:
+            self._compact()
+
+    def _compact(self) -> None:
+        kept = "".join(self._chunks)[-self.max_chars:]
+        self._chunks = [kept]
+        self._size = len(kept)
+
+    def text(self) -> str:
+        """窗口内保留的全部文本（最多 max_chars 个字符）"""
+        return "".join(self._chunks)[-self.max_chars:]
+
+    def tail(self, max_tokens: int = None) -> str:
+        """返回不超过 max_tokens 个 token 的尾部文本"""
+        max_tokens = self.max_tokens if max_tokens is None else min(max_tokens, self.max_tokens)
+        if max_tokens <= 0 or not self._chunks:
+            return ""
+        self._compact()
+        retained = self._chunks[0]
+        try:
+            encoding = get_token_encoding()
+        except Exception as e:
+            # 编码表无法加载（如离线环境）时按 1 字符≈1 token 保守截取，不影响生成主流程
+            mylog.warning(f"[ContextWindow] tiktoken 编码器不可用，按字符截取: {e}")
+            return retained[-max_tokens:]
+        for ratio in _CHARS_PER_TOKEN_STEPS:
+            text = retained[-max_tokens * ratio:]
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) > max_tokens:
+                # 截断点可能落在多字节字符中间，去掉解码产生的替换字符
+                return encoding.decode(tokens[-max_tokens:]).lstrip("\ufffd")
+            if len(text) == len(retained):
+                break
+        return text
@@ -0,0 +1,88 @@
+"""
+流式分片合并
+大模型按 token 产出的分片很小，逐片写 Redis / 推 SSE 帧开销远大于内容本身。
+这里在生产者与写出端之间加一层缓冲：累计满 max_chars 个字符、或距缓冲区第一个分片超过 interval_ms 毫秒时合并刷出，
+上游长时间无输出时也会按时刷出，感知延迟不超过刷新间隔。
+"""
+import asyncio
+import contextlib
+from typing import AsyncIterable, AsyncGenerator, List, Optional
+
+from config import STREAM_FLUSH_INTERVAL_MS, STREAM_FLUSH_MAX_CHARS
+
+
+async def coalesce_stream(
+    source: AsyncIterable[str],
+    interval_ms: Optional[int] = None,
+    max_chars: Optional[int] = None
+) -> AsyncGenerator[str, None]:
+    """
+    按时间/大小合并流式文本分片
+    - interval_ms: 最长缓冲时间（毫秒），缺省取配置 STREAM_FLUSH_INTERVAL_MS；<=0 表示不合并，逐片透传
+    - max_chars: 缓冲字符数上限，缺省取配置 STREAM_FLUSH_MAX_CHARS
+    - 上游结束或抛出异常时先刷出已缓冲内容，异常继续向上抛出
+    """
+    interval = (STREAM_FLUSH_INTERVAL_MS if interval_ms is None else interval_ms) / 1000
+    limit = STREAM_FLUSH_MAX_CHARS if max_chars is None else max_chars
+
+    if interval <= 0:
+        async for piece in source:
+            if piece:
+                yield piece
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    buffer: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+    # 预取下一个分片：等待期间计时器仍可触发刷出
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 上游暂无新分片，到期刷出
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                deadline = None
+                continue
+
+            future, pending = pending, None
+            try:
+                piece = future.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if buffer:
+                    yield "".join(buffer)
+                    buffer.clear()
+                raise
+
+            if not piece:
+                continue
+            buffer.append(piece)
+            size += len(piece)
+            if deadline is None:
+                deadline = loop.time() + interval
+            if size >= limit or loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                deadline = None
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await pending
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            with contextlib.suppress(Exception):
+                await aclose()
@@ -1,6 +1,7 @@
 # -*- coding:utf-8 -*-
 import os
 import re
+from functools import lru_cache
 
 import tiktoken
 from docx import Document
@@ -11,9 +12,14 @@ from io import BytesIO
 import requests
 import json
 
+#获取 tiktoken 编码器（进程内复用）
+@lru_cache(maxsize=1)
+def get_token_encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
 #计算gpt4使用的tokens
 def compute_gpt_tokens(example_string: str):
-    encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_token_encoding()
     token_integers = encoding.encode(example_string)
     num_tokens = len(token_integers)
     return num_tokens